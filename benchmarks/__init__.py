@@ -0,0 +1,8 @@
+"""
+Benchmark suite for the SmartNotes storage backends.
+
+Generates deterministic synthetic notebooks (``corpus``), measures latency
+percentiles and peak memory of the storage operations on them (``runner``)
+and compares a run with a stored JSON baseline (``compare``). Run it from
+the repository root with ``python -m benchmarks``.
+"""
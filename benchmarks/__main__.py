@@ -0,0 +1,168 @@
+"""
+Command line for the SmartNotes benchmarks:
+
+    python -m benchmarks run --sizes 1k 10k --output results.json
+    python -m benchmarks compare results.json
+    python -m benchmarks generate 100k --backend sqlite --path /tmp/notes.sqlite3
+    python -m benchmarks stress --processes 8 --threads 4 --notes 25
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from smartnotes.storage import BACKENDS, open_storage
+
+from .compare import DEFAULT_THRESHOLD, compare, is_regression, load_results, over_budget, report, save_results
+from .corpus import DEFAULT_SEED, SIZES, Corpus, fill, parse_size
+from .runner import DEFAULT_REPEAT, OPERATIONS, run_suite
+from .stress import DEFAULT_NOTES, DEFAULT_PROCESSES, DEFAULT_THREADS, STRESS_BACKENDS, render_stress, run_stress
+
+BASELINE_FILE = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_SIZES = ["1k", "10k"]
+
+
+def size_label(value: str) -> str:
+    try:
+        parse_size(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from None
+    return value.lower()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="benchmarks", description="Бенчмарки сховищ SmartNotes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Виміряти затримки та памʼять")
+    run_parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=size_label,
+        default=DEFAULT_SIZES,
+        help=f"Розміри корпусу: {', '.join(SIZES)} або число (типово: {' '.join(DEFAULT_SIZES)})",
+    )
+    run_parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    run_parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Вимірювань на операцію")
+    run_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    run_parser.add_argument("--workdir", type=Path, help="Де створювати сховища (типово: тимчасовий каталог)")
+    run_parser.add_argument("--output", type=Path, help="Записати результати в JSON")
+    run_parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help=f"Записати результати як базові ({BASELINE_FILE.name})",
+    )
+    run_parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Порівняти з базовими результатами (код виходу 1 при регресії)",
+    )
+    add_threshold_argument(run_parser)
+
+    compare_parser = subparsers.add_parser("compare", help="Порівняти результати з базовими")
+    compare_parser.add_argument("results", type=Path)
+    compare_parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    compare_parser.add_argument("--verbose", action="store_true", help="Показати й незмінені метрики")
+    add_threshold_argument(compare_parser)
+
+    generate_parser = subparsers.add_parser("generate", help="Заповнити сховище синтетичними нотатками")
+    generate_parser.add_argument("size", type=size_label)
+    generate_parser.add_argument("--backend", choices=BACKENDS, required=True)
+    generate_parser.add_argument("--path", type=Path, required=True)
+    generate_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+
+    stress_parser = subparsers.add_parser("stress", help="Паралельні записи з багатьох процесів без втрат")
+    stress_parser.add_argument("--backends", nargs="+", choices=STRESS_BACKENDS, default=list(STRESS_BACKENDS))
+    stress_parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES, help="Процесів-записувачів")
+    stress_parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="Потоків у кожному процесі")
+    stress_parser.add_argument("--notes", type=int, default=DEFAULT_NOTES, help="Нотаток від кожного потоку")
+    stress_parser.add_argument("--workdir", type=Path, help="Де створювати сховища (типово: тимчасовий каталог)")
+    return parser
+
+
+def add_threshold_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"Допустиме погіршення, частка (типово: {DEFAULT_THRESHOLD})",
+    )
+
+
+def render_table(results: dict) -> str:
+    lines = [f"{'measurement':<32} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10} {'peak KiB':>10}"]
+    for key, summary in results["results"].items():
+        lines.append(
+            f"{key:<32} {summary['p50_ms']:>10.3f} {summary['p90_ms']:>10.3f} "
+            f"{summary['p99_ms']:>10.3f} {summary['max_ms']:>10.3f} {summary['peak_kib']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def check(baseline_path: Path, current: dict, threshold: float, verbose: bool = False) -> int:
+    baseline = load_results(baseline_path)
+    for line in report(baseline, current, threshold, verbose):
+        print(line)
+    regressions = [change for change in compare(baseline, current) if is_regression(change, threshold)]
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%} against {baseline_path}")
+    return 1 if regressions else 0
+
+
+def check_budgets(results: dict) -> int:
+    lines = over_budget(results)
+    for line in lines:
+        print(line)
+    return 1 if lines else 0
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    if args.command == "run":
+        if args.repeat < 1:
+            raise SystemExit("--repeat must be at least 1")
+        results = run_suite(args.backends, args.sizes, args.repeat, args.seed, args.operations, args.workdir)
+        print(render_table(results))
+        if args.output:
+            save_results(results, args.output)
+        status = check_budgets(results)
+        if args.compare:
+            status = check(BASELINE_FILE, results, args.threshold) or status
+        if args.save_baseline:
+            save_results(results, BASELINE_FILE)
+        sys.exit(status)
+    if args.command == "compare":
+        results = load_results(args.results)
+        status = check(args.baseline, results, args.threshold, args.verbose)
+        sys.exit(check_budgets(results) or status)
+    if args.command == "stress":
+        if min(args.processes, args.threads, args.notes) < 1:
+            raise SystemExit("--processes, --threads and --notes must be at least 1")
+        results = [
+            run_stress(backend, args.processes, args.threads, args.notes, args.workdir) for backend in args.backends
+        ]
+        print(render_stress(results))
+        failed = [
+            result
+            for result in results
+            if result["lost"] or not result["sequence_ok"] or not result["batch_ok"] or not result["search_ok"]
+        ]
+        for result in failed:
+            if result["lost"]:
+                print(f"{result['backend']}: lost {len(result['lost'])} note(s), e.g. {result['lost'][0]!r}")
+            if not result["sequence_ok"]:
+                print(f"{result['backend']}: sequence differs from changes_since(0).seq after local writes")
+            if not result["batch_ok"]:
+                print(f"{result['backend']}: writers in other processes waited for an open batch() or lost notes")
+            if not result["search_ok"]:
+                print(f"{result['backend']}: search splits words differently from index.TOKEN_RE")
+        sys.exit(1 if failed else 0)
+    with open_storage(args.backend, args.path) as storage:
+        count = fill(storage, Corpus(args.seed), parse_size(args.size))
+    print(f"{count} notes -> {args.path}")
+
+
+if __name__ == "__main__":
+    main()
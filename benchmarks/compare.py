@@ -0,0 +1,110 @@
+"""
+Compare a benchmark run against a stored baseline.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import List, NamedTuple
+
+from .corpus import parse_size
+
+# Metrics judged for regressions, with the smallest absolute change that
+# counts: sub-50µs differences on fast operations are timer noise.
+COMPARED_METRICS = {"p50_ms": 0.05, "p90_ms": 0.05, "peak_kib": 64.0}
+DEFAULT_THRESHOLD = 0.25
+# Absolute p90 limits in ms for interactive operations, whatever the baseline:
+# a fuzzy search is typed into the GUI, so it must stay well under a keystroke
+# pause on notebooks of up to BUDGET_MAX_NOTES.
+LATENCY_BUDGETS = {"search_fuzzy": 50.0}
+BUDGET_MAX_NOTES = 100_000
+
+
+class Change(NamedTuple):
+    key: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float("inf")
+
+
+def load_results(path: Path) -> dict:
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_results(results: dict, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(baseline: dict, current: dict) -> List[Change]:
+    """Every compared metric of the measurements both runs have, baseline first."""
+    changes = []
+    for key, before in sorted(baseline["results"].items()):
+        after = current["results"].get(key)
+        if after is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric in before and metric in after:
+                changes.append(Change(key, metric, before[metric], after[metric]))
+    return changes
+
+
+def is_regression(change: Change, threshold: float = DEFAULT_THRESHOLD) -> bool:
+    return (
+        change.current > change.baseline * (1 + threshold)
+        and change.current - change.baseline > COMPARED_METRICS[change.metric]
+    )
+
+
+def is_improvement(change: Change, threshold: float = DEFAULT_THRESHOLD) -> bool:
+    return (
+        change.current < change.baseline / (1 + threshold)
+        and change.baseline - change.current > COMPARED_METRICS[change.metric]
+    )
+
+
+def report(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD, verbose: bool = False) -> List[str]:
+    """Human-readable comparison lines; regressions are marked ``REGRESSION``."""
+    lines = []
+    if baseline.get("environment") != current.get("environment"):
+        lines.append("! the runs come from different environments; timings are not directly comparable")
+    if (baseline.get("seed"), baseline.get("repeat")) != (current.get("seed"), current.get("repeat")):
+        lines.append("! the runs used a different seed or repeat count")
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    if missing:
+        lines.append(f"! not measured in this run: {', '.join(missing)}")
+    for change in compare(baseline, current):
+        if is_regression(change, threshold):
+            mark = "REGRESSION"
+        elif is_improvement(change, threshold):
+            mark = "improved"
+        elif verbose:
+            mark = "ok"
+        else:
+            continue
+        lines.append(
+            f"{mark:<10} {change.key:<32} {change.metric:<8} "
+            f"{change.baseline:>12.3f} -> {change.current:>12.3f}  (x{change.ratio:.2f})"
+        )
+    return lines
+
+
+def over_budget(results: dict) -> List[str]:
+    """Measurements whose p90 exceeds their ``LATENCY_BUDGETS`` entry."""
+    lines = []
+    for key, summary in sorted(results["results"].items()):
+        _, size, operation = key.split("/")
+        budget = LATENCY_BUDGETS.get(operation)
+        if budget is None or parse_size(size) > BUDGET_MAX_NOTES:
+            continue
+        if summary["p90_ms"] > budget:
+            lines.append(f"{'OVER':<10} {key:<32} p90_ms   {summary['p90_ms']:>12.3f} > budget {budget:.1f}")
+    return lines
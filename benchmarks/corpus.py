@@ -0,0 +1,133 @@
+"""
+Deterministic synthetic notebooks for the benchmarks.
+
+The same ``(count, seed)`` always yields the same notes, so runs on
+different commits measure identical data. Text mixes Ukrainian and Latin
+words with a Zipf-like frequency (a few very common words, a long tail),
+and tags follow the same shape: a handful of tags are on a large share of
+the notes, most are rare.
+"""
+
+from __future__ import annotations
+
+import random
+import uuid
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+from typing import Iterator, List, Sequence
+
+from smartnotes.storage import BaseNoteStorage, Note
+
+DEFAULT_SEED = 4
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+_CYRILLIC_WORDS = (
+    "звіт лаба лекція конспект завдання дедлайн екзамен проєкт модуль тест "
+    "алгоритм структура дані база запит індекс пошук сортування граф дерево "
+    "масив список черга стек функція клас обʼєкт метод інтерфейс сервер "
+    "клієнт мережа протокол безпека шифр ключ пароль файл каталог диск "
+    "памʼять процесор потік процес ядро система налаштування помилка виправлення "
+    "документація презентація семінар практика курсова диплом оцінка бал рейтинг"
+).split()
+_LATIN_WORDS = (
+    "report deadline exam project module test algorithm data query index search "
+    "sort graph tree array list queue stack function class object method server "
+    "client network protocol security cipher key file directory cache thread "
+    "process kernel config error fix docs slides seminar review sprint backlog "
+    "kanban commit branch merge python sqlite json latency throughput benchmark"
+).split()
+_CYRILLIC_SYLLABLES = "ба ве ги до ку ла мі но пе ра со ти фу ха це ча ше юн ят ів ор ан ель ук".split()
+_LATIN_SYLLABLES = "ba ce di fo gu ka le mi no pa re si to vu xa ze ul or an en th st".split()
+
+VOCABULARY_SIZE = 5_000
+TAG_COUNT = 200
+# Spread of created_at values, ending at a fixed date so runs match.
+_DATE_END = datetime(2025, 12, 1)
+_DATE_SPAN = timedelta(days=730)
+
+
+def parse_size(label: str) -> int:
+    """``"10k"`` -> 10000; plain integers are accepted too."""
+    label = label.lower()
+    if label in SIZES:
+        return SIZES[label]
+    try:
+        return int(label)
+    except ValueError:
+        raise ValueError(f"Unknown corpus size: {label!r} (expected one of {', '.join(SIZES)} or a number)") from None
+
+
+def _invent(rng: random.Random, syllables: Sequence[str]) -> str:
+    return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+
+
+def _zipf_cum_weights(count: int) -> List[float]:
+    # Cumulative, so random.choices bisects instead of summing on every call.
+    return list(accumulate(1 / rank for rank in range(1, count + 1)))
+
+
+class Corpus:
+    """Vocabulary and tag pool for one seed, plus a note generator over them."""
+
+    def __init__(self, seed: int = DEFAULT_SEED) -> None:
+        self.seed = seed
+        rng = random.Random(seed)
+        words = list(_CYRILLIC_WORDS) + list(_LATIN_WORDS)
+        seen = set(words)
+        while len(words) < VOCABULARY_SIZE:
+            # Alternate scripts so the long tail is mixed too.
+            word = _invent(rng, _CYRILLIC_SYLLABLES if len(words) % 2 else _LATIN_SYLLABLES)
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        rng.shuffle(words)
+        self.words = words
+        self.tags = [f"{rng.choice(words)}-{i}" for i in range(TAG_COUNT)]
+        self._word_weights = _zipf_cum_weights(len(self.words))
+        self._tag_weights = _zipf_cum_weights(len(self.tags))
+
+    def sample_words(self, rng: random.Random, k: int) -> List[str]:
+        return rng.choices(self.words, cum_weights=self._word_weights, k=k)
+
+    def sample_tags(self, rng: random.Random, k: int) -> List[str]:
+        # Sampled with the note distribution, so popular tags are queried more.
+        return list(dict.fromkeys(rng.choices(self.tags, cum_weights=self._tag_weights, k=k)))
+
+    def misspell(self, rng: random.Random, word: str) -> str:
+        """``word`` with one typo (two letters swapped, one dropped or doubled) after its first letter."""
+        if len(word) < 4:
+            return word
+        i = rng.randrange(1, len(word) - 1)
+        typo = rng.choice(("swap", "drop", "double"))
+        if typo == "swap":
+            return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        if typo == "drop":
+            return word[:i] + word[i + 1:]
+        return word[:i] + word[i] + word[i:]
+
+    def notes(self, count: int) -> Iterator[Note]:
+        """``count`` notes with unique titles, 0-4 tags and 8-40 word bodies."""
+        rng = random.Random(f"{self.seed}:notes")
+        span = int(_DATE_SPAN.total_seconds())
+        for i in range(count):
+            title = " ".join(self.sample_words(rng, rng.randint(2, 5))).capitalize()
+            yield Note(
+                id=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                # The number keeps titles unique, as storage requires.
+                title=f"{title} #{i}",
+                body=" ".join(self.sample_words(rng, rng.randint(8, 40))),
+                tags=self.sample_tags(rng, rng.randint(0, 4)),
+                created_at=(_DATE_END - timedelta(seconds=rng.randrange(span))).isoformat(timespec="seconds"),
+            )
+
+
+def fill(storage: BaseNoteStorage, corpus: Corpus, count: int, batch_size: int = 10_000) -> int:
+    """Import ``count`` corpus notes into ``storage`` with a single commit."""
+    notes = corpus.notes(count)
+    total = 0
+    with storage.batch():
+        while True:
+            batch = list(islice(notes, batch_size))
+            if not batch:
+                return total
+            total += storage.import_notes(batch)
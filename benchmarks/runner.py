@@ -0,0 +1,229 @@
+"""
+Latency and memory measurements for one backend over one synthetic notebook.
+"""
+
+from __future__ import annotations
+
+import gc
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from smartnotes.storage import BaseNoteStorage, open_storage
+
+from .corpus import DEFAULT_SEED, Corpus, fill, parse_size
+
+OPERATIONS = (
+    "cold_start",
+    "list_notes_tag",
+    "search",
+    "search_top",
+    "search_fuzzy",
+    "add_note",
+    "update_note",
+    "delete",
+)
+DEFAULT_REPEAT = 30
+# Opening a store re-reads everything, so cold start is sampled less often.
+COLD_START_REPEAT = 6
+STORE_FILES = {
+    "json": "notes.json",
+    "log": "notes.json",
+    "sqlite": "notes.sqlite3",
+    "binary": "notes.snb",
+    # A directory: manifest.json plus the shard files.
+    "sharded": "shards",
+}
+
+
+def percentile(sorted_samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, round(pct / 100 * len(sorted_samples)))
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def summarize(samples: List[float], peak_bytes: int) -> Dict[str, float]:
+    """Percentiles in milliseconds and the traced peak in KiB."""
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 4),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 4),
+        "p90_ms": round(percentile(ordered, 90) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+        "peak_kib": round(peak_bytes / 1024, 1),
+    }
+
+
+def measure(calls: Sequence[Callable[[], object]]) -> Dict[str, float]:
+    """Time every call but the last, which runs under tracemalloc for the peak.
+
+    Tracing slows allocation-heavy code several times over, so it is kept out of
+    the timed samples. The peak covers Python allocations only; memory SQLite
+    allocates in C is not seen.
+    """
+    if len(calls) < 2:
+        raise ValueError("measure needs at least two calls")
+    samples: List[float] = []
+    gc.collect()
+    for call in calls[:-1]:
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        calls[-1]()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return summarize(samples, peak)
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+class Workload:
+    """One backend filled with one corpus size, measured operation by operation."""
+
+    def __init__(
+        self,
+        backend: str,
+        size: str,
+        workdir: Path,
+        corpus: Corpus,
+        repeat: int = DEFAULT_REPEAT,
+        log: Callable[[str], None] = lambda message: None,
+    ) -> None:
+        self.backend = backend
+        self.size = size
+        self.count = parse_size(size)
+        self.path = workdir / f"{backend}-{size}" / STORE_FILES[backend]
+        self.corpus = corpus
+        self.repeat = repeat
+        self.log = log
+        # Per workload, so adding a backend or size does not shift the others' queries.
+        self.rng = random.Random(f"{corpus.seed}:{backend}:{size}")
+
+    def open(self) -> BaseNoteStorage:
+        return open_storage(self.backend, self.path)
+
+    def prepare(self) -> float:
+        """Create the store and import the corpus; returns the seconds it took."""
+        # A store left in --workdir by an earlier run would already hold this
+        # run's benchmark titles.
+        if self.path.parent.exists():
+            shutil.rmtree(self.path.parent)
+        self.path.parent.mkdir(parents=True)
+        start = time.perf_counter()
+        with self.open() as storage:
+            fill(storage, self.corpus, self.count)
+        return time.perf_counter() - start
+
+    def run(self, operations: Iterable[str] = OPERATIONS) -> Dict[str, Dict[str, float]]:
+        wanted = set(operations)
+        results: Dict[str, Dict[str, float]] = {}
+        self.log(f"{self.backend}/{self.size}: importing {self.count} notes")
+        self.log(f"{self.backend}/{self.size}: imported in {self.prepare():.1f}s")
+        if "cold_start" in wanted:
+            results["cold_start"] = measure([self._cold_start()] * min(self.repeat + 1, COLD_START_REPEAT))
+        with self.open() as storage:
+            # Warm the caches and indexes once, as a long-running GUI or server has them.
+            storage.list_notes(limit=1)
+            storage.search(self.corpus.words[0], limit=1)
+            storage.search(self.corpus.words[0], mode="fuzzy", limit=1)
+            ids = [note.id for note in storage.iter_notes()]
+            for name, calls in self._operations(storage, ids):
+                if name in wanted:
+                    self.log(f"{self.backend}/{self.size}: {name}")
+                    results[name] = measure(calls)
+        return results
+
+    def _cold_start(self) -> Callable[[], object]:
+        def call() -> object:
+            # A fresh instance has empty caches: this is what a CLI start pays.
+            with self.open() as storage:
+                return storage.list_notes(limit=20)
+
+        return call
+
+    def _operations(self, storage: BaseNoteStorage, ids: List[str]) -> List[Tuple[str, List[Callable[[], object]]]]:
+        """Call lists per operation: ``repeat`` timed calls plus one traced for memory."""
+        rng = self.rng
+        repeat = self.repeat
+        tags = [self.corpus.sample_tags(rng, 1)[0] for _ in range(repeat + 1)]
+        words = [self.corpus.sample_words(rng, 1)[0] for _ in range(repeat + 1)]
+        queries = [" ".join(self.corpus.sample_words(rng, 2)) for _ in range(repeat + 1)]
+        # Fuzzy search only forgives typos in words of four letters or more.
+        long_words = [word for word in self.corpus.words if len(word) >= 4]
+        typos = [self.corpus.misspell(rng, rng.choice(long_words)) for _ in range(repeat + 1)]
+        # Reads come first and deletes last, so every operation sees the full corpus.
+        victims = rng.sample(ids, min(len(ids), 2 * (repeat + 1)))
+        updated, deleted = victims[: repeat + 1], victims[repeat + 1 :]
+        run_id = rng.getrandbits(32)
+        return [
+            ("list_notes_tag", [lambda tag=tag: storage.list_notes(tag=tag) for tag in tags]),
+            ("search", [lambda word=word: storage.search(word) for word in words]),
+            # The first page of a ranked two-word query, as the CLI and GUI ask for it.
+            ("search_top", [lambda query=query: storage.search(query, limit=20) for query in queries]),
+            ("search_fuzzy", [lambda typo=typo: storage.search(typo, mode="fuzzy", limit=20) for typo in typos]),
+            (
+                "add_note",
+                [
+                    lambda i=i: storage.add_note(f"Benchmark {run_id} #{i}", " ".join(words), tags[:2])
+                    for i in range(repeat + 1)
+                ],
+            ),
+            (
+                "update_note",
+                [
+                    lambda note_id=note_id, i=i: storage.update_note(note_id, f"Updated {run_id} #{i}", "оновлено", tags[:1])
+                    for i, note_id in enumerate(updated)
+                ],
+            ),
+            ("delete", [lambda note_id=note_id: storage.delete(note_id) for note_id in deleted]),
+        ]
+
+
+def run_suite(
+    backends: Iterable[str],
+    sizes: Iterable[str],
+    repeat: int = DEFAULT_REPEAT,
+    seed: int = DEFAULT_SEED,
+    operations: Iterable[str] = OPERATIONS,
+    workdir: Optional[Path] = None,
+    log: Callable[[str], None] = lambda message: print(message, file=sys.stderr),
+) -> dict:
+    """Measure every backend at every size; results are keyed ``backend/size/operation``."""
+    corpus = Corpus(seed)
+    operations = list(operations)
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory(prefix="smartnotes-bench-") as tmp:
+        base = workdir or Path(tmp)
+        for size in sizes:
+            for backend in backends:
+                workload = Workload(backend, size, base, corpus, repeat, log)
+                for name, summary in workload.run(operations).items():
+                    results[f"{backend}/{size}/{name}"] = summary
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "seed": seed,
+        "repeat": repeat,
+        "environment": environment(),
+        "results": results,
+    }
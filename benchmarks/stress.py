@@ -0,0 +1,156 @@
+"""
+Concurrent-writer stress test: many processes, each with several threads,
+add notes to one store at once; afterwards every note must be there. Each
+run also checks that a store's ``sequence`` agrees with its change feed,
+that writers in other processes are not held up by a ``batch()`` left open,
+and that search splits words the same way on every backend.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from smartnotes.storage import open_storage
+
+from .runner import STORE_FILES
+
+STRESS_BACKENDS = ("json", "log", "sqlite", "binary", "sharded")
+DEFAULT_PROCESSES = 8
+DEFAULT_THREADS = 4
+DEFAULT_NOTES = 25
+BATCH_WRITERS = 2
+BATCH_WAIT_SECONDS = 30.0
+
+
+def _title(process: int, thread: int, i: int) -> str:
+    return f"stress {process}-{thread}-{i}"
+
+
+def _writer(backend: str, path: str, process: int, threads: int, notes: int) -> None:
+    """One writer process: ``threads`` threads sharing a storage, ``notes`` adds each."""
+    with open_storage(backend, Path(path)) as storage:
+
+        def add(thread: int) -> None:
+            for i in range(notes):
+                storage.add_note(_title(process, thread, i), f"body {process} {thread} {i}", ["stress"])
+
+        workers = [threading.Thread(target=add, args=(thread,)) for thread in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+
+def check_sequence(backend: str, path: Path) -> bool:
+    """Whether ``sequence`` matches ``changes_since(0).seq`` after writes through one instance."""
+    with open_storage(backend, path) as storage:
+        note = storage.add_note("sequence check", "body", [])
+        storage.update_note(note.id, note.title, "changed", [])
+        storage.delete(storage.add_note("sequence check 2", "body", []).id)
+        return storage.sequence == storage.changes_since(0).seq
+
+
+def check_search(backend: str, path: Path) -> bool:
+    """Whether search finds words as ``index.TOKEN_RE`` splits them: apostrophes
+    only inside a word, underscores part of it."""
+    with open_storage(backend, path) as storage:
+        quoted = storage.add_note("search check 1", "'quoted' word", [])
+        snake = storage.add_note("search check 2", "snake_case name", [])
+        elided = storage.add_note("search check 3", "п'ять ‘слів’", [])
+        expected = {
+            "quoted": [quoted.id],
+            "word": [quoted.id],
+            "snake_case": [snake.id],
+            "case": [],
+            "п'ять": [elided.id],
+            "слів": [elided.id],
+        }
+        return all([note.id for note in storage.search(query)] == ids for query, ids in expected.items())
+
+
+def check_open_batch(backend: str, path: Path, notes: int = DEFAULT_NOTES) -> bool:
+    """Whether writer processes finish while this one holds a ``batch()`` open,
+    and their notes and the batch's all end up in the store."""
+    open_storage(backend, path).close()
+    # Spawned, so the writers inherit no file descriptor (and no lock) of ours.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(BATCH_WRITERS, mp_context=context) as pool:
+        with open_storage(backend, path) as storage:
+            with storage.batch():
+                storage.add_note("batch 0", "body", ["batch"])
+                futures = [pool.submit(_writer, backend, str(path), p, 1, notes) for p in range(BATCH_WRITERS)]
+                finished = not wait(futures, timeout=BATCH_WAIT_SECONDS).not_done
+                storage.add_note("batch 1", "body", ["batch"])
+        for future in futures:
+            future.result()
+    with open_storage(backend, path) as storage:
+        titles = {note.title for note in storage.list_notes()}
+    expected = {"batch 0", "batch 1"} | {_title(p, 0, i) for p in range(BATCH_WRITERS) for i in range(notes)}
+    return finished and expected <= titles
+
+
+def run_stress(
+    backend: str,
+    processes: int = DEFAULT_PROCESSES,
+    threads: int = DEFAULT_THREADS,
+    notes: int = DEFAULT_NOTES,
+    workdir: Optional[Path] = None,
+) -> Dict[str, object]:
+    """Run the writers against a fresh store and count what they left in it."""
+    root = Path(tempfile.mkdtemp(prefix="smartnotes-stress-", dir=workdir))
+    try:
+        path = root / STORE_FILES[backend]
+        # Created up front, so the writers only ever open an existing store.
+        open_storage(backend, path).close()
+        started = time.perf_counter()
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(_writer, backend, str(path), p, threads, notes) for p in range(processes)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+        with open_storage(backend, path) as storage:
+            titles = {note.title for note in storage.list_notes()}
+        sequence_ok = check_sequence(backend, root / f"sequence-{STORE_FILES[backend]}")
+        batch_ok = check_open_batch(backend, root / f"batch-{STORE_FILES[backend]}", notes)
+        search_ok = check_search(backend, root / f"search-{STORE_FILES[backend]}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    expected = {
+        _title(p, t, i) for p in range(processes) for t in range(threads) for i in range(notes)
+    }
+    lost: List[str] = sorted(expected - titles)
+    return {
+        "backend": backend,
+        "writers": processes * threads,
+        "expected": len(expected),
+        "stored": len(titles),
+        "lost": lost,
+        "seconds": round(elapsed, 3),
+        "notes_per_second": round(len(expected) / max(elapsed, 1e-9), 1),
+        "sequence_ok": sequence_ok,
+        "batch_ok": batch_ok,
+        "search_ok": search_ok,
+    }
+
+
+def render_stress(results: Sequence[Dict[str, object]]) -> str:
+    lines = [
+        f"{'backend':<10} {'writers':>8} {'expected':>9} {'stored':>8} {'lost':>6} {'seconds':>9} {'notes/s':>9}"
+        f" {'sequence':>9} {'batch':>6} {'search':>7}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['backend']:<10} {result['writers']:>8} {result['expected']:>9} {result['stored']:>8} "
+            f"{len(result['lost']):>6} {result['seconds']:>9.3f} {result['notes_per_second']:>9.1f}"
+            f" {'ok' if result['sequence_ok'] else 'MISMATCH':>9}"
+            f" {'ok' if result['batch_ok'] else 'FAIL':>6}"
+            f" {'ok' if result['search_ok'] else 'FAIL':>7}"
+        )
+    return "\n".join(lines)
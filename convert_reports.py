@@ -1,48 +1,271 @@
 """
 Utility script to convert all lab*_report.html files into PDF using Playwright.
+
+Only reports whose HTML or linked local files (images, stylesheets) changed
+since their PDF was made are converted again; the content hashes are kept in
+``.reports-manifest.json`` next to the reports. Stale reports are rendered
+concurrently, one browser page per job:
+
+    python convert_reports.py --jobs 4
+    python convert_reports.py --force      # convert everything again
 """
 
 from __future__ import annotations
 
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from abc import ABC, abstractmethod
+from html.parser import HTMLParser
 from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import unquote, urlsplit
+
+MANIFEST_NAME = ".reports-manifest.json"
+# Part of every hash: bump it when PDF_OPTIONS change so all reports are redone.
+RENDER_VERSION = 1
+PDF_OPTIONS = {
+    "format": "A4",
+    "print_background": True,
+    "margin": {"top": "15mm", "bottom": "15mm", "left": "15mm", "right": "15mm"},
+}
+DEFAULT_JOBS = min(4, os.cpu_count() or 1)
+_CSS_URL_RE = re.compile(r"""url\(\s*['"]?([^'")]+)['"]?\s*\)""")
+
+
+class Renderer(ABC):
+    """Turns one HTML file into a PDF; up to ``jobs`` renders run at once.
+
+    ``PlaywrightRenderer`` is the real one; tests can pass any subclass to
+    ``convert_reports`` to run without a browser.
+    """
+
+    async def start(self, jobs: int) -> None:
+        """Get ready for ``jobs`` concurrent ``render`` calls."""
+
+    @abstractmethod
+    async def render(self, html_file: Path, output_pdf: Path) -> None:
+        ...
+
+    async def close(self) -> None:
+        """Release whatever ``start`` acquired."""
+
+
+class PlaywrightRenderer(Renderer):
+    """Headless Chromium with a pool of pages, each in its own browser context."""
+
+    def __init__(self) -> None:
+        self._playwright = None
+        self._browser = None
+        self._pages: Optional[asyncio.Queue] = None
+
+    async def start(self, jobs: int) -> None:
+        try:
+            from playwright.async_api import async_playwright
+        except ImportError as exc:  # pragma: no cover
+            raise SystemExit(
+                "Playwright is required. Install it via 'pip install playwright' "
+                "and run 'playwright install chromium'."
+            ) from exc
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        self._pages = asyncio.Queue()
+        for _ in range(jobs):
+            context = await self._browser.new_context()
+            self._pages.put_nowait(await context.new_page())
+
+    async def render(self, html_file: Path, output_pdf: Path) -> None:
+        page = await self._pages.get()
+        try:
+            await page.goto(html_file.resolve().as_uri())
+            await page.pdf(path=str(output_pdf), **PDF_OPTIONS)
+        finally:
+            self._pages.put_nowait(page)
+
+    async def close(self) -> None:
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.links: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        for name, value in attrs:
+            if value and name in ("src", "href"):
+                self.links.append(value)
+            elif value and name == "style":
+                self.links.extend(_CSS_URL_RE.findall(value))
+
+    def handle_data(self, data: str) -> None:
+        # <style> contents arrive as data; url(...) elsewhere is harmless.
+        self.links.extend(_CSS_URL_RE.findall(data))
+
+
+def linked_files(html_file: Path, text: str) -> List[Path]:
+    """Local files the report refers to (existing or not), sorted and without repeats."""
+    parser = _LinkParser()
+    parser.feed(text)
+    files = set()
+    for link in parser.links:
+        url = urlsplit(link)
+        if url.scheme not in ("", "file") or url.netloc or not url.path:
+            continue
+        files.add((html_file.parent / unquote(url.path)).resolve())
+    return sorted(files)
 
-try:
-    from playwright.sync_api import sync_playwright
-except ImportError as exc:  # pragma: no cover
-    raise SystemExit(
-        "Playwright is required. Install it via 'pip install playwright' "
-        "and run 'playwright install chromium'."
-    ) from exc
 
+def report_hash(html_file: Path) -> str:
+    """Hash of the report, the render settings and every local file it links to."""
+    data = html_file.read_bytes()
+    digest = hashlib.sha256(f"{RENDER_VERSION}\0".encode())
+    digest.update(data)
+    for path in linked_files(html_file, data.decode("utf-8", errors="replace")):
+        digest.update(f"\0{path}\0".encode())
+        # A missing image still counts, so adding it later triggers a rebuild.
+        digest.update(path.read_bytes() if path.is_file() else b"<missing>")
+    return digest.hexdigest()
 
-def convert_reports(base_dir: Path) -> None:
+
+def load_manifest(path: Path) -> Dict[str, str]:
+    """Report name -> hash of its last converted version; empty if unreadable."""
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest(path: Path, manifest: Dict[str, str]) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+class Conversion(NamedTuple):
+    name: str
+    # "converted", "unchanged" or "failed".
+    status: str
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+async def _convert(stale: List[Path], renderer: Renderer, jobs: int) -> List[Conversion]:
+    queue = list(reversed(stale))
+    done: List[Conversion] = []
+
+    async def worker() -> None:
+        while queue:
+            html_file = queue.pop()
+            output_pdf = html_file.with_suffix(".pdf")
+            print(f"Converting {html_file.name} -> {output_pdf.name}")
+            started = time.perf_counter()
+            try:
+                await renderer.render(html_file, output_pdf)
+            except Exception as exc:  # reported in the summary, the other reports go on
+                done.append(Conversion(html_file.name, "failed", time.perf_counter() - started, str(exc)))
+            else:
+                done.append(Conversion(html_file.name, "converted", time.perf_counter() - started))
+
+    await renderer.start(jobs)
+    try:
+        await asyncio.gather(*(worker() for _ in range(jobs)))
+    finally:
+        await renderer.close()
+    return done
+
+
+def convert_reports(
+    base_dir: Path,
+    jobs: int = DEFAULT_JOBS,
+    force: bool = False,
+    renderer: Optional[Renderer] = None,
+) -> List[Conversion]:
+    """Convert the stale ``lab*_report.html`` files in ``base_dir``, ``jobs`` at a time.
+
+    A report is stale if its PDF is missing or its ``report_hash`` differs from
+    the manifest's (always, with ``force``). The manifest records only reports
+    that converted successfully. Returns one ``Conversion`` per report, in name
+    order.
+    """
     html_files = sorted(base_dir.glob("lab*_report.html"))
     if not html_files:
         print("No lab*_report.html files found.")
-        return
+        return []
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
-        for html_file in html_files:
-            output_pdf = html_file.with_suffix(".pdf")
-            print(f"Converting {html_file.name} -> {output_pdf.name}")
-            page.goto(html_file.resolve().as_uri())
-            page.pdf(
-                path=str(output_pdf),
-                format="A4",
-                print_background=True,
-                margin={"top": "15mm", "bottom": "15mm", "left": "15mm", "right": "15mm"},
-            )
-        browser.close()
+    manifest_path = base_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    hashes = {html_file.name: report_hash(html_file) for html_file in html_files}
+    stale = [
+        html_file
+        for html_file in html_files
+        if force
+        or manifest.get(html_file.name) != hashes[html_file.name]
+        or not html_file.with_suffix(".pdf").exists()
+    ]
+    results = {html_file.name: Conversion(html_file.name, "unchanged") for html_file in html_files}
+    if stale:
+        jobs = max(1, min(jobs, len(stale)))
+        for conversion in asyncio.run(_convert(stale, renderer or PlaywrightRenderer(), jobs)):
+            results[conversion.name] = conversion
+            if conversion.status == "converted":
+                manifest[conversion.name] = hashes[conversion.name]
+            else:
+                # The old PDF may be half overwritten; convert it next time.
+                manifest.pop(conversion.name, None)
+        # Reports deleted since the last run drop out of the manifest.
+        save_manifest(manifest_path, {name: manifest[name] for name in hashes if name in manifest})
+    return [results[html_file.name] for html_file in html_files]
+
+
+def render_summary(conversions: List[Conversion], elapsed: float, jobs: int) -> str:
+    lines = []
+    for conversion in conversions:
+        line = f"{conversion.name:<24} {conversion.status:<10}"
+        if conversion.status != "unchanged":
+            line += f" {conversion.seconds:>7.2f} s"
+        if conversion.error:
+            line += f"  {conversion.error}"
+        lines.append(line)
+    counts = {status: sum(c.status == status for c in conversions) for status in ("converted", "unchanged", "failed")}
+    lines.append(
+        f"{counts['converted']} converted, {counts['unchanged']} unchanged, {counts['failed']} failed "
+        f"in {elapsed:.2f} s (jobs: {jobs})"
+    )
+    return "\n".join(lines)
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert lab*_report.html files into PDF.")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Reports rendered at once (default: {DEFAULT_JOBS})",
+    )
+    parser.add_argument("--force", action="store_true", help="Convert every report, even unchanged ones")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
     base_dir = Path(__file__).resolve().parent
-    convert_reports(base_dir)
+    started = time.perf_counter()
+    conversions = convert_reports(base_dir, args.jobs, args.force)
+    if conversions:
+        print(render_summary(conversions, time.perf_counter() - started, args.jobs))
+    sys.exit(1 if any(conversion.status == "failed" for conversion in conversions) else 0)
 
 
 if __name__ == "__main__":
     main()
-
-
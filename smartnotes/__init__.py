@@ -4,8 +4,28 @@ SmartNotes package initializer.
 This module exposes high-level helpers for convenient imports.
 """
 
-from .storage import NoteStorage, Note
+from typing import Any
 
-__all__ = ["NoteStorage", "Note"]
 
+# The names in __all__ are re-exported from .storage on first access, so
+# importing a submodule such as smartnotes.app does not load every storage
+# backend up front.
+def __getattr__(name: str) -> Any:
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from . import storage
+
+    value = getattr(storage, name)
+    globals()[name] = value
+    return value
+
+
+__all__ = [
+    "AsyncNoteStorage",
+    "DuplicateTitleError",
+    "NoteStorage",
+    "Note",
+    "SqliteNoteStorage",
+    "open_storage",
+]
 
@@ -5,13 +5,49 @@ Command-line interface for SmartNotes.
 from __future__ import annotations
 
 import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
 from textwrap import dedent
+from typing import TYPE_CHECKING, Optional, Type, Union
 
-from .storage import NoteStorage
+from .query import QueryError, parse_query
+from .storage import BACKENDS, SORT_ORDERS, CorruptStorageError, DuplicateTitleError, open_storage
+from .storage.config import SERVER_ENV, SERVER_FILE
+from .transfer import FORMATS
 
+if TYPE_CHECKING:
+    from .client import NotesClient
+    from .storage import BaseNoteStorage, Note
 
-def build_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(
+# Commands that change notes; batch/shell count them for --commit-every.
+WRITE_COMMANDS = {"add", "update", "delete", "import", "reindex"}
+# Commands that make no sense inside a batch/shell session.
+SESSION_EXCLUDED = {"batch", "shell", "migrate", "reshard"}
+
+
+class CommandError(Exception):
+    """A batch/shell line that does not parse as a command."""
+
+
+class SessionParser(argparse.ArgumentParser):
+    """Parser for batch/shell lines: reports errors instead of exiting."""
+
+    def error(self, message: str) -> None:
+        raise CommandError(message)
+
+    def exit(self, status: int = 0, message: Optional[str] = None) -> None:
+        # --help inside a session prints the help and carries on.
+        if message:
+            print(message, file=sys.stderr)
+        raise CommandError("")
+
+
+def build_parser(parser_class: Type[argparse.ArgumentParser] = argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser = parser_class(
         prog="smartnotes",
         description="Мінімальний CLI для створення та пошуку нотаток.",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -20,11 +56,45 @@ def build_parser() -> argparse.ArgumentParser:
             Приклади:
               python -m smartnotes.app add --title "Лаба" --body "Завершити звіт" --tags uni urgent
               python -m smartnotes.app list --tag uni
+              python -m smartnotes.app list --tag uni --tag urgent --any
+              python -m smartnotes.app list --limit 20 --after-id <id>
+              python -m smartnotes.app list --sort date_desc --limit 20
               python -m smartnotes.app search "звіт"
+              python -m smartnotes.app search '"лабораторна робота" tag:uni -чернетка after:2025-09' --limit 10
+              python -m smartnotes.app search "лабораторан" --fuzzy
+              python -m smartnotes.app search "звіт" --full
+              python -m smartnotes.app update <id> --title "Лаба 4" --tags uni
               python -m smartnotes.app delete <id>
+              python -m smartnotes.app reindex
+              python -m smartnotes.app migrate --from json --to sqlite
+              python -m smartnotes.app migrate --from json --to sharded
+              python -m smartnotes.app reshard --shards 16
+              python -m smartnotes.app reshard --by month
+              python -m smartnotes.app import notes.jsonl
+              python -m smartnotes.app export backup.csv
+              python -m smartnotes.app batch commands.txt --commit-every 100
+              python -m smartnotes.app shell
+              python -m smartnotes.app --stats search "звіт"
+              python -m smartnotes.app --profile list.prof list
             """
         ),
     )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        help="Сховище нотаток (типово: $SMARTNOTES_BACKEND, data/config.json або json)",
+    )
+    parser.add_argument(
+        "--server",
+        help="Адреса запущеного smartnotes.server (типово: $SMARTNOTES_SERVER або data/server.json)",
+    )
+    parser.add_argument("--local", action="store_true", help="Працювати з файлами напряму, без сервера")
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Після команди вивести час операцій сховища та лічильники (у stderr)",
+    )
+    parser.add_argument("--profile", metavar="PATH", help="Записати профіль cProfile команди у файл")
 
     subparsers = parser.add_subparsers(dest="command", required=True)
 
@@ -33,48 +103,496 @@ def build_parser() -> argparse.ArgumentParser:
     add_parser.add_argument("--body", required=True)
     add_parser.add_argument("--tags", nargs="*", default=[])
 
+    update_parser = subparsers.add_parser("update", help="Змінити нотатку за ID")
+    update_parser.add_argument("note_id")
+    update_parser.add_argument("--title", help="Новий заголовок")
+    update_parser.add_argument("--body", help="Новий текст")
+    update_parser.add_argument("--tags", nargs="*", help="Нові теги (замість наявних)")
+
     list_parser = subparsers.add_parser("list", help="Вивести всі нотатки")
-    list_parser.add_argument("--tag", help="Фільтр за тегом")
+    list_parser.add_argument(
+        "--tag",
+        dest="tags",
+        action="append",
+        default=[],
+        help="Фільтр за тегом (можна кілька: нотатка має мати всі)",
+    )
+    list_parser.add_argument("--any", action="store_true", help="Досить будь-якого з тегів --tag")
+
+    add_pagination_arguments(list_parser)
 
-    search_parser = subparsers.add_parser("search", help="Пошук за ключовим словом")
-    search_parser.add_argument("keyword")
+    subparsers.add_parser("tags", help="Вивести теги з кількістю нотаток")
+
+    search_parser = subparsers.add_parser(
+        "search",
+        help="Пошук: слова, \"фрази\", tag:, after:/before:, -виключення",
+    )
+    search_parser.add_argument(
+        "query",
+        help='Запит, напр. \'звіт "лабораторна робота" tag:uni -чернетка after:2025-09-01\'',
+    )
+    search_mode = search_parser.add_mutually_exclusive_group()
+    search_mode.add_argument(
+        "--substring",
+        action="store_true",
+        help="Шукати підрядок повним переглядом замість індексу",
+    )
+    search_mode.add_argument(
+        "--fuzzy",
+        action="store_true",
+        help="Знаходити слова й з одруківками (1 помилка від 4 літер, 2 — від 8)",
+    )
+    search_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Виводити текст нотаток повністю, а не уривок навколо збігу",
+    )
+    add_pagination_arguments(search_parser, "спочатку найрелевантніші")
+
+    subparsers.add_parser("reindex", help="Перебудувати пошуковий індекс")
+
+    migrate_parser = subparsers.add_parser("migrate", help="Скопіювати нотатки в інше сховище")
+    migrate_parser.add_argument("--from", dest="source", choices=BACKENDS, help="Звідки (типово: поточне сховище)")
+    migrate_parser.add_argument("--to", dest="target", choices=BACKENDS, required=True, help="Куди")
+    migrate_parser.add_argument("--from-path", type=Path, help="Файл джерела, якщо не типовий")
+    migrate_parser.add_argument("--to-path", type=Path, help="Файл призначення, якщо не типовий")
+    migrate_parser.add_argument("--batch-size", type=int, default=500)
+
+    reshard_parser = subparsers.add_parser("reshard", help="Перерозподілити нотатки шардованого сховища")
+    reshard_parser.add_argument("--shards", type=int, help="Кількість шардів для --by hash (типово: як зараз)")
+    # Literal choices: importing SHARD_SCHEMES would load the sharded backend on every start.
+    reshard_parser.add_argument(
+        "--by",
+        dest="scheme",
+        choices=("hash", "month"),
+        help="hash — за id, month — за місяцем створення (типово: як зараз)",
+    )
+    reshard_parser.add_argument("--path", type=Path, help="Каталог сховища, якщо не типовий")
+
+    import_parser = subparsers.add_parser("import", help="Імпортувати нотатки з JSONL/CSV")
+    import_parser.add_argument("path", type=Path, help="Файл (або - для stdin)")
+    import_parser.add_argument("--format", choices=FORMATS, help="Типово — за розширенням файлу")
+    import_parser.add_argument("--batch-size", type=int, default=1000)
+
+    export_parser = subparsers.add_parser("export", help="Експортувати нотатки в JSONL/CSV")
+    export_parser.add_argument("path", type=Path, help="Файл (або - для stdout)")
+    export_parser.add_argument("--format", choices=FORMATS, help="Типово — за розширенням файлу")
+    export_parser.add_argument("--batch-size", type=int, default=1000)
 
     delete_parser = subparsers.add_parser("delete", help="Видалити нотатку за ID")
     delete_parser.add_argument("note_id")
 
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="Виконати команди з файлу або stdin (по одній на рядок), результати — JSON Lines",
+    )
+    batch_parser.add_argument("path", nargs="?", type=Path, default=Path("-"), help="Файл команд (типово stdin)")
+    add_commit_argument(batch_parser)
+
+    shell_parser = subparsers.add_parser("shell", help="Інтерактивний режим")
+    add_commit_argument(shell_parser)
+
     return parser
 
 
-def render_notes(notes):
-    if not notes:
-        print("Нотаток не знайдено.")
-        return
+def add_pagination_arguments(parser: argparse.ArgumentParser, default_order: str = "порядок додавання") -> None:
+    parser.add_argument("--limit", type=int, help="Скільки нотаток вивести")
+    parser.add_argument("--offset", type=int, default=0, help="Скільки нотаток пропустити")
+    parser.add_argument("--after-id", help="Почати після нотатки з цим ID (курсор наступної сторінки)")
+    parser.add_argument(
+        "--sort",
+        choices=SORT_ORDERS,
+        help=f"Порядок: за датою або назвою (типово — {default_order})",
+    )
+
+
+def search_mode(args: argparse.Namespace) -> str:
+    if args.substring:
+        return "substring"
+    return "fuzzy" if args.fuzzy else "index"
+
+
+def add_commit_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--commit-every",
+        type=int,
+        metavar="N",
+        help="Зберігати зміни кожні N команд (типово — один раз у кінці)",
+    )
+
+
+def render_notes(notes, limit=None, snippets=None):
+    """Print notes in full, or with ``snippets`` (note id -> text) in place of their bodies."""
+    shown = 0
+    last_id = None
     for note in notes:
         header = f"[{note.id}] {note.title} ({', '.join(note.tags) or 'без тегів'})"
         print(header)
         print("-" * len(header))
-        print(note.body)
+        print(note.body if snippets is None else snippets[note.id])
         print(f"Створено: {note.created_at}")
         print()
+        shown += 1
+        last_id = note.id
+    if not shown:
+        print("Нотаток не знайдено.")
+    elif limit is not None and shown == limit:
+        print(f"Наступна сторінка: --after-id {last_id}")
+
+
+def migrate(args: argparse.Namespace) -> None:
+    started = time.perf_counter()
+    copied = 0
+    with open_storage(args.source or args.backend, args.from_path) as source, \
+            open_storage(args.target, args.to_path) as target, target.batch():
+        for batch in source.export_batches(args.batch_size):
+            # Copy as-is: older notebooks may already hold duplicate titles.
+            copied += target.import_notes(batch, unique_titles=False)
+            print(f"… скопійовано {copied} нотаток", flush=True)
+    elapsed = time.perf_counter() - started
+    print(f"✅ Міграцію завершено: {copied} нотаток за {elapsed:.1f} с.")
+
+
+def reshard(args: argparse.Namespace) -> None:
+    started = time.perf_counter()
+    try:
+        with open_storage("sharded", args.path) as storage:
+            moved = storage.reshard(args.shards, args.scheme)
+            layout = storage.scheme if storage.scheme == "month" else f"{storage.scheme} × {storage.shard_count}"
+    except ValueError as exc:
+        print(f"⚠️  {exc}", file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - started
+    print(f"✅ Перерозподілено {moved} нотаток ({layout}) за {elapsed:.1f} с.")
+
+
+def report_progress(label: str, counts) -> int:
+    """Consume per-batch counts, printing running totals and throughput to stderr."""
+    started = time.perf_counter()
+    total = 0
+    for count in counts:
+        total += count
+        rate = total / max(time.perf_counter() - started, 1e-9)
+        print(f"… {label}: {total} нотаток ({rate:.0f} нот./с)", file=sys.stderr, flush=True)
+    elapsed = time.perf_counter() - started
+    print(f"✅ {label}: {total} нотаток за {elapsed:.1f} с.", file=sys.stderr)
+    return total
+
+
+def duplicate_message(exc: DuplicateTitleError) -> str:
+    return f"Нотатка з заголовком «{exc.title.strip()}» вже існує: {exc.existing_id}"
+
+
+def render_stats(stats: dict) -> str:
+    lines = ["📊 Статистика сховища:"]
+    for section, title in (("operations", "операції"), ("timers", "етапи")):
+        if stats[section]:
+            lines.append(f"  {title}:")
+        for name, timing in stats[section].items():
+            lines.append(
+                f"    {name:<16} {timing['calls']:>6} × {timing['mean_ms']:>9.3f} мс"
+                f" = {timing['total_ms']:>10.3f} мс (макс. {timing['max_ms']:.3f} мс)"
+            )
+    if stats["counters"]:
+        lines.append("  лічильники: " + ", ".join(f"{name}={value}" for name, value in stats["counters"].items()))
+    return "\n".join(lines)
 
 
 def main() -> None:
-    storage = NoteStorage()
-    parser = build_parser()
-    args = parser.parse_args()
+    args = build_parser().parse_args()
+    if args.profile is None:
+        execute(args)
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(execute, args)
+    finally:
+        profiler.dump_stats(args.profile)
+        print(f"Профіль записано в {args.profile} (python -m pstats {args.profile})", file=sys.stderr)
+
+
+def execute(args: argparse.Namespace) -> None:
+    if args.command == "migrate":
+        migrate(args)
+        return
+    if args.command == "reshard":
+        reshard(args)
+        return
+    storage = connect(args)
+    try:
+        if args.command == "batch":
+            failed = run_batch(args, storage)
+            sys.exit(1 if failed else 0)
+        elif args.command == "shell":
+            run_shell(args, storage)
+        else:
+            run_command(args, storage)
+    except DuplicateTitleError as exc:
+        print(f"⚠️  {duplicate_message(exc)}", file=sys.stderr)
+        sys.exit(1)
+    except QueryError as exc:
+        print(f"⚠️  Невірний запит: {exc}", file=sys.stderr)
+        sys.exit(1)
+    except CorruptStorageError as exc:
+        print(f"⚠️  Файл сховища пошкоджено, його не змінено: {exc}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.stats:
+            # Deferred commits are written out first, so they are counted too.
+            storage.commit()
+            print(render_stats(storage.stats()), file=sys.stderr)
+        storage.close()
+
+
+def connect(args: argparse.Namespace) -> Union[BaseNoteStorage, NotesClient]:
+    """The running server if there is one (and no backend was asked for), else local storage."""
+    if args.local or (args.backend and not args.server):
+        return open_storage(args.backend)
+    # Only look for a server (and load the HTTP client) if one may be running.
+    if args.server or os.environ.get(SERVER_ENV) or SERVER_FILE.exists():
+        from .client import discover_server
+
+        client = discover_server(args.server)
+        if client is not None:
+            return client
+    if args.server:
+        print(f"⚠️  Сервер {args.server} недоступний.", file=sys.stderr)
+        sys.exit(1)
+    return open_storage(args.backend)
+
+
+def update_from_args(args: argparse.Namespace, storage: Union[BaseNoteStorage, NotesClient]) -> Optional[Note]:
+    """Apply ``update``: fields not given keep their stored values."""
+    note = storage.get_note(args.note_id)
+    if note is None:
+        return None
+    return storage.update_note(
+        note.id,
+        note.title if args.title is None else args.title,
+        note.body if args.body is None else args.body,
+        note.tags if args.tags is None else args.tags,
+    )
+
+
+def import_counts(args: argparse.Namespace, storage: Union[BaseNoteStorage, NotesClient]):
+    from .transfer import guess_format, read_batches
+
+    batches = read_batches(args.path, guess_format(args.path, args.format), args.batch_size)
+    return (storage.import_notes(batch) for batch in batches)
+
 
+def export_counts(args: argparse.Namespace, storage: Union[BaseNoteStorage, NotesClient]):
+    from .transfer import guess_format, write_batches
+
+    fmt = guess_format(args.path, args.format)
+    return write_batches(args.path, fmt, storage.export_batches(args.batch_size))
+
+
+def run_command(args: argparse.Namespace, storage: Union[BaseNoteStorage, NotesClient]) -> None:
     if args.command == "add":
         note = storage.add_note(args.title, args.body, args.tags)
         print(f"✅ Створено нотатку {note.id}")
+    elif args.command == "update":
+        if update_from_args(args, storage) is None:
+            print("⚠️  Нотатку не знайдено.")
+        else:
+            print("✏️  Нотатку оновлено.")
     elif args.command == "list":
-        render_notes(storage.list_notes(tag=args.tag))
+        notes = storage.iter_notes(
+            tags=args.tags,
+            match_any=args.any,
+            limit=args.limit,
+            offset=args.offset,
+            after_id=args.after_id,
+            sort=args.sort,
+        )
+        render_notes(notes, args.limit)
+    elif args.command == "tags":
+        counts = storage.tags()
+        if not counts:
+            print("Тегів ще немає.")
+        for tag, count in counts.items():
+            print(f"{tag}: {count}")
     elif args.command == "search":
-        render_notes(storage.search(args.keyword))
+        mode = search_mode(args)
+        if mode != "substring":
+            # Report a malformed query before touching storage or the server.
+            parse_query(args.query)
+        search = storage.iter_search if args.full else storage.search_hits
+        results = search(
+            args.query,
+            mode=mode,
+            limit=args.limit,
+            offset=args.offset,
+            after_id=args.after_id,
+            sort=args.sort,
+        )
+        if args.full:
+            render_notes(results, args.limit)
+        else:
+            render_notes([hit.note for hit in results], args.limit, {hit.note.id: hit.snippet for hit in results})
     elif args.command == "delete":
         if storage.delete(args.note_id):
             print("🗑️  Нотатку видалено.")
         else:
             print("⚠️  Нотатку не знайдено.")
+    elif args.command == "reindex":
+        count = storage.rebuild_index()
+        print(f"🔎 Індекс перебудовано: {count} нотаток.")
+    elif args.command == "import":
+        report_progress("імпортовано", import_counts(args, storage))
+    elif args.command == "export":
+        report_progress("експортовано", export_counts(args, storage))
+
+
+def command_result(args: argparse.Namespace, storage: Union[BaseNoteStorage, NotesClient]) -> dict:
+    """Run one command for ``batch`` and return its outcome as a JSON-ready dict."""
+    if args.command == "add":
+        return {"note": asdict(storage.add_note(args.title, args.body, args.tags))}
+    if args.command == "update":
+        note = update_from_args(args, storage)
+        return {"note": None if note is None else asdict(note)}
+    if args.command in ("list", "search"):
+        if args.command == "list":
+            notes = storage.list_notes(
+                tags=args.tags,
+                match_any=args.any,
+                limit=args.limit,
+                offset=args.offset,
+                after_id=args.after_id,
+                sort=args.sort,
+            )
+        else:
+            notes = storage.search(
+                args.query,
+                mode=search_mode(args),
+                limit=args.limit,
+                offset=args.offset,
+                after_id=args.after_id,
+                sort=args.sort,
+            )
+        result = {"notes": [asdict(note) for note in notes]}
+        if args.limit is not None and notes and len(notes) == args.limit:
+            result["next_after_id"] = notes[-1].id
+        return result
+    if args.command == "tags":
+        return {"tags": storage.tags()}
+    if args.command == "delete":
+        return {"deleted": storage.delete(args.note_id)}
+    if args.command == "reindex":
+        return {"count": storage.rebuild_index()}
+    if args.command == "import":
+        return {"count": sum(import_counts(args, storage))}
+    return {"count": sum(export_counts(args, storage))}
+
+
+def parse_session_line(parser: argparse.ArgumentParser, line: str) -> argparse.Namespace:
+    import shlex
+
+    try:
+        tokens = shlex.split(line)
+    except ValueError as exc:
+        raise CommandError(str(exc)) from None
+    args = parser.parse_args(tokens)
+    if args.command in SESSION_EXCLUDED:
+        raise CommandError(f"команда {args.command} недоступна в цьому режимі")
+    return args
+
+
+class CommitCounter:
+    """Calls ``storage.commit()`` after every ``every`` write commands (never if None)."""
+
+    def __init__(self, storage: Union[BaseNoteStorage, NotesClient], every: Optional[int]) -> None:
+        self.storage = storage
+        self.every = every
+        self.pending = 0
+
+    def record(self, command: str) -> None:
+        if command not in WRITE_COMMANDS:
+            return
+        self.pending += 1
+        if self.every and self.pending >= self.every:
+            self.storage.commit()
+            self.pending = 0
+
+
+def run_batch(args: argparse.Namespace, storage: Union[BaseNoteStorage, NotesClient]) -> int:
+    """Run one command per input line, printing a JSON result per line; returns the failure count.
+
+    All commands share the open storage, which commits once at the end (or
+    every ``--commit-every`` write commands, or at a ``commit`` line).
+    """
+    parser = build_parser(SessionParser)
+    counter = CommitCounter(storage, args.commit_every)
+    failed = 0
+    source = sys.stdin if str(args.path) == "-" else args.path.open("r", encoding="utf-8")
+    try:
+        with storage.batch():
+            for number, line in enumerate(source, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                result: dict = {"line": number}
+                try:
+                    if line == "commit":
+                        storage.commit()
+                        counter.pending = 0
+                        result.update(command="commit", ok=True)
+                    else:
+                        command = parse_session_line(parser, line)
+                        result.update(command=command.command, ok=True, **command_result(command, storage))
+                        counter.record(command.command)
+                except DuplicateTitleError as exc:
+                    result.update(ok=False, error=duplicate_message(exc), existing_id=exc.existing_id)
+                except (CommandError, ValueError, OSError) as exc:
+                    result.update(ok=False, error=str(exc) or "некоректна команда")
+                failed += not result["ok"]
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return failed
+
+
+def run_shell(args: argparse.Namespace, storage: Union[BaseNoteStorage, NotesClient]) -> None:
+    """Interactive prompt running CLI commands against one open storage."""
+    try:
+        import readline  # noqa: F401  (line editing and history where available)
+    except ImportError:
+        pass
+    parser = build_parser(SessionParser)
+    counter = CommitCounter(storage, args.commit_every)
+    print("SmartNotes shell: команди як у CLI (add, list, search, …); commit — зберегти зміни, exit — вийти.")
+    with storage.batch():
+        while True:
+            try:
+                line = input("smartnotes> ").strip()
+            except EOFError:
+                print()
+                break
+            except KeyboardInterrupt:
+                print()
+                continue
+            if not line or line.startswith("#"):
+                continue
+            if line in ("exit", "quit"):
+                break
+            if line == "commit":
+                storage.commit()
+                counter.pending = 0
+                print("💾 Зміни збережено.")
+                continue
+            try:
+                command = parse_session_line(parser, line)
+                run_command(command, storage)
+                counter.record(command.command)
+            except DuplicateTitleError as exc:
+                print(f"⚠️  {duplicate_message(exc)}")
+            except (CommandError, ValueError, OSError) as exc:
+                if str(exc):
+                    print(f"⚠️  {exc}")
 
 
 if __name__ == "__main__":
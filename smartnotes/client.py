@@ -0,0 +1,223 @@
+"""
+Thin client for a running ``smartnotes.server``.
+
+``NotesClient`` has the storage methods the CLI uses, so ``smartnotes.app``
+runs its commands against it unchanged when a server is up.
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+from urllib.parse import quote, urlencode, urlsplit
+
+from .query import Hit, Span
+from .storage.changes import Changes
+from .storage.config import SERVER_ENV, SERVER_FILE
+from .storage.errors import DuplicateTitleError
+from .storage.models import Note
+
+# Notes per request when a listing is streamed page by page.
+CLIENT_PAGE_SIZE = 500
+CLIENT_TIMEOUT = 30.0
+
+
+class ServerError(RuntimeError):
+    """The server answered with an error the CLI has no better exception for."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class NotesClient:
+    """Storage-like access to a SmartNotes server over one keep-alive connection."""
+
+    def __init__(self, url: str, timeout: float = CLIENT_TIMEOUT) -> None:
+        parts = urlsplit(url)
+        self.url = url
+        self._conn = http.client.HTTPConnection(parts.hostname or "127.0.0.1", parts.port or 80, timeout=timeout)
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None, query: Optional[dict] = None):
+        if query:
+            path += "?" + urlencode({k: v for k, v in query.items() if v is not None}, doseq=True)
+        data = None if body is None else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        try:
+            self._conn.request(method, path, body=data, headers=headers)
+            response = self._conn.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError):
+            # The server dropped an idle keep-alive connection; reconnect once.
+            self._conn.close()
+            self._conn.request(method, path, body=data, headers=headers)
+            response = self._conn.getresponse()
+        raw = response.read()
+        payload = json.loads(raw) if raw else None
+        if response.status == 404 and payload and payload.get("error") == "note not found":
+            return None
+        if response.status == 409:
+            raise DuplicateTitleError(payload["title"], payload["existing_id"])
+        if response.status == 400:
+            raise ValueError(payload["error"])
+        if response.status >= 300:
+            raise ServerError(response.status, (payload or {}).get("error", response.reason))
+        return payload if payload is not None else True
+
+    def _note_path(self, note_id: str) -> str:
+        return "/notes/" + quote(note_id, safe="")
+
+    def _pages(
+        self,
+        path: str,
+        query: dict,
+        limit: Optional[int],
+        offset: int,
+        after_id: Optional[str],
+        read: Callable[[dict], Any] = lambda entry: Note(**entry),
+    ) -> Iterator[Any]:
+        """Stream a listing in ``CLIENT_PAGE_SIZE`` requests, following the cursor;
+        ``read`` turns each entry of the ``notes`` list into what is yielded."""
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = CLIENT_PAGE_SIZE if remaining is None else min(CLIENT_PAGE_SIZE, remaining)
+            page = self._request("GET", path, query={**query, "limit": size, "offset": offset, "after_id": after_id})
+            entries = page["notes"]
+            yield from map(read, entries)
+            if len(entries) < size:
+                return
+            if remaining is not None:
+                remaining -= len(entries)
+            after_id, offset = entries[-1]["id"], 0
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+    def stats(self) -> dict:
+        """The server storage's ``stats()``, covering every client's requests."""
+        return self._request("GET", "/stats")
+
+    def get_note(self, note_id: str) -> Optional[Note]:
+        entry = self._request("GET", self._note_path(note_id))
+        return None if entry is None else Note(**entry)
+
+    def iter_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        wanted = [tag, *tags] if tag else list(tags)
+        query = {"tag": wanted, "any": "1" if match_any else None, "sort": sort}
+        return self._pages("/notes", query, limit, offset, after_id)
+
+    def list_notes(self, *args, **kwargs) -> List[Note]:
+        return list(self.iter_notes(*args, **kwargs))
+
+    def iter_search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        return self._pages("/search", {"q": query, "mode": mode, "sort": sort}, limit, offset, after_id)
+
+    def search(self, *args, **kwargs) -> List[Note]:
+        return list(self.iter_search(*args, **kwargs))
+
+    def search_hits(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Hit]:
+        def read(entry: dict) -> Hit:
+            spans = [Span(*span) for span in entry.pop("spans")]
+            snippet = entry.pop("snippet")
+            return Hit(Note(**entry), spans, snippet)
+
+        params = {"q": query, "mode": mode, "sort": sort, "spans": "1"}
+        return list(self._pages("/search", params, limit, offset, after_id, read))
+
+    def tags(self) -> Dict[str, int]:
+        return self._request("GET", "/tags")["tags"]
+
+    def changes_since(self, seq: int) -> Changes:
+        payload = self._request("GET", "/changes", query={"since": seq})
+        notes = [Note(**entry) for entry in payload["notes"]]
+        return Changes(payload["seq"], notes, payload["deleted"], payload["complete"])
+
+    def add_note(self, title: str, body: str, tags: Optional[List[str]] = None) -> Note:
+        return Note(**self._request("POST", "/notes", {"title": title, "body": body, "tags": tags or []}))
+
+    def update_note(self, note_id: str, title: str, body: str, tags: Optional[List[str]] = None) -> Optional[Note]:
+        entry = self._request("PUT", self._note_path(note_id), {"title": title, "body": body, "tags": tags or []})
+        return None if entry is None else Note(**entry)
+
+    def delete(self, note_id: str) -> bool:
+        return self._request("DELETE", self._note_path(note_id)) is not None
+
+    def import_notes(self, notes: Iterable[Note], unique_titles: bool = True) -> int:
+        body = {"notes": [asdict(note) for note in notes], "unique_titles": unique_titles}
+        return self._request("POST", "/import", body)["count"]
+
+    def export_batches(self, batch_size: int = 500) -> Iterator[List[Note]]:
+        batch: List[Note] = []
+        for note in self.iter_notes():
+            batch.append(note)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def rebuild_index(self) -> int:
+        return self._request("POST", "/reindex")["count"]
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        # The server commits every request itself; nothing to defer here.
+        yield
+
+    def commit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "NotesClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def discover_server(url: Optional[str] = None) -> Optional[NotesClient]:
+    """A client for ``url``, ``$SMARTNOTES_SERVER`` or the server recorded in
+    ``data/server.json``, if that server answers; otherwise None."""
+    url = url or os.environ.get(SERVER_ENV)
+    if url is None:
+        try:
+            url = json.loads(SERVER_FILE.read_text(encoding="utf-8"))["url"]
+        except (OSError, ValueError, KeyError):
+            return None
+    client = NotesClient(url, timeout=CLIENT_TIMEOUT)
+    try:
+        client.health()
+    except (OSError, http.client.HTTPException, ServerError, ValueError):
+        client.close()
+        return None
+    return client
@@ -4,16 +4,37 @@ Tkinter-based graphical interface for SmartNotes.
 
 from __future__ import annotations
 
+import re
+import threading
+import time
 import tkinter as tk
+from bisect import bisect_left
+from concurrent.futures import Future, ThreadPoolExecutor
 from tkinter import messagebox, ttk
-from typing import Optional
-
-from .storage import Note, NoteStorage
+from typing import Callable, Optional
+
+from .index import normalize_tag, normalize_title
+from .listview import VirtualNoteList
+from .query import QueryError, Span, find_hit, parse_query, quote_value
+from .storage import ChangeWatcher, Changes, DuplicateTitleError, Note, OperationTiming, open_storage
+from .storage.base import parse_sort
+
+# Pause in typing before the search box starts a query.
+SEARCH_DEBOUNCE_MS = 250
+# How often the Tk loop checks whether the running query has finished.
+QUERY_POLL_MS = 20
+# How often the Tk loop checks whether the watcher saw the notes change.
+CHANGE_POLL_MS = 200
+# Characters beyond the BMP, which Tcl 8.6 counts as two in text indices.
+_WIDE_CHAR_RE = re.compile("[\U00010000-\U0010ffff]")
+# Sort option that ranks search results by relevance; without a search
+# it lists the newest notes first.
+RELEVANCE = "relevance"
 
 
 class SmartNotesGUI:
     def __init__(self) -> None:
-        self.storage = NoteStorage()
+        self.storage = open_storage()
         self.root = tk.Tk()
         self.root.title("SmartNotes")
         self.root.geometry("1000x650")
@@ -31,11 +52,34 @@ class SmartNotesGUI:
         self.style.configure("Accent.TButton", background="#059669", foreground="#ffffff")
         self.style.map("Accent.TButton", background=[("active", "#047857")])
 
-        self.notes: list[Note] = []
         self.selected_note_id: Optional[str] = None
+        # Tag picker entries ("uni (12)") -> tag they filter by.
+        self.tag_labels: dict[str, str] = {}
+        # Queries run on one worker thread; only the newest one is applied.
+        self._query_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smartnotes-query")
+        self._query_future: Optional[Future] = None
+        self._query_generation = 0
+        # (tag, keyword, mode, sort) of the shown list while the storage may
+        # hold more of it than has been loaded; None once it is all there.
+        self._more_rows: Optional[tuple] = None
+        # Id of the last note the storage returned, where the next page starts;
+        # kept apart from the list, which changes from elsewhere can reorder.
+        self._cursor_id: Optional[str] = None
+        self._debounce_id: Optional[str] = None
+        # Where the current search matched each shown note, by id; filled for
+        # the first screen by the query, for other notes when previewed.
+        self._hit_spans: dict[str, list[Span]] = {}
+        # Sequence number of the storage the shown list reflects; only the
+        # query worker reads and moves it.
+        self._view_seq = 0
+        # Set by the watcher thread, cleared by the Tk loop that applies the changes.
+        self._changes_pending = threading.Event()
+        self.watcher = ChangeWatcher(self.storage, lambda _changes: self._changes_pending.set())
 
         self._build_widgets()
         self._refresh_notes()
+        self.watcher.start()
+        self.root.after(CHANGE_POLL_MS, self._poll_changes)
 
     def _build_widgets(self) -> None:
         self.root.columnconfigure(0, weight=1)
@@ -64,10 +108,11 @@ class SmartNotesGUI:
         self.search_var = tk.StringVar()
         search_entry = ttk.Entry(filter_frame, textvariable=self.search_var)
         search_entry.grid(row=1, column=1, sticky="ew", pady=(5, 0))
-        search_entry.bind("<KeyRelease>", lambda _: self._refresh_notes())
+        search_entry.bind("<KeyRelease>", lambda _: self._schedule_refresh())
 
         ttk.Label(filter_frame, text="Сортування:").grid(row=2, column=0, padx=(0, 5), pady=(5, 0), sticky="w")
         self.sort_options = [
+            (RELEVANCE, "За релевантністю"),
             ("date_desc", "За датою (нові → старі)"),
             ("date_asc", "За датою (старі → нові)"),
             ("title_asc", "За назвою (А → Я)"),
@@ -90,9 +135,19 @@ class SmartNotesGUI:
         button_frame.grid(row=3, column=0, columnspan=2, pady=5, sticky="ew")
         ttk.Button(button_frame, text="Оновити", command=self._refresh_notes).pack(side="left", padx=(0, 5))
         ttk.Button(button_frame, text="Очистити фільтри", command=self._clear_filters).pack(side="left")
-
-        self.listbox = tk.Listbox(
+        self.fuzzy_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            button_frame,
+            text="Нечіткий пошук",
+            variable=self.fuzzy_var,
+            command=self._refresh_notes,
+        ).pack(side="left", padx=(10, 0))
+
+        self.note_list = VirtualNoteList(
             list_frame,
+            render=self._format_row,
+            on_select=self._show_selected_note,
+            on_near_end=self._load_more,
             height=20,
             activestyle="none",
             bg="#e0e7ff",
@@ -101,12 +156,7 @@ class SmartNotesGUI:
             selectbackground="#4338ca",
             selectforeground="#ffffff",
         )
-        self.listbox.grid(row=1, column=0, sticky="nsew")
-        self.listbox.bind("<<ListboxSelect>>", lambda _: self._show_selected_note())
-
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.listbox.yview)
-        scrollbar.grid(row=1, column=1, sticky="ns")
-        self.listbox.configure(yscrollcommand=scrollbar.set)
+        self.note_list.grid(row=1, column=0)
 
         # Right panel
         detail_frame = ttk.Frame(self.root, padding=15)
@@ -157,35 +207,220 @@ class SmartNotesGUI:
         self.sort_var.set(self.sort_options[0][0])
         self._refresh_notes()
 
+    def _schedule_refresh(self) -> None:
+        """Refresh once typing pauses instead of on every keystroke."""
+        if self._debounce_id is not None:
+            self.root.after_cancel(self._debounce_id)
+        self._debounce_id = self.root.after(SEARCH_DEBOUNCE_MS, self._refresh_notes)
+
     def _refresh_notes(self) -> None:
-        tag = self.tag_var.get().strip() or None
+        if self._debounce_id is not None:
+            self.root.after_cancel(self._debounce_id)
+            self._debounce_id = None
+        tag = self.tag_labels.get(self.tag_var.get())
         keyword = self.search_var.get().strip()
+        sort = self.sort_var.get()
+        mode = "fuzzy" if self.fuzzy_var.get() else "index"
+        self._query_generation += 1
+        # A query still waiting for the worker is obsolete now; one already
+        # running finishes, but its results are dropped in _poll_query.
+        if self._query_future is not None:
+            self._query_future.cancel()
+        self._more_rows = None
+        # Every page is a top-k read from the storage's sorted view; pages after
+        # the first follow from the last loaded note as the list is scrolled.
+        self._start_query(tag, keyword, mode, sort, self.note_list.page_size, None, [], 0.0)
+
+    def _start_query(
+        self,
+        tag: Optional[str],
+        keyword: str,
+        mode: str,
+        sort: str,
+        limit: Optional[int],
+        after_id: Optional[str],
+        loaded: list[Note],
+        elapsed: float,
+    ) -> None:
+        self._query_future = self._query_executor.submit(self._run_query, tag, keyword, mode, sort, limit, after_id)
+        self.root.after(
+            QUERY_POLL_MS,
+            self._poll_query,
+            self._query_future,
+            self._query_generation,
+            (tag, keyword, mode, sort, limit, loaded, elapsed),
+        )
+
+    def _run_query(
+        self,
+        tag: Optional[str],
+        keyword: str,
+        mode: str,
+        sort: str,
+        limit: Optional[int],
+        after_id: Optional[str],
+    ) -> tuple:
+        """Worker thread: everything that touches storage, nothing that touches Tk."""
+        started = time.perf_counter()
+        if after_id is None:
+            # Taken before reading: a change made meanwhile is applied again later, never lost.
+            self._view_seq = self.storage.sequence
         if keyword:
-            notes = self.storage.search(keyword)
+            if tag:
+                keyword = f"{keyword} tag:{quote_value(tag)}"
+            ranked = None if sort == RELEVANCE else sort
+            if after_id is None:
+                hits = self.storage.search_hits(keyword, mode=mode, limit=limit, sort=ranked)
+                notes = [hit.note for hit in hits]
+                spans = {hit.note.id: hit.spans for hit in hits}
+            else:
+                notes = self.storage.search(keyword, mode=mode, limit=limit, after_id=after_id, sort=ranked)
+                spans = {}
         else:
-            notes = self.storage.list_notes(tag=tag)
-        notes = self._sort_notes(notes)
-        self.notes = notes
-        self.listbox.delete(0, tk.END)
-        self._populate_tag_choices(notes)
-        for note in notes:
-            display = f"{note.title}  [{', '.join(note.tags) or 'без тегів'}]"
-            self.listbox.insert(tk.END, display)
-        self.preview_text.configure(state="normal")
-        self.preview_text.delete("1.0", tk.END)
-        self.preview_text.configure(state="disabled")
-        self.status_var.set(f"Завантажено {len(notes)} нотаток.")
-
-    def _sort_notes(self, notes: list[Note]) -> list[Note]:
-        mode = self.sort_var.get()
-        if mode == "date_asc":
-            return sorted(notes, key=lambda n: n.created_at)
-        if mode == "title_asc":
-            return sorted(notes, key=lambda n: n.title.lower())
-        if mode == "title_desc":
-            return sorted(notes, key=lambda n: n.title.lower(), reverse=True)
-        # default date_desc
-        return sorted(notes, key=lambda n: n.created_at, reverse=True)
+            listed = "date_desc" if sort == RELEVANCE else sort
+            notes = self.storage.list_notes(tag=tag, limit=limit, after_id=after_id, sort=listed)
+            spans = {}
+        # Taken before tags(), which would replace it.
+        operation = self.storage.last_operation()
+        # Tag counts only change with the notes, so the first page fetches them.
+        tags = self.storage.tags() if after_id is None else None
+        return notes, spans, tags, operation, time.perf_counter() - started
+
+    def _poll_query(self, future: Future, generation: int, query: tuple) -> None:
+        if generation != self._query_generation or future.cancelled():
+            return
+        if not future.done():
+            self.root.after(QUERY_POLL_MS, self._poll_query, future, generation, query)
+            return
+        self._query_future = None
+        tag, keyword, mode, sort, limit, loaded, elapsed = query
+        try:
+            notes, spans, tags, operation, query_elapsed = future.result()
+        except QueryError as exc:
+            self.status_var.set(f"Невірний запит: {exc}")
+            return
+        except Exception as exc:  # surfaced in the status bar, the UI keeps working
+            self.status_var.set(f"Помилка завантаження: {exc}")
+            return
+        if not loaded:
+            self._hit_spans = {}
+        self._hit_spans.update(spans)
+        full_page = limit is not None and len(notes) == limit
+        if notes:
+            self._cursor_id = notes[-1].id
+        notes = loaded + notes
+        elapsed += query_elapsed
+        self._more_rows = (tag, keyword, mode, sort) if full_page else None
+        # Asks for the next page right away if the list does not fill two screens.
+        self._show_notes(notes)
+        if tags is not None:
+            self._populate_tag_choices(tags, tag)
+        self.status_var.set(self._with_timing(f"Завантажено {len(notes)} нотаток за {elapsed * 1000:.0f} мс.", operation))
+
+    def _load_more(self) -> None:
+        """Fetch the next page once the list is scrolled close to its loaded end."""
+        if self._more_rows is None or self._query_future is not None or not self.note_list.items:
+            return
+        tag, keyword, mode, sort = self._more_rows
+        self._start_query(tag, keyword, mode, sort, self.note_list.page_size, self._cursor_id, self.note_list.items, 0.0)
+
+    def _poll_changes(self) -> None:
+        """Fetch what the watcher saw change, once the list has finished loading."""
+        if self._changes_pending.is_set() and self._query_future is None:
+            self._changes_pending.clear()
+            self._query_future = self._query_executor.submit(self._read_changes)
+            self.root.after(QUERY_POLL_MS, self._poll_sync, self._query_future, self._query_generation)
+        self.root.after(CHANGE_POLL_MS, self._poll_changes)
+
+    def _read_changes(self) -> tuple:
+        """Worker thread: notes changed since the list was read, and the tag counts."""
+        changes = self.storage.changes_since(self._view_seq)
+        self._view_seq = changes.seq
+        return changes, self.storage.tags()
+
+    def _poll_sync(self, future: Future, generation: int) -> None:
+        # A newer query rereads everything anyway.
+        if generation != self._query_generation or future.cancelled():
+            return
+        if not future.done():
+            self.root.after(QUERY_POLL_MS, self._poll_sync, future, generation)
+            return
+        self._query_future = None
+        try:
+            changes, tags = future.result()
+        except Exception as exc:  # surfaced in the status bar, the UI keeps working
+            self.status_var.set(f"Помилка оновлення: {exc}")
+            return
+        self._apply_changes(changes, tags)
+
+    def _apply_changes(self, changes: Changes, tags: dict[str, int]) -> None:
+        """Patch the shown list with notes changed elsewhere instead of reloading it."""
+        tag = self.tag_labels.get(self.tag_var.get())
+        sort = self.sort_var.get()
+        shown = self._view_filter(tag, self.search_var.get().strip(), sort)
+        changed = {note.id for note in changes.notes}.union(changes.deleted)
+        # A cursor note changed elsewhere may have moved or gone, so the next
+        # page would not start where the loaded rows end.
+        if not changes.complete or shown is None or (self._more_rows is not None and self._cursor_id in changed):
+            self._refresh_notes()
+            return
+        for note_id in changed:
+            self._hit_spans.pop(note_id, None)
+        notes = [note for note in self.note_list.items if note.id not in changed]
+        field, reverse = parse_sort("date_desc" if sort == RELEVANCE else sort)
+        for note in changes.notes:
+            if shown(note):
+                index = _insertion_index(notes, note, field, reverse)
+                # Past the loaded rows while more are to come: a later page brings it.
+                if index == len(notes) and self._more_rows is not None:
+                    continue
+                notes.insert(index, note)
+        self._show_notes(notes)
+        self._populate_tag_choices(tags, tag)
+        if self.selected_note_id in changes.deleted:
+            self.status_var.set("Вибрану нотатку видалено в іншому вікні.")
+        else:
+            self.status_var.set(f"Зміни ззовні: оновлено {len(changes.notes)}, видалено {len(changes.deleted)}.")
+
+    def _view_filter(self, tag: Optional[str], keyword: str, sort: str) -> Optional[Callable[[Note], bool]]:
+        """Whether a note belongs in the current view; None if only the storage can tell
+        (results ranked by relevance, fuzzy search)."""
+        if not keyword:
+            if not tag:
+                return lambda note: True
+            wanted = normalize_tag(tag)
+            return lambda note: any(normalize_tag(t) == wanted for t in note.tags)
+        if sort == RELEVANCE or self.fuzzy_var.get():
+            return None
+        try:
+            query = parse_query(f"{keyword} tag:{quote_value(tag)}" if tag else keyword)
+        except QueryError:
+            return None
+        if query.is_empty():
+            # The storage falls back to a substring scan for text with no words.
+            return lambda note: note.matches_keyword(keyword)
+        return query.matches
+
+    @staticmethod
+    def _with_timing(message: str, operation: Optional[OperationTiming]) -> str:
+        """Append the storage time of the last operation, as the status bar shows it."""
+        if operation is None:
+            return message
+        return f"{message} [{operation.name}: {operation.seconds * 1000:.1f} мс у сховищі]"
+
+    def _show_notes(self, notes: list[Note]) -> None:
+        self.note_list.set_items(notes)
+        selected = self.note_list.selected()
+        if selected is not None:
+            self._render_preview(selected)
+        else:
+            self.preview_text.configure(state="normal")
+            self.preview_text.delete("1.0", tk.END)
+            self.preview_text.configure(state="disabled")
+
+    @staticmethod
+    def _format_row(note: Note) -> str:
+        return f"{note.title}  [{', '.join(note.tags) or 'без тегів'}]"
 
     def _on_sort_change(self) -> None:
         label = self.sort_display_var.get()
@@ -195,30 +430,32 @@ class SmartNotesGUI:
                 break
         self._refresh_notes()
 
-    def _populate_tag_choices(self, notes: list[Note]) -> None:
-        tags = sorted({tag for note in notes for tag in note.tags})
-        self.tag_combo["values"] = [""] + tags
+    def _populate_tag_choices(self, tags: dict[str, int], selected: Optional[str]) -> None:
+        self.tag_labels = {f"{tag} ({count})": tag for tag, count in tags.items()}
+        self.tag_combo["values"] = [""] + list(self.tag_labels)
+        # Counts change with every edit; keep the chosen tag under its new label.
+        current = next((label for label, tag in self.tag_labels.items() if tag == selected), "")
+        self.tag_var.set(current)
 
-    def _show_selected_note(self) -> None:
-        selection = self.listbox.curselection()
-        if not selection:
-            return
-        note = self.notes[selection[0]]
+    def _show_selected_note(self, note: Note) -> None:
         self.selected_note_id = note.id
         self.title_var.set(note.title)
         self.tags_var.set(" ".join(note.tags))
         self.body_text.delete("1.0", tk.END)
         self.body_text.insert(tk.END, note.body)
+        self._render_preview(note)
+        self.status_var.set(f"Обрана нотатка: {note.title}")
 
+    def _render_preview(self, note: Note) -> None:
         self.preview_text.configure(state="normal")
         self.preview_text.delete("1.0", tk.END)
         self.preview_text.insert(tk.END, f"{note.title}\n{'=' * len(note.title)}\n")
         self.preview_text.insert(tk.END, f"Теги: {', '.join(note.tags) or 'без тегів'}\n")
         self.preview_text.insert(tk.END, f"Створено: {note.created_at}\n\n")
+        body_start = self.preview_text.index("end-1c")
         self.preview_text.insert(tk.END, note.body)
+        self._apply_search_highlight(note, body_start)
         self.preview_text.configure(state="disabled")
-        self._apply_search_highlight()
-        self.status_var.set(f"Обрана нотатка: {note.title}")
 
     def _create_or_update(self) -> None:
         title = self.title_var.get().strip()
@@ -229,19 +466,21 @@ class SmartNotesGUI:
             messagebox.showwarning("Помилка", "Необхідно вказати заголовок і текст.")
             return
 
-        if self._has_duplicate_title(title, exclude_id=self.selected_note_id):
+        # Storage enforces unique titles (ignoring case and surrounding spaces).
+        try:
+            if self.selected_note_id:
+                updated = self.storage.update_note(self.selected_note_id, title, body, tags)
+                message = "Нотатку оновлено." if updated else None
+            else:
+                self.storage.add_note(title=title, body=body, tags=tags)
+                message = "Нотатку додано."
+        except DuplicateTitleError:
             messagebox.showerror("SmartNotes", "Нотатка з таким заголовком вже існує.")
             return
 
-        if self.selected_note_id:
-            updated = self.storage.update_note(self.selected_note_id, title, body, tags)
-            if updated:
-                self.status_var.set("Нотатку оновлено.")
-                messagebox.showinfo("SmartNotes", "Нотатку оновлено.")
-        else:
-            self.storage.add_note(title=title, body=body, tags=tags)
-            self.status_var.set("Нотатку додано.")
-            messagebox.showinfo("SmartNotes", "Нотатку додано.")
+        if message:
+            self.status_var.set(self._with_timing(message, self.storage.last_operation()))
+            messagebox.showinfo("SmartNotes", message)
 
         self._clear_form()
         self._refresh_notes()
@@ -251,22 +490,22 @@ class SmartNotesGUI:
         self.title_var.set("")
         self.tags_var.set("")
         self.body_text.delete("1.0", tk.END)
-        self.listbox.selection_clear(0, tk.END)
+        self.note_list.clear_selection()
         self.status_var.set("Форма очищена.")
 
     def _delete_note(self) -> None:
-        selection = self.listbox.curselection()
-        if not selection:
+        note = self.note_list.selected()
+        if note is None:
             messagebox.showinfo("SmartNotes", "Оберіть нотатку для видалення.")
             return
-        note = self.notes[selection[0]]
         confirm = messagebox.askyesno("Підтвердження", f"Видалити '{note.title}'?")
         if confirm:
             if self.storage.delete(note.id):
+                operation = self.storage.last_operation()
                 self._clear_form()
                 self._refresh_notes()
                 messagebox.showinfo("SmartNotes", "Нотатку видалено.")
-                self.status_var.set("Нотатку видалено.")
+                self.status_var.set(self._with_timing("Нотатку видалено.", operation))
             else:
                 messagebox.showerror("SmartNotes", "Не вдалося видалити нотатку.")
 
@@ -279,32 +518,68 @@ class SmartNotesGUI:
         self.root.clipboard_append(body)
         self.status_var.set("Текст скопійовано в буфер обміну.")
 
-    def _has_duplicate_title(self, title: str, exclude_id: Optional[str] = None) -> bool:
-        normalized = title.strip().lower()
-        for existing in self.storage.list_notes():
-            if exclude_id and existing.id == exclude_id:
-                continue
-            if existing.title.strip().lower() == normalized:
-                return True
-        return False
-
-    def _apply_search_highlight(self) -> None:
-        keyword = self.search_var.get().strip()
-        self.preview_text.configure(state="normal")
+    def _apply_search_highlight(self, note: Note, body_start: str) -> None:
+        """Mark where the search matched the previewed note, with one tag_add for all spans."""
         self.preview_text.tag_remove("highlight", "1.0", tk.END)
-        if keyword:
-            idx = "1.0"
-            while True:
-                idx = self.preview_text.search(keyword, idx, nocase=True, stopindex=tk.END)
-                if not idx:
-                    break
-                end_idx = f"{idx}+{len(keyword)}c"
-                self.preview_text.tag_add("highlight", idx, end_idx)
-                idx = end_idx
-        self.preview_text.configure(state="disabled")
+        fields = {"title": ("1.0", _tk_offsets(note.title)), "body": (body_start, _tk_offsets(note.body))}
+        ranges: list[str] = []
+        for span in self._note_spans(note):
+            start, offset = fields[span.field]
+            ranges.append(f"{start}+{offset(span.start)}c")
+            ranges.append(f"{start}+{offset(span.end)}c")
+        if ranges:
+            self.preview_text.tag_add("highlight", *ranges)
+
+    def _note_spans(self, note: Note) -> list[Span]:
+        """Spans the query found in ``note``, located here for notes it did not return them for."""
+        keyword = self.search_var.get().strip()
+        if not keyword:
+            return []
+        spans = self._hit_spans.get(note.id)
+        if spans is None:
+            fuzzy = self.fuzzy_var.get()
+            try:
+                query = parse_query(keyword)
+            except QueryError:
+                return []
+            spans = self._hit_spans[note.id] = find_hit(query, note, keyword, None, fuzzy).spans
+        return spans
 
     def run(self) -> None:
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.watcher.stop()
+            self._query_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _tk_offsets(text: str) -> Callable[[int], int]:
+    """Turns offsets into ``text`` into the character counts Tk text indices use."""
+    wide = [] if tk.TkVersion >= 8.7 else [match.start() for match in _WIDE_CHAR_RE.finditer(text)]
+    if not wide:
+        return lambda offset: offset
+    return lambda offset: offset + bisect_left(wide, offset)
+
+
+def _insertion_index(notes: list[Note], note: Note, field: str, reverse: bool) -> int:
+    """Where ``note`` goes in ``notes``, which are in ``field`` order (descending with ``reverse``).
+
+    Like the storage, a newer note goes after the ones it ties with, or before
+    them in a descending order.
+    """
+    def value(item: Note) -> str:
+        return item.created_at if field == "date" else normalize_title(item.title)
+
+    key = value(note)
+    low, high = 0, len(notes)
+    while low < high:
+        middle = (low + high) // 2
+        other = value(notes[middle])
+        if (other > key) if reverse else (other <= key):
+            low = middle + 1
+        else:
+            high = middle
+    return low
 
 
 def main() -> None:
@@ -0,0 +1,581 @@
+"""
+Token-level inverted index used by NoteStorage.search.
+
+The index lives next to the notes file as a JSON-lines sidecar: one record per
+indexed note (its id, a checksum of the indexed fields and how often each token
+occurs in it, for BM25 ranking) or a tombstone for a removed note. Updates are
+appended, so keeping the sidecar in step with a mutation costs one short write;
+the file is rewritten only when superseded records start to dominate it.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import re
+import unicodedata
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from .storage.models import Note
+
+INDEX_VERSION = 2
+# BM25 term-frequency saturation and document-length normalisation.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Ukrainian spells apostrophes inside words ("п'ять", "з’явитися") in several
+# ways; they are folded to one and kept as part of the token.
+_APOSTROPHES = str.maketrans({"’": "'", "ʼ": "'", "`": "'"})
+TOKEN_RE = re.compile(r"\w+(?:'\w+)*")
+# Typos fuzzy search tolerates per query word: none up to 3 characters,
+# one up to 7, two beyond.
+FUZZY_DISTANCES = ((3, 0), (7, 1))
+FUZZY_MAX_DISTANCE = 2
+# A fuzzy word expands to at most this many of the closest misspelt tokens.
+FUZZY_MAX_EXPANSIONS = 32
+# SortIndex.walk sorts a subset on its own when it is this many times smaller
+# than the whole order, instead of filtering the whole order down to it.
+SUBSET_SORT_FACTOR = 8
+
+
+def normalize(text: str) -> str:
+    """Fold text for matching: NFKC (so "й"/"ї" are single code points) + casefold."""
+    return unicodedata.normalize("NFKC", text).translate(_APOSTROPHES).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(normalize(text))
+
+
+def normalize_offsets(text: str) -> Tuple[str, Optional[List[Tuple[int, int]]]]:
+    """``normalize(text)`` and, for each of its characters, the ``(start, end)``
+    of ``text`` it came from; None instead of the list when every character
+    maps to its own position, as it does for most text."""
+    folded = normalize(text)
+    if len(folded) == len(text) and unicodedata.is_normalized("NFKC", text):
+        return folded, None
+    # A character with its combining marks normalises on its own, so each
+    # piece of the result can be traced back to it.
+    folded_parts: List[str] = []
+    origins: List[Tuple[int, int]] = []
+    start = 0
+    while start < len(text):
+        end = start + 1
+        while end < len(text) and unicodedata.combining(text[end]):
+            end += 1
+        part = normalize(text[start:end])
+        folded_parts.append(part)
+        origins.extend([(start, end)] * len(part))
+        start = end
+    return "".join(folded_parts), origins
+
+
+@lru_cache(maxsize=4096)
+def normalize_tag(tag: str) -> str:
+    # Cached: a notebook has few distinct tags, each repeated across many notes.
+    return normalize(tag.strip())
+
+
+def normalize_title(title: str) -> str:
+    """Key under which two titles count as the same note title: NFKC, like
+    ``normalize``, so a composed and a decomposed "й" give the same key."""
+    return unicodedata.normalize("NFKC", title.strip()).casefold()
+
+
+def note_tokens(note: "Note") -> FrozenSet[str]:
+    return frozenset(term_counts(note))
+
+
+def term_counts(note: "Note") -> Dict[str, int]:
+    """How often each token occurs in the note's title, body and tags."""
+    counts = Counter(tokenize(note.title))
+    counts.update(tokenize(note.body))
+    for tag in note.tags:
+        counts.update(tokenize(tag))
+    return dict(counts)
+
+
+def prefix_match(query_tokens: Iterable[str], tokens: FrozenSet[str]) -> bool:
+    """Per-note equivalent of prefix ``InvertedIndex.lookup``s for notes that are not indexed."""
+    return all(any(token.startswith(query) for token in tokens) for query in query_tokens)
+
+
+def fuzzy_distance(word: str) -> int:
+    """How many typos fuzzy search forgives in ``word``: none in very short words."""
+    for length, distance in FUZZY_DISTANCES:
+        if len(word) <= length:
+            return distance
+    return FUZZY_MAX_DISTANCE
+
+
+def trigrams(word: str) -> Set[str]:
+    """Character trigrams of ``word``, with its start and end marked."""
+    padded = f"\x02{word}\x03"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int, prefix: bool = False) -> int:
+    """Edits (insertions, deletions, substitutions, adjacent transpositions)
+    turning ``a`` into ``b``, or into the closest prefix of ``b`` with ``prefix``.
+
+    Stops as soon as the distance is certain to exceed ``limit`` and then
+    returns ``limit + 1``, so checking a candidate costs little.
+    """
+    if prefix:
+        # A prefix longer than this is already more than ``limit`` edits away.
+        b = b[:len(a) + limit]
+    elif abs(len(a) - len(b)) > limit:
+        return limit + 1
+    cap = limit + 1
+    width = len(b)
+    # Cells more than ``limit`` off the diagonal are over the limit anyway,
+    # so each row only fills its band and leaves the rest at ``cap``.
+    before: List[int] = []
+    previous = [j if j < cap else cap for j in range(width + 1)]
+    for i, char in enumerate(a, 1):
+        low, high = max(1, i - limit), min(width, i + limit)
+        current = [cap] * (width + 1)
+        if i <= limit:
+            current[0] = row_min = i
+        else:
+            row_min = cap
+        for j in range(low, high + 1):
+            other = b[j - 1]
+            value = previous[j - 1] + (char != other)
+            if previous[j] < value:
+                value = previous[j] + 1
+            if current[j - 1] < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == other and before[j - 2] < value:
+                value = before[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return cap
+        before, previous = previous, current
+    distance = min(previous) if prefix else previous[-1]
+    return min(distance, cap)
+
+
+def fingerprint(note: "Note") -> int:
+    """Cheap checksum of the indexed fields, used to spot stale entries."""
+    return zlib.crc32("\x1f".join([note.title, note.body, *note.tags]).encode("utf-8"))
+
+
+class TrigramIndex:
+    """Vocabulary tokens by character trigram, for typo-tolerant lookups.
+
+    A token within ``d`` edits of a word shares all but at most ``4 * d`` of
+    its trigrams (a swap of two letters touches four), so counting shared
+    trigrams over the word's few postings narrows the vocabulary to a handful
+    of candidates, which ``edit_distance`` then checks exactly.
+    """
+
+    def __init__(self, tokens: Iterable[str] = ()) -> None:
+        self._tokens: Dict[str, Set[str]] = {}
+        for token in tokens:
+            self.add(token)
+
+    def add(self, token: str) -> None:
+        for gram in trigrams(token):
+            self._tokens.setdefault(gram, set()).add(token)
+
+    def remove(self, token: str) -> None:
+        for gram in trigrams(token):
+            tokens = self._tokens.get(gram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens[gram]
+
+    def similar(self, word: str, distance: int, prefix: bool = False) -> Dict[str, int]:
+        """Tokens within ``distance`` edits of ``word`` (or whose prefix is, with
+        ``prefix``), with their distance. Very short words, where a typo can
+        touch every trigram, are only found if a trigram survives."""
+        grams = trigrams(word)
+        # A prefix match also lacks the word's end-marked trigram.
+        needed = max(1, len(grams) - 4 * distance - prefix)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._tokens.get(gram, ()))
+        found = {}
+        for token, count in shared.items():
+            if count >= needed:
+                edits = edit_distance(word, token, distance, prefix)
+                if edits <= distance:
+                    found[token] = edits
+        return found
+
+
+class InvertedIndex:
+    """Maps normalised tokens to the ids of the notes containing them.
+
+    Each note's token counts are kept as well, so matches can be ranked
+    with BM25 (``bm25``) without reading the notes again.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # token -> {note id: occurrences of the token in that note}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._docs: Dict[str, Tuple[int, Dict[str, int]]] = {}
+        # Tokens per note and their sum, for BM25 length normalisation.
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        # Sorted vocabulary for prefix lookups and its trigrams for fuzzy
+        # ones; each built on first use.
+        self._vocab: Optional[List[str]] = None
+        self._trigrams: Optional[TrigramIndex] = None
+        self._records = 0
+        # Set when the sidecar on disk is unreadable or from another version;
+        # the next sync rewrites it rather than appending to it.
+        self._outdated = False
+
+    @classmethod
+    def load(cls, path: Path) -> "InvertedIndex":
+        index = cls(path)
+        if not path.exists():
+            return index
+        docs: Dict[str, Tuple[int, Dict[str, int]]] = {}
+        with path.open("r", encoding="utf-8") as f:
+            try:
+                header = json.loads(f.readline())
+            except json.JSONDecodeError:
+                index._outdated = True
+                return index
+            if not isinstance(header, dict) or header.get("version") != INDEX_VERSION:
+                index._outdated = True
+                return index
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                index._records += 1
+                if record.get("deleted"):
+                    docs.pop(record["id"], None)
+                else:
+                    docs[record["id"]] = (record["crc"], record["tokens"])
+        for note_id, (crc, tokens) in docs.items():
+            index._link(note_id, crc, tokens)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _link(self, note_id: str, crc: int, counts: Dict[str, int]) -> None:
+        self._docs[note_id] = (crc, counts)
+        length = sum(counts.values())
+        self._lengths[note_id] = length
+        self._total_length += length
+        for token, occurrences in counts.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                if self._vocab is not None:
+                    insort(self._vocab, token)
+                if self._trigrams is not None:
+                    self._trigrams.add(token)
+            posting[note_id] = occurrences
+
+    def _unlink(self, note_id: str) -> bool:
+        entry = self._docs.pop(note_id, None)
+        if entry is None:
+            return False
+        self._total_length -= self._lengths.pop(note_id)
+        for token in entry[1]:
+            posting = self._postings[token]
+            del posting[note_id]
+            if not posting:
+                del self._postings[token]
+                if self._vocab is not None:
+                    del self._vocab[bisect_left(self._vocab, token)]
+                if self._trigrams is not None:
+                    self._trigrams.remove(token)
+        return True
+
+    @staticmethod
+    def record(note: "Note") -> dict:
+        return {"id": note.id, "crc": fingerprint(note), "tokens": dict(sorted(term_counts(note).items()))}
+
+    @staticmethod
+    def append(path: Path, records: List[dict]) -> None:
+        """Append records to an existing sidecar without loading it."""
+        if not records or not path.exists():
+            return
+        with path.open("a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def apply(self, notes: Iterable["Note"] = (), removed: Iterable[str] = ()) -> None:
+        """Index added/updated notes and drop removed ids with one sidecar append."""
+        records: List[dict] = []
+        for note in notes:
+            record = self.record(note)
+            self._unlink(note.id)
+            self._link(note.id, record["crc"], record["tokens"])
+            records.append(record)
+        for note_id in removed:
+            if self._unlink(note_id):
+                records.append({"id": note_id, "deleted": True})
+        self._append(records)
+
+    def _append(self, records: List[dict]) -> None:
+        if not records:
+            return
+        if self._outdated or not self.path.exists():
+            self.save()
+            return
+        self.append(self.path, records)
+        self._records += len(records)
+
+    def sync(self, notes: Iterable["Note"]) -> None:
+        """Reconcile the index with the current notes, touching only what differs."""
+        by_id: Dict[str, "Note"] = {}
+
+        def entries() -> Iterator[Tuple[str, int]]:
+            for note in notes:
+                by_id[note.id] = note
+                yield note.id, fingerprint(note)
+
+        self.sync_fingerprints(entries(), by_id.__getitem__)
+
+    def sync_fingerprints(self, entries: Iterable[Tuple[str, int]], fetch: Callable[[str], "Note"]) -> None:
+        """``sync`` for a store that keeps each note's ``fingerprint``: only notes
+        whose fingerprint differs from the index are fetched."""
+        records: List[dict] = []
+        seen: Set[str] = set()
+        for note_id, crc in entries:
+            seen.add(note_id)
+            entry = self._docs.get(note_id)
+            if entry is not None and entry[0] == crc:
+                continue
+            counts = dict(sorted(term_counts(fetch(note_id)).items()))
+            self._unlink(note_id)
+            self._link(note_id, crc, counts)
+            records.append({"id": note_id, "crc": crc, "tokens": counts})
+        for note_id in [note_id for note_id in self._docs if note_id not in seen]:
+            self._unlink(note_id)
+            records.append({"id": note_id, "deleted": True})
+        if self._outdated or not self.path.exists() or self._records + len(records) > 2 * len(self._docs) + 100:
+            self.save()
+        elif records:
+            self._append(records)
+
+    def rebuild(self, notes: Iterable["Note"]) -> None:
+        self._postings.clear()
+        self._docs.clear()
+        self._lengths.clear()
+        self._total_length = 0
+        self._vocab = None
+        self._trigrams = None
+        for note in notes:
+            self._link(note.id, fingerprint(note), dict(sorted(term_counts(note).items())))
+        self.save()
+
+    def save(self) -> None:
+        """Rewrite the sidecar with exactly one record per indexed note."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write(json.dumps({"version": INDEX_VERSION}) + "\n")
+            for note_id, (crc, counts) in self._docs.items():
+                record = {"id": note_id, "crc": crc, "tokens": counts}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        tmp_path.replace(self.path)
+        self._records = len(self._docs)
+        self._outdated = False
+
+    def expand(self, token: str, prefix: bool = False) -> List[str]:
+        """Indexed tokens equal to ``token`` (or starting with it, with ``prefix``)."""
+        if not prefix:
+            return [token] if token in self._postings else []
+        if self._vocab is None:
+            self._vocab = sorted(self._postings)
+        tokens = []
+        for pos in range(bisect_left(self._vocab, token), len(self._vocab)):
+            candidate = self._vocab[pos]
+            if not candidate.startswith(token):
+                break
+            tokens.append(candidate)
+        return tokens
+
+    def expansion(self, token: str, prefix: bool = False, fuzzy: bool = False) -> Dict[str, float]:
+        """Indexed tokens a query term stands for, with the weight their occurrences count with.
+
+        That is ``token`` itself (and with ``prefix`` every token starting with
+        it) at weight 1; with ``fuzzy`` also up to ``FUZZY_MAX_EXPANSIONS`` tokens
+        within ``fuzzy_distance`` edits, at ``1 / (1 + edits)``.
+        """
+        expanded = dict.fromkeys(self.expand(token, prefix), 1.0)
+        distance = fuzzy_distance(token) if fuzzy else 0
+        if distance:
+            if self._trigrams is None:
+                self._trigrams = TrigramIndex(self._postings)
+            similar = self._trigrams.similar(token, distance, prefix)
+            # Closest first, then the most common spelling.
+            closest = sorted(
+                (candidate for candidate in similar if candidate not in expanded),
+                key=lambda candidate: (similar[candidate], -len(self._postings[candidate])),
+            )
+            for candidate in closest[:FUZZY_MAX_EXPANSIONS]:
+                expanded[candidate] = 1 / (1 + similar[candidate])
+        return expanded
+
+    def lookup(self, token: str, prefix: bool = False) -> Set[str]:
+        return self.lookup_all(self.expand(token, prefix))
+
+    def lookup_all(self, tokens: Iterable[str]) -> Set[str]:
+        """Ids of the notes containing any of ``tokens``."""
+        ids: Set[str] = set()
+        for token in tokens:
+            ids.update(self._postings.get(token, ()))
+        return ids
+
+    def bm25(self, terms: Iterable[Dict[str, float]], ids: Set[str]) -> Dict[str, float]:
+        """BM25 score of each note in ``ids`` for query terms given as ``expansion``s.
+
+        An expanded term counts as one term whose occurrences are those of every
+        token it stands for (times their weight), so "лаб" weighs like a word,
+        not like each of "лаба", "лабораторна", ... added together.
+        """
+        scores = dict.fromkeys(ids, 0.0)
+        count = len(self._docs)
+        if not count:
+            return scores
+        lengths = self._lengths
+        # Per-note length normalisation: k1 * (1 - b + b * length / average).
+        base = BM25_K1 * (1 - BM25_B)
+        scale = BM25_K1 * BM25_B * count / (self._total_length or 1)
+        for expanded in terms:
+            postings = [
+                (self._postings[token], weight) for token, weight in expanded.items() if token in self._postings
+            ]
+            if not postings:
+                continue
+            if len(postings) == 1 and postings[0][1] == 1.0:
+                occurrences: Dict[str, float] = postings[0][0]
+            else:
+                occurrences = {}
+                for posting, weight in postings:
+                    for note_id, tf in posting.items():
+                        occurrences[note_id] = occurrences.get(note_id, 0) + tf * weight
+            frequency = len(occurrences)
+            idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            weight = idf * (BM25_K1 + 1)
+            # Walk whichever of the occurrences and the matches is smaller.
+            if len(occurrences) <= len(scores):
+                for note_id, tf in occurrences.items():
+                    if note_id in scores:
+                        scores[note_id] += weight * tf / (tf + base + scale * lengths[note_id])
+            else:
+                for note_id in scores:
+                    tf = occurrences.get(note_id)
+                    if tf:
+                        scores[note_id] += weight * tf / (tf + base + scale * lengths[note_id])
+        return scores
+
+
+class TagIndex:
+    """Normalised tag -> ids of the notes carrying it, with a display label per tag."""
+
+    def __init__(self) -> None:
+        self._ids: Dict[str, Set[str]] = {}
+        # First spelling seen for each normalised tag.
+        self._labels: Dict[str, str] = {}
+
+    def add(self, note_id: str, tags: Iterable[str]) -> None:
+        for tag in tags:
+            key = normalize_tag(tag)
+            if key not in self._ids:
+                self._ids[key] = set()
+                self._labels[key] = tag
+            self._ids[key].add(note_id)
+
+    def remove(self, note_id: str, tags: Iterable[str]) -> None:
+        for tag in tags:
+            key = normalize_tag(tag)
+            ids = self._ids.get(key)
+            if ids is None:
+                continue
+            ids.discard(note_id)
+            if not ids:
+                del self._ids[key]
+                del self._labels[key]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of notes per tag, ordered by normalised tag."""
+        return {self._labels[key]: len(self._ids[key]) for key in sorted(self._ids)}
+
+    def match(self, tags: Iterable[str], match_any: bool = False) -> Set[str]:
+        """Ids of notes with all of ``tags`` (or any of them with ``match_any``)."""
+        postings = [self._ids.get(normalize_tag(tag), set()) for tag in tags]
+        if not postings:
+            return set()
+        if match_any:
+            return set().union(*postings)
+        postings.sort(key=len)
+        return set(postings[0]).intersection(*postings[1:])
+
+
+class SortIndex:
+    """Note ids ordered by ``(key, position)``, kept sorted as notes change.
+
+    Built with a single sort, then maintained with ``insort``/``bisect`` on each
+    mutation, so a sorted page or the top ``k`` notes are read off one end of
+    the order without sorting the notebook again.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, int, str]] = ()) -> None:
+        self._entries: List[Tuple[str, int, str]] = sorted(entries)
+        self._by_id: Dict[str, Tuple[str, int, str]] = {entry[2]: entry for entry in self._entries}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, note_id: str, key: str, position: int) -> None:
+        self.remove(note_id)
+        entry = (key, position, note_id)
+        insort(self._entries, entry)
+        self._by_id[note_id] = entry
+
+    def remove(self, note_id: str) -> None:
+        entry = self._by_id.pop(note_id, None)
+        if entry is not None:
+            del self._entries[bisect_left(self._entries, entry)]
+
+    def walk(
+        self,
+        ids: Optional[Set[str]] = None,
+        reverse: bool = False,
+        after_id: Optional[str] = None,
+    ) -> Iterator[str]:
+        """Yield ids in order (descending with ``reverse``), only those in ``ids``
+        if given, starting after ``after_id``; an ``after_id`` that is unknown or
+        not in ``ids`` yields nothing, as in ``paginate``."""
+        cursor = None
+        if after_id is not None:
+            cursor = self._by_id.get(after_id)
+            if cursor is None or (ids is not None and after_id not in ids):
+                return
+        if ids is not None and len(ids) * SUBSET_SORT_FACTOR < len(self._entries):
+            entries = sorted((self._by_id[note_id] for note_id in ids if note_id in self._by_id), reverse=reverse)
+            for entry in entries:
+                if cursor is None or (entry < cursor if reverse else entry > cursor):
+                    yield entry[2]
+            return
+        if reverse:
+            stop = len(self._entries) if cursor is None else bisect_left(self._entries, cursor)
+            positions = range(stop - 1, -1, -1)
+        else:
+            start = 0 if cursor is None else bisect_right(self._entries, cursor)
+            positions = range(start, len(self._entries))
+        for i in positions:
+            note_id = self._entries[i][2]
+            if ids is None or note_id in ids:
+                yield note_id
@@ -0,0 +1,188 @@
+"""
+Virtualized note list for the SmartNotes GUI.
+"""
+
+from __future__ import annotations
+
+import tkinter as tk
+from difflib import SequenceMatcher
+from tkinter import font as tkfont
+from tkinter import ttk
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .storage import Note
+
+# Rows moved per mouse wheel notch.
+WHEEL_ROWS = 3
+
+
+class VirtualNoteList:
+    """A Listbox that only ever holds the rows currently on screen.
+
+    The whole result lives in ``items``; the Listbox shows
+    ``items[top:top + page_size]`` and the scrollbar is driven by hand. A refresh
+    diffs the visible rows against the ones already displayed and touches only
+    those that changed. The selection and the note at the top of the view are
+    tracked by id, so both survive a refresh.
+
+    ``items`` may be only the start of the result: ``on_near_end`` is called
+    whenever less than a screen of rows is left below the view, so the owner
+    can fetch the next page and hand the longer list to ``set_items``.
+    """
+
+    def __init__(
+        self,
+        parent: tk.Misc,
+        render: Callable[[Note], str],
+        on_select: Callable[[Note], None],
+        on_near_end: Optional[Callable[[], None]] = None,
+        **listbox_options,
+    ) -> None:
+        self.render = render
+        self.on_select = on_select
+        self.on_near_end = on_near_end
+        self.items: List[Note] = []
+        # Note id -> its index in ``items``.
+        self._indexes: Dict[str, int] = {}
+        self.top = 0
+        self.page_size = int(listbox_options.get("height", 10))
+        self.selected_id: Optional[str] = None
+        # (note id, text) of every row the Listbox holds right now.
+        self._rows: List[Tuple[str, str]] = []
+
+        listbox_options.setdefault("exportselection", False)
+        self.listbox = tk.Listbox(parent, **listbox_options)
+        self.scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self._on_scrollbar)
+
+        self.listbox.bind("<Configure>", self._on_resize)
+        self.listbox.bind("<<ListboxSelect>>", self._on_listbox_select)
+        self.listbox.bind("<MouseWheel>", self._on_wheel)
+        self.listbox.bind("<Button-4>", lambda _: self._scroll_and_break(-WHEEL_ROWS))
+        self.listbox.bind("<Button-5>", lambda _: self._scroll_and_break(WHEEL_ROWS))
+        self.listbox.bind("<Up>", lambda _: self._move_selection(-1))
+        self.listbox.bind("<Down>", lambda _: self._move_selection(1))
+        self.listbox.bind("<Prior>", lambda _: self._move_selection(-self.page_size))
+        self.listbox.bind("<Next>", lambda _: self._move_selection(self.page_size))
+        self.listbox.bind("<Home>", lambda _: self._move_selection(-len(self.items)))
+        self.listbox.bind("<End>", lambda _: self._move_selection(len(self.items)))
+
+    def grid(self, row: int, column: int) -> None:
+        self.listbox.grid(row=row, column=column, sticky="nsew")
+        self.scrollbar.grid(row=row, column=column + 1, sticky="ns")
+
+    def set_items(self, items: Sequence[Note]) -> None:
+        """Show a new result list, keeping the top note and the selection where possible."""
+        anchor = self.items[self.top].id if self.top < len(self.items) else None
+        self.items = list(items)
+        self._indexes = {note.id: i for i, note in enumerate(self.items)}
+        if anchor is not None:
+            index = self._index_of(anchor)
+            if index is not None:
+                self.top = index
+        self._render()
+
+    def selected(self) -> Optional[Note]:
+        if self.selected_id is None:
+            return None
+        index = self._index_of(self.selected_id)
+        return None if index is None else self.items[index]
+
+    def clear_selection(self) -> None:
+        self.selected_id = None
+        self.listbox.selection_clear(0, tk.END)
+
+    def see(self, index: int) -> None:
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + self.page_size:
+            self.top = index - self.page_size + 1
+        self._render()
+
+    def scroll(self, rows: int) -> None:
+        self.top += rows
+        self._render()
+
+    def _index_of(self, note_id: str) -> Optional[int]:
+        return self._indexes.get(note_id)
+
+    def _render(self) -> None:
+        self.top = max(0, min(self.top, len(self.items) - self.page_size))
+        window = self.items[self.top:self.top + self.page_size]
+        rows = [(note.id, self.render(note)) for note in window]
+        matcher = SequenceMatcher(a=self._rows, b=rows, autojunk=False)
+        # Applied back to front so the Listbox indexes of earlier opcodes stay valid.
+        for op, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if op == "equal":
+                continue
+            if i2 > i1:
+                self.listbox.delete(i1, i2 - 1)
+            if j2 > j1:
+                self.listbox.insert(i1, *(text for _, text in rows[j1:j2]))
+        self._rows = rows
+        self._sync_selection()
+        self._sync_scrollbar()
+        if self.on_near_end is not None and len(self.items) - self.top < 2 * self.page_size:
+            self.on_near_end()
+
+    def _sync_selection(self) -> None:
+        self.listbox.selection_clear(0, tk.END)
+        for row, (note_id, _) in enumerate(self._rows):
+            if note_id == self.selected_id:
+                self.listbox.selection_set(row)
+                break
+
+    def _sync_scrollbar(self) -> None:
+        total = len(self.items)
+        if total <= self.page_size:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.top / total, (self.top + self.page_size) / total)
+
+    def _row_height(self) -> int:
+        # Tk lays listbox lines out as linespace + 1 + the selection border.
+        linespace = tkfont.Font(font=self.listbox.cget("font")).metrics("linespace")
+        return linespace + 1 + 2 * int(self.listbox.cget("selectborderwidth"))
+
+    def _on_resize(self, event: tk.Event) -> None:
+        border = 2 * (int(self.listbox.cget("borderwidth")) + int(self.listbox.cget("highlightthickness")))
+        page_size = max(1, (event.height - border) // self._row_height())
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self._render()
+
+    def _on_scrollbar(self, action: str, *args: str) -> None:
+        if action == "moveto":
+            self.top = int(float(args[0]) * len(self.items))
+        elif action == "scroll":
+            amount, unit = int(args[0]), args[1]
+            self.top += amount * (self.page_size if unit == "pages" else 1)
+        self._render()
+
+    def _on_wheel(self, event: tk.Event) -> str:
+        return self._scroll_and_break(-WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS)
+
+    def _scroll_and_break(self, rows: int) -> str:
+        self.scroll(rows)
+        return "break"
+
+    def _on_listbox_select(self, _event: tk.Event) -> None:
+        selection = self.listbox.curselection()
+        if not selection or selection[0] >= len(self._rows):
+            return
+        note = self.items[self.top + selection[0]]
+        self.selected_id = note.id
+        self.on_select(note)
+
+    def _move_selection(self, delta: int) -> str:
+        if not self.items:
+            return "break"
+        index = self._index_of(self.selected_id) if self.selected_id is not None else None
+        if index is None:
+            index = self.top
+        else:
+            index = max(0, min(len(self.items) - 1, index + delta))
+        note = self.items[index]
+        self.selected_id = note.id
+        self.see(index)
+        self.on_select(note)
+        return "break"
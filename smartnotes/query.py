@@ -0,0 +1,400 @@
+"""
+Search query language used by NoteStorage.search.
+
+    звіт "лабораторна робота" tag:uni -чернетка after:2025-09-01 before:2026-01
+
+- a bare word must occur in the note as the start of a token, as before;
+  a word that splits into several tokens ("e-mail") is read as a phrase;
+- a quoted phrase must occur as consecutive tokens of the title, the body
+  or one tag;
+- ``tag:name`` (``tag:"two words"``) keeps notes carrying that tag;
+  inside quotes ``\\"`` and ``\\\\`` stand for ``"`` and ``\\`` (``quote_value``);
+- ``after:DATE`` keeps notes created on or after DATE, ``before:DATE`` those
+  created before it; DATE is ``YYYY``, ``YYYY-MM`` or ``YYYY-MM-DD``;
+- a leading ``-`` negates a word, phrase or tag (``-after:`` is ``before:``).
+
+``parse_query`` turns the text into a ``Query``; ``evaluate`` answers it
+from a backend's inverted and tag indexes, ranking matches with BM25 over
+the words and phrase tokens, and ``rank`` keeps the best ``k`` of them.
+``find_hit`` locates the words and phrases in a matched note and cuts a
+snippet of its body around the best match.
+"""
+
+from __future__ import annotations
+
+import heapq
+import re
+from typing import (
+    TYPE_CHECKING, Callable, Collection, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple,
+)
+
+from .index import (
+    TOKEN_RE,
+    InvertedIndex,
+    TagIndex,
+    edit_distance,
+    fuzzy_distance,
+    normalize,
+    normalize_offsets,
+    normalize_tag,
+    note_tokens,
+    prefix_match,
+    tokenize,
+)
+
+if TYPE_CHECKING:
+    from .storage.models import Note
+
+FILTERS = ("tag", "after", "before")
+DATE_RE = re.compile(r"\d{4}(?:-\d{2}(?:-\d{2})?)?")
+_FILTER_RE = re.compile(r"(?i)(%s):" % "|".join(FILTERS))
+# Characters of a note body a search snippet shows, and how many of them
+# come before the match it is cut around.
+SNIPPET_LENGTH = 160
+SNIPPET_LEAD = 40
+_SPACE_RE = re.compile(r"\s+")
+
+
+class QueryError(ValueError):
+    """The search text could not be parsed (e.g. a malformed date)."""
+
+
+class Query(NamedTuple):
+    # Token prefixes that must all occur.
+    terms: Tuple[str, ...] = ()
+    # Token sequences that must occur as they are.
+    phrases: Tuple[Tuple[str, ...], ...] = ()
+    tags: Tuple[str, ...] = ()
+    # Creation-date bounds: after <= created_at < before.
+    after: Optional[str] = None
+    before: Optional[str] = None
+    excluded_terms: Tuple[str, ...] = ()
+    excluded_phrases: Tuple[Tuple[str, ...], ...] = ()
+    excluded_tags: Tuple[str, ...] = ()
+
+    @property
+    def scored(self) -> Tuple[Tuple[str, bool], ...]:
+        """``(token, prefix)`` terms the matches are ranked by."""
+        terms = [(term, True) for term in self.terms]
+        terms.extend((token, False) for phrase in self.phrases for token in phrase)
+        return tuple(dict.fromkeys(terms))
+
+    def is_empty(self) -> bool:
+        """True if nothing was understood, e.g. the text is only punctuation."""
+        return not any(self)
+
+    def matches(self, note: "Note") -> bool:
+        """Evaluate the query against one note, without any index."""
+        if self.after is not None and note.created_at < self.after:
+            return False
+        if self.before is not None and note.created_at >= self.before:
+            return False
+        if self.tags or self.excluded_tags:
+            note_tags = {normalize_tag(tag) for tag in note.tags}
+            if any(normalize_tag(tag) not in note_tags for tag in self.tags):
+                return False
+            if any(normalize_tag(tag) in note_tags for tag in self.excluded_tags):
+                return False
+        if self.terms or self.excluded_terms:
+            tokens = note_tokens(note)
+            if not prefix_match(self.terms, tokens):
+                return False
+            if any(prefix_match([term], tokens) for term in self.excluded_terms):
+                return False
+        return self.phrases_match(note)
+
+    def phrases_match(self, note: "Note") -> bool:
+        """Check only the phrases, the part the indexes cannot answer on their own."""
+        if not self.phrases and not self.excluded_phrases:
+            return True
+        fields = [tokenize(note.title), tokenize(note.body), *(tokenize(tag) for tag in note.tags)]
+
+        def found(phrase: Tuple[str, ...]) -> bool:
+            return any(_contains(tokens, phrase) for tokens in fields)
+
+        return all(map(found, self.phrases)) and not any(map(found, self.excluded_phrases))
+
+
+def _contains(tokens: Sequence[str], phrase: Sequence[str]) -> bool:
+    size = len(phrase)
+    first = phrase[0]
+    return any(
+        tokens[i] == first and list(tokens[i:i + size]) == list(phrase)
+        for i in range(len(tokens) - size + 1)
+    )
+
+
+def _date(value: str, name: str) -> str:
+    if not DATE_RE.fullmatch(value):
+        raise QueryError(f"{name}: очікується дата РРРР, РРРР-ММ або РРРР-ММ-ДД, а не {value!r}")
+    return value
+
+
+def quote_value(value: str) -> str:
+    """``value`` as a quoted phrase or filter value, e.g. for ``tag:`` + a tag from a list."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _read_quoted(text: str, pos: int) -> Tuple[str, int]:
+    """The text between the quote at ``pos`` and the next unescaped one (or the end)."""
+    chars: List[str] = []
+    end = pos + 1
+    while end < len(text):
+        char = text[end]
+        if char == '"':
+            return "".join(chars), end + 1
+        if char == "\\" and text[end + 1:end + 2] in ('"', "\\"):
+            end += 1
+            char = text[end]
+        chars.append(char)
+        end += 1
+    return "".join(chars), len(text)
+
+
+def _read_word(text: str, pos: int) -> Tuple[str, int]:
+    end = pos
+    while end < len(text) and not text[end].isspace():
+        end += 1
+    return text[pos:end], end
+
+
+def parse_query(text: str) -> Query:
+    """Parse search text into a ``Query``; an unterminated quote runs to the end."""
+    parts: Dict[str, List] = {field: [] for field in Query._fields if field not in ("after", "before")}
+    after: Optional[str] = None
+    before: Optional[str] = None
+    pos = 0
+    while pos < len(text):
+        if text[pos].isspace():
+            pos += 1
+            continue
+        negated = text[pos] == "-" and pos + 1 < len(text) and not text[pos + 1].isspace()
+        if negated:
+            pos += 1
+        prefix = "excluded_" if negated else ""
+        if text[pos] == '"':
+            value, pos = _read_quoted(text, pos)
+            tokens = tuple(tokenize(value))
+            if tokens:
+                parts[prefix + "phrases"].append(tokens)
+            continue
+        field = _FILTER_RE.match(text, pos)
+        if field is not None:
+            name = field.group(1).lower()
+            pos = field.end()
+            if pos < len(text) and text[pos] == '"':
+                value, pos = _read_quoted(text, pos)
+            else:
+                value, pos = _read_word(text, pos)
+            value = value.strip()
+            if not value:
+                continue
+            if name == "tag":
+                parts[prefix + "tags"].append(value)
+            elif (name == "after") != negated:
+                after = max(after or "", _date(value, name))
+            else:
+                bound = _date(value, name)
+                before = bound if before is None else min(before, bound)
+            continue
+        word, pos = _read_word(text, pos)
+        tokens = tuple(tokenize(word))
+        if len(tokens) == 1:
+            parts[prefix + "terms"].append(tokens[0])
+        elif tokens:
+            parts[prefix + "phrases"].append(tokens)
+    unique = {field: tuple(dict.fromkeys(values)) for field, values in parts.items()}
+    return Query(after=after, before=before, **unique)
+
+
+class Matches(NamedTuple):
+    ids: Set[str]
+    # BM25 score per id; None when the query has nothing to rank by.
+    scores: Optional[Dict[str, float]]
+    # Candidates left after the index lookups, i.e. notes checked one by one.
+    scanned: int
+
+
+def evaluate(
+    query: Query,
+    index: InvertedIndex,
+    tags: TagIndex,
+    every_id: Callable[[], Iterable[str]],
+    created_at: Callable[[str], str],
+    note: Callable[[str], "Note"],
+    fuzzy: bool = False,
+) -> Matches:
+    """Answer ``query`` from a backend's indexes.
+
+    Words, phrase tokens and negated words narrow the candidates through
+    ``index``, tags through ``tags``; only then are dates (``created_at``)
+    and phrases (``note``, called just for the remaining candidates when
+    the query has phrases) checked per note. With ``fuzzy`` the words also
+    match tokens a few typos away (phrases and negated words stay exact).
+    """
+    terms = [index.expansion(token, prefix, fuzzy and prefix) for token, prefix in query.scored]
+    ids: Optional[Set[str]] = None
+    # Smallest match sets first keeps the intersection small.
+    for found in sorted((index.lookup_all(expanded) for expanded in terms), key=len):
+        ids = found if ids is None else ids & found
+        if not ids:
+            return Matches(set(), {}, 0)
+    if query.tags:
+        found = tags.match(query.tags)
+        ids = found if ids is None else ids & found
+    if ids is None:
+        ids = set(every_id())
+    for term in query.excluded_terms:
+        ids -= index.lookup(term, prefix=True)
+    if query.excluded_tags:
+        ids -= tags.match(query.excluded_tags, match_any=True)
+    scanned = len(ids)
+    if query.after is not None or query.before is not None:
+        after, before = query.after or "", query.before
+        ids = {
+            note_id
+            for note_id in ids
+            if after <= created_at(note_id) and (before is None or created_at(note_id) < before)
+        }
+    if query.phrases or query.excluded_phrases:
+        ids = {note_id for note_id in ids if query.phrases_match(note(note_id))}
+    return Matches(ids, index.bm25(terms, ids) if terms else None, scanned)
+
+
+def rank(scores: Dict[str, float], position: Callable[[str], int], k: Optional[int] = None) -> List[str]:
+    """Ids by descending score, ties in storage order; only the best ``k`` if given.
+
+    The ``k`` best scores are picked with a bounded heap, so only those notes
+    (and any tied with the last of them) are sorted.
+    """
+    if k is not None and k < len(scores):
+        if k <= 0:
+            return []
+        threshold = heapq.nlargest(k, scores.values())[-1]
+        best = [note_id for note_id, score in scores.items() if score >= threshold]
+    else:
+        best = list(scores)
+    # Two stable sorts with plain lookups as keys: storage order, then score.
+    best.sort(key=position)
+    best.sort(key=scores.__getitem__, reverse=True)
+    return best if k is None else best[:k]
+
+
+class Span(NamedTuple):
+    # "title" or "body".
+    field: str
+    # Character offsets into that field as stored, end exclusive.
+    start: int
+    end: int
+
+
+class Hit(NamedTuple):
+    note: "Note"
+    # Where the query matched: title spans, then body spans, in order.
+    spans: List[Span]
+    # Up to SNIPPET_LENGTH characters of the body around its best match.
+    snippet: str
+
+
+def find_hit(
+    query: Query,
+    note: "Note",
+    keyword: str = "",
+    misspellings: Optional[Mapping[str, Collection[str]]] = None,
+    fuzzy: bool = False,
+) -> Hit:
+    """Locate ``query``'s words and phrases in the title and body of ``note``,
+    which matched it; for an empty query, the raw ``keyword`` as substring
+    search finds it.
+
+    A word is marked as far as the query spells it, a phrase as a whole. With
+    ``fuzzy`` a word also marks the tokens ``misspellings`` lists for it (those
+    the backend's index expanded it to) or, without that mapping, any token
+    within ``fuzzy_distance`` edits.
+    """
+    spans: List[Span] = []
+    for field in ("title", "body"):
+        found = _text_spans(getattr(note, field), query, keyword, misspellings if fuzzy else {})
+        spans.extend(Span(field, start, end) for start, end in found)
+    return Hit(note, spans, snippet(note.body, [span for span in spans if span.field == "body"]))
+
+
+def _text_spans(
+    text: str,
+    query: Query,
+    keyword: str,
+    misspellings: Optional[Mapping[str, Collection[str]]],
+) -> List[Tuple[int, int]]:
+    """Matches in ``text`` as merged offsets into it; ``misspellings`` is None to
+    check edit distances, empty for no fuzzy matching."""
+    folded, origins = normalize_offsets(text)
+    found: List[Tuple[int, int]] = []
+    if query.is_empty():
+        pattern = normalize(keyword)
+        position = folded.find(pattern) if pattern else -1
+        while position >= 0:
+            found.append((position, position + len(pattern)))
+            position = folded.find(pattern, position + len(pattern))
+    else:
+        tokens = [(match.group(), match.start(), match.end()) for match in TOKEN_RE.finditer(folded)]
+        misspelt: Dict[Tuple[str, str], bool] = {}
+        for token, start, end in tokens:
+            for term in query.terms:
+                if token.startswith(term):
+                    found.append((start, start + len(term)))
+                    break
+                if misspellings is None:
+                    key = (term, token)
+                    if key not in misspelt:
+                        distance = fuzzy_distance(term)
+                        misspelt[key] = bool(distance) and edit_distance(term, token, distance, prefix=True) <= distance
+                    if misspelt[key]:
+                        found.append((start, end))
+                        break
+                elif token in misspellings.get(term, ()):
+                    found.append((start, end))
+                    break
+        for phrase in query.phrases:
+            size = len(phrase)
+            for i in range(len(tokens) - size + 1):
+                if all(tokens[i + k][0] == phrase[k] for k in range(size)):
+                    found.append((tokens[i][1], tokens[i + size - 1][2]))
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(found):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    if origins is None:
+        return merged
+    return [(origins[start][0], origins[end - 1][1]) for start, end in merged]
+
+
+def snippet(text: str, spans: Sequence[Span] = (), length: int = SNIPPET_LENGTH) -> str:
+    """Up to about ``length`` characters of ``text`` with the most of ``spans``
+    (sorted, offsets into ``text``), or its start without any; whitespace is
+    collapsed and "…" marks where the text was cut."""
+    start, stop = 0, length
+    if spans:
+        best, best_count, j = 0, 0, 0
+        for i, span in enumerate(spans):
+            j = max(j, i)
+            while j < len(spans) and spans[j].end <= span.start - SNIPPET_LEAD + length:
+                j += 1
+            if j - i > best_count:
+                best, best_count = i, j - i
+        first = spans[best].start
+        start = max(0, first - SNIPPET_LEAD)
+        stop = start + length
+        # Begin and end on whole words where the match leaves room for it.
+        space = _SPACE_RE.search(text, start, first) if start else None
+        if space is not None:
+            start = space.end()
+    if stop < len(text):
+        cut = max(text.rfind(" ", start, stop), text.rfind("\n", start, stop))
+        if cut > (spans[best].end if spans else start):
+            stop = cut
+    else:
+        stop = len(text)
+    piece = " ".join(text[start:stop].split())
+    return ("…" if start else "") + piece + ("…" if stop < len(text) else "")
@@ -0,0 +1,325 @@
+"""
+Local HTTP/JSON server for SmartNotes.
+
+Keeps one storage open (and its notes cached) for as long as it runs, so
+scripts pay for a request instead of an interpreter start and a full load:
+
+    python -m smartnotes.server --port 8765
+
+Endpoints (all bodies are JSON, notes as in ``Note``):
+
+    GET    /health                 backend name and pid
+    GET    /stats                  the storage's stats()
+    GET    /notes?tag=&any=&limit=&offset=&after_id=&sort=
+    GET    /notes/<id>
+    POST   /notes                  {"title", "body", "tags"} -> 201 note
+    PUT    /notes/<id>             {"title", "body", "tags"} -> note
+    DELETE /notes/<id>             -> 204
+    GET    /search?q=&mode=&limit=&offset=&after_id=&sort=&spans=
+                                   with spans=1 each note also has "spans"
+                                   ([field, start, end] lists) and "snippet"
+    GET    /tags
+    GET    /changes?since=         {"seq", "notes", "deleted", "complete"}, as changes_since
+    POST   /import                 {"notes": [...], "unique_titles": true}
+    POST   /reindex
+
+While it runs, ``data/server.json`` holds its URL; the CLI finds the server
+through it and sends its commands there.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .storage import BACKENDS, BaseNoteStorage, DuplicateTitleError, Note, open_storage
+from .storage.config import SERVER_FILE, resolve_backend
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+
+
+class ReadWriteLock:
+    """Many readers or one writer; a waiting writer holds off new readers."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class NotesServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, storage: BaseNoteStorage, backend: str, verbose: bool = False) -> None:
+        super().__init__(address, NotesRequestHandler)
+        self.storage = storage
+        self.backend = backend
+        self.verbose = verbose
+        self.lock = ReadWriteLock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class NotesRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the connection open between requests of one client.
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; without TCP_NODELAY each
+    # response waits on the client's delayed ACK.
+    disable_nagle_algorithm = True
+    server: NotesServer
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def do_PUT(self) -> None:
+        self._dispatch("PUT")
+
+    def do_DELETE(self) -> None:
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        query = parse_qs(url.query)
+        try:
+            body = self._read_body()
+            self._route(method, parts, query, body)
+        except DuplicateTitleError as exc:
+            self._send(HTTPStatus.CONFLICT, {"error": str(exc), "title": exc.title, "existing_id": exc.existing_id})
+        except (BadRequest, ValueError, KeyError, TypeError) as exc:
+            self._send(HTTPStatus.BAD_REQUEST, {"error": str(exc)})
+        except Exception as exc:  # reported to the client, the server keeps running
+            self.log_error("%s %s failed: %r", method, self.path, exc)
+            self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(exc)})
+
+    def _route(self, method: str, parts: List[str], query: dict, body: dict) -> None:
+        storage = self.server.storage
+        lock = self.server.lock
+        route = (method, parts[0] if parts else "", len(parts))
+        if route == ("GET", "health", 1):
+            self._send(HTTPStatus.OK, {"backend": self.server.backend, "pid": os.getpid()})
+        elif route == ("GET", "stats", 1):
+            self._send(HTTPStatus.OK, storage.stats())
+        elif route == ("GET", "notes", 1):
+            with lock.reading():
+                notes = storage.list_notes(
+                    tags=query.get("tag", []),
+                    match_any=_flag(query, "any"),
+                    limit=_int(query, "limit"),
+                    offset=_int(query, "offset") or 0,
+                    after_id=_str(query, "after_id"),
+                    sort=_str(query, "sort"),
+                )
+            self._send_notes(notes)
+        elif route == ("GET", "notes", 2):
+            with lock.reading():
+                note = storage.get_note(parts[1])
+            self._send_note(note)
+        elif route == ("POST", "notes", 1):
+            with lock.writing():
+                note = storage.add_note(body["title"], body["body"], list(body.get("tags") or []))
+            self._send(HTTPStatus.CREATED, asdict(note))
+        elif route == ("PUT", "notes", 2):
+            with lock.writing():
+                note = storage.update_note(parts[1], body["title"], body["body"], list(body.get("tags") or []))
+            self._send_note(note)
+        elif route == ("DELETE", "notes", 2):
+            with lock.writing():
+                deleted = storage.delete(parts[1])
+            if deleted:
+                self._send(HTTPStatus.NO_CONTENT)
+            else:
+                self._send(HTTPStatus.NOT_FOUND, {"error": "note not found"})
+        elif route == ("GET", "search", 1):
+            spans = _flag(query, "spans")
+            with lock.reading():
+                results = (storage.search_hits if spans else storage.search)(
+                    _str(query, "q") or "",
+                    mode=_str(query, "mode") or "index",
+                    limit=_int(query, "limit"),
+                    offset=_int(query, "offset") or 0,
+                    after_id=_str(query, "after_id"),
+                    sort=_str(query, "sort"),
+                )
+            if spans:
+                entries = [
+                    {**asdict(hit.note), "spans": [list(span) for span in hit.spans], "snippet": hit.snippet}
+                    for hit in results
+                ]
+                self._send(HTTPStatus.OK, {"notes": entries})
+            else:
+                self._send_notes(results)
+        elif route == ("GET", "tags", 1):
+            with lock.reading():
+                counts = storage.tags()
+            self._send(HTTPStatus.OK, {"tags": counts})
+        elif route == ("GET", "changes", 1):
+            with lock.reading():
+                changes = storage.changes_since(_int(query, "since") or 0)
+            self._send(
+                HTTPStatus.OK,
+                {
+                    "seq": changes.seq,
+                    "notes": [asdict(note) for note in changes.notes],
+                    "deleted": changes.deleted,
+                    "complete": changes.complete,
+                },
+            )
+        elif route == ("POST", "import", 1):
+            notes = [Note(**entry) for entry in body["notes"]]
+            with lock.writing():
+                count = storage.import_notes(notes, unique_titles=body.get("unique_titles", True))
+            self._send(HTTPStatus.OK, {"count": count})
+        elif route == ("POST", "reindex", 1):
+            with lock.writing():
+                count = storage.rebuild_index()
+            self._send(HTTPStatus.OK, {"count": count})
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {"error": f"no route for {method} {'/' + '/'.join(parts)}"})
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError as exc:
+            raise BadRequest(f"invalid JSON body: {exc}") from exc
+        if not isinstance(body, dict):
+            raise BadRequest("JSON body must be an object")
+        return body
+
+    def _send_note(self, note: Optional[Note]) -> None:
+        if note is None:
+            self._send(HTTPStatus.NOT_FOUND, {"error": "note not found"})
+        else:
+            self._send(HTTPStatus.OK, asdict(note))
+
+    def _send_notes(self, notes: List[Note]) -> None:
+        self._send(HTTPStatus.OK, {"notes": [asdict(note) for note in notes]})
+
+    def _send(self, status: HTTPStatus, payload: Optional[dict] = None) -> None:
+        data = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def _str(query: dict, name: str) -> Optional[str]:
+    values = query.get(name)
+    return values[-1] if values else None
+
+
+def _int(query: dict, name: str) -> Optional[int]:
+    value = _str(query, name)
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer") from None
+
+
+def _flag(query: dict, name: str) -> bool:
+    return (_str(query, name) or "").lower() in ("1", "true", "yes")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="smartnotes.server", description="Локальний HTTP/JSON сервер SmartNotes.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        help="Сховище нотаток (типово: $SMARTNOTES_BACKEND, data/config.json або json)",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Логувати кожен запит")
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    backend = resolve_backend(args.backend)
+    storage = open_storage(backend)
+    # Parse the notes now, not on the first request.
+    storage.list_notes(limit=1)
+    server = NotesServer((args.host, args.port), storage, backend, args.verbose)
+    SERVER_FILE.parent.mkdir(parents=True, exist_ok=True)
+    SERVER_FILE.write_text(json.dumps({"url": server.url, "pid": os.getpid()}), encoding="utf-8")
+    print(f"SmartNotes server ({backend}) listening on {server.url}", file=sys.stderr)
+    # Stop cleanly on `kill` too, removing data/server.json on the way out.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            if json.loads(SERVER_FILE.read_text(encoding="utf-8")).get("pid") == os.getpid():
+                SERVER_FILE.unlink()
+        except (OSError, json.JSONDecodeError):
+            pass
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Persistence layer for SmartNotes.
+
+``NoteStorage`` (the JSON file, optionally with an append-only log),
+``SqliteNoteStorage``, ``BinaryNoteStorage`` (a compact memory-mapped
+file) and ``ShardedNoteStorage`` (notes split across JSON files, read in
+parallel) implement the same ``BaseNoteStorage`` API;
+``open_storage`` picks one from an explicit name, ``$SMARTNOTES_BACKEND`` or
+``data/config.json``. ``AsyncNoteStorage`` wraps any of them for asyncio code;
+``ChangeWatcher`` follows one's ``changes_since`` feed as other processes
+write to it.
+"""
+
+from __future__ import annotations
+
+import importlib
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+from .config import BINARY_FILE, DATA_DIR, DATA_FILE, SHARDS_DIR, SQLITE_FILE, resolve_backend
+
+if TYPE_CHECKING:
+    from .async_storage import AsyncNoteStorage
+    from .binary_backend import BinaryNoteStorage, NoteHeader
+    from .changes import Changes, ChangeWatcher
+    from .base import SEARCH_MODES, SORT_ORDERS, BaseNoteStorage
+    from .errors import CorruptStorageError, DuplicateTitleError
+    from .json_backend import STORAGE_MODES, CacheInfo, NoteStorage
+    from .models import Note
+    from .sharded_backend import SHARD_SCHEMES, ShardedNoteStorage
+    from .sqlite_backend import SqliteNoteStorage
+    from .stats import OperationTiming, StorageStats
+
+BACKENDS = ("json", "log", "sqlite", "binary", "sharded")
+
+# Public name -> submodule defining it. Submodules are imported on first use,
+# so a CLI command only pays for the backend it opens (asyncio and sqlite3
+# in particular are not loaded unless asked for).
+_LAZY = {
+    "AsyncNoteStorage": "async_storage",
+    "BaseNoteStorage": "base",
+    "BinaryNoteStorage": "binary_backend",
+    "NoteHeader": "binary_backend",
+    "Changes": "changes",
+    "ChangeWatcher": "changes",
+    "SEARCH_MODES": "base",
+    "SORT_ORDERS": "base",
+    "CorruptStorageError": "errors",
+    "DuplicateTitleError": "errors",
+    "CacheInfo": "json_backend",
+    "NoteStorage": "json_backend",
+    "STORAGE_MODES": "json_backend",
+    "Note": "models",
+    "SHARD_SCHEMES": "sharded_backend",
+    "ShardedNoteStorage": "sharded_backend",
+    "SqliteNoteStorage": "sqlite_backend",
+    "OperationTiming": "stats",
+    "StorageStats": "stats",
+}
+
+
+def __getattr__(name: str) -> Any:
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def open_storage(backend: Optional[str] = None, path: Optional[Path] = None) -> BaseNoteStorage:
+    """Open the configured backend; ``path`` overrides its default file (directory for "sharded")."""
+    name = resolve_backend(backend)
+    if name == "sqlite":
+        from .sqlite_backend import SqliteNoteStorage
+
+        return SqliteNoteStorage(path or SQLITE_FILE)
+    if name == "binary":
+        from .binary_backend import BinaryNoteStorage
+
+        return BinaryNoteStorage(path or BINARY_FILE)
+    if name == "sharded":
+        from .sharded_backend import ShardedNoteStorage
+
+        return ShardedNoteStorage(path or SHARDS_DIR)
+    if name in ("json", "log"):
+        from .json_backend import NoteStorage
+
+        return NoteStorage(path or DATA_FILE, mode=name)
+    raise ValueError(f"Unknown storage backend: {name!r} (expected one of {', '.join(BACKENDS)})")
+
+
+__all__ = [
+    "AsyncNoteStorage",
+    "BACKENDS",
+    "BaseNoteStorage",
+    "BINARY_FILE",
+    "BinaryNoteStorage",
+    "CacheInfo",
+    "ChangeWatcher",
+    "Changes",
+    "CorruptStorageError",
+    "DATA_DIR",
+    "DATA_FILE",
+    "DuplicateTitleError",
+    "Note",
+    "NoteHeader",
+    "NoteStorage",
+    "OperationTiming",
+    "SEARCH_MODES",
+    "SHARD_SCHEMES",
+    "SHARDS_DIR",
+    "SORT_ORDERS",
+    "SQLITE_FILE",
+    "STORAGE_MODES",
+    "ShardedNoteStorage",
+    "SqliteNoteStorage",
+    "StorageStats",
+    "open_storage",
+]
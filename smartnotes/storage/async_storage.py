@@ -0,0 +1,187 @@
+"""
+Asyncio front end for any SmartNotes storage backend.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from .base import BaseNoteStorage
+from .models import Note
+
+# Worker threads shared by reads and the write batches.
+ASYNC_MAX_WORKERS = 4
+# Writes queued behind a running commit beyond this go into the next one.
+ASYNC_MAX_BATCH = 500
+
+# (kind, payload, future) of a write waiting for the next group commit.
+_Write = Tuple[str, Any, "asyncio.Future[Any]"]
+
+
+class AsyncNoteStorage:
+    """Awaitable ``add_note``/``update_note``/``delete``/``list_notes``/``search``.
+
+    Every storage call runs on a bounded thread pool, so file I/O and parsing
+    never block the event loop; the notes stay in whatever backend ``storage``
+    is, in its usual on-disk format.
+
+    Writes are queued and committed in groups: while one commit runs, the
+    writes that arrive are collected and go to disk together through the
+    backend's ``add_many``/``update_many``/``delete_many``. A batch the backend
+    rejects (e.g. a duplicate title) is retried one write at a time, so only
+    the offending call sees the error.
+
+    Identical reads issued while one is already running share its result
+    instead of running again; a committed write ends that sharing, so a read
+    started after a write returns never sees the state before it.
+    """
+
+    def __init__(
+        self,
+        storage: BaseNoteStorage,
+        max_workers: int = ASYNC_MAX_WORKERS,
+        max_batch: int = ASYNC_MAX_BATCH,
+    ) -> None:
+        self.storage = storage
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="smartnotes-async")
+        self._pending: List[_Write] = []
+        self._writer: Optional[asyncio.Task] = None
+        self._reads: Dict[Hashable, asyncio.Future] = {}
+
+    async def _call(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _read(self, key: Hashable, func: Callable[..., Any], *args: Any) -> Any:
+        shared = self._reads.get(key)
+        if shared is None:
+            shared = asyncio.ensure_future(self._call(func, *args))
+            self._reads[key] = shared
+
+            def forget(done: asyncio.Future) -> None:
+                # A write may have replaced this entry with a newer read already.
+                if self._reads.get(key) is done:
+                    del self._reads[key]
+
+            shared.add_done_callback(forget)
+        # Shielded: one caller being cancelled must not cancel the others' read.
+        result = await asyncio.shield(shared)
+        # Each caller gets its own list; the notes in it are shared, as with the backends.
+        return list(result)
+
+    async def _write(self, kind: str, payload: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((kind, payload, future))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._drain())
+        return await future
+
+    async def _drain(self) -> None:
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                results = await self._call(self._commit, [(kind, payload) for kind, payload, _ in batch])
+            except BaseException as exc:
+                results = [exc] * len(batch)
+            # Reads already in flight may predate this commit.
+            self._reads.clear()
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _commit(self, writes: List[Tuple[str, Any]]) -> List[Any]:
+        """Worker thread: apply writes in order, one backend batch per run of the same kind."""
+        results: List[Any] = []
+        start = 0
+        while start < len(writes):
+            kind = writes[start][0]
+            end = start + 1
+            seen = {self._write_key(writes[start])}
+            # A second write to the same note starts a new run, so each run's
+            # results map back to its writes unambiguously.
+            while end < len(writes) and writes[end][0] == kind and self._write_key(writes[end]) not in seen:
+                seen.add(self._write_key(writes[end]))
+                end += 1
+            run = [payload for _, payload in writes[start:end]]
+            try:
+                results.extend(self._apply(kind, run))
+            except Exception:
+                for payload in run:
+                    try:
+                        results.extend(self._apply(kind, [payload]))
+                    except Exception as exc:
+                        results.append(exc)
+            start = end
+        return results
+
+    @staticmethod
+    def _write_key(write: Tuple[str, Any]) -> Hashable:
+        kind, payload = write
+        if kind == "delete":
+            return payload
+        if kind == "update":
+            return payload["id"]
+        return object()  # adds never collide by id
+
+    def _apply(self, kind: str, run: List[Any]) -> List[Any]:
+        if kind == "add":
+            return self.storage.add_many(run)
+        if kind == "update":
+            updated = {note.id: note for note in self.storage.update_many(run)}
+            return [updated.get(item["id"]) for item in run]
+        existing = {note_id for note_id in run if self.storage.get_note(note_id) is not None}
+        self.storage.delete_many(run)
+        return [note_id in existing for note_id in run]
+
+    async def add_note(self, title: str, body: str, tags: Optional[List[str]] = None) -> Note:
+        return await self._write("add", {"title": title, "body": body, "tags": tags})
+
+    async def update_note(self, note_id: str, title: str, body: str, tags: Optional[List[str]] = None) -> Optional[Note]:
+        return await self._write("update", {"id": note_id, "title": title, "body": body, "tags": tags})
+
+    async def delete(self, note_id: str) -> bool:
+        return await self._write("delete", note_id)
+
+    async def list_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        args = (tag, tuple(tags), match_any, limit, offset, after_id, sort)
+        return await self._read(("list_notes", args), self.storage.list_notes, *args)
+
+    async def search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        args = (query, mode, limit, offset, after_id, sort)
+        return await self._read(("search", args), self.storage.search, *args)
+
+    async def close(self) -> None:
+        """Finish queued writes, then release the workers and the backend."""
+        if self._writer is not None:
+            await self._writer
+        await self._call(self.storage.close)
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self) -> "AsyncNoteStorage":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
@@ -0,0 +1,315 @@
+"""
+Interface shared by the SmartNotes storage backends.
+"""
+
+from __future__ import annotations
+
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from ..index import normalize_title
+from ..query import Hit, Query, find_hit, parse_query
+from .changes import ChangeJournal, Changes
+from .errors import DuplicateTitleError
+from .models import Note
+from .stats import OperationTiming, StorageStats, instrumented
+
+# "index" parses the query language and answers it through the backend's
+# full-text index; "fuzzy" does the same but lets its words match tokens a
+# few typos away; "substring" is the original Note.matches_keyword scan.
+SEARCH_MODES = ("index", "fuzzy", "substring")
+# "date" orders by created_at, "title" by the normalised title; ties keep
+# storage order (reversed along with everything else for "_desc").
+SORT_ORDERS = ("date_desc", "date_asc", "title_asc", "title_desc")
+
+
+def parse_sort(sort: str) -> Tuple[str, bool]:
+    """Split a ``SORT_ORDERS`` name into its field and whether it is descending."""
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort order: {sort!r}")
+    field, direction = sort.split("_")
+    return field, direction == "desc"
+
+
+def paginate(
+    notes: Iterable[Note],
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_id: Optional[str] = None,
+) -> Iterator[Note]:
+    """Skip past the ``after_id`` cursor, then ``offset`` notes, and yield up to ``limit``.
+
+    An ``after_id`` that is not among the notes (e.g. deleted since the previous
+    page was read) yields nothing.
+    """
+    it = iter(notes)
+    if after_id is not None:
+        for note in it:
+            if note.id == after_id:
+                break
+        else:
+            return
+    yield from islice(it, offset, None if limit is None else offset + limit)
+
+
+class BaseNoteStorage(ABC):
+    """Operations the CLI and GUI rely on, whatever keeps the notes.
+
+    Titles are unique up to case and surrounding whitespace: every method that
+    creates or retitles notes raises ``DuplicateTitleError`` before changing
+    anything if the batch would clash with another note or with itself.
+
+    Each mutation is committed on its own unless it runs inside ``batch()``.
+    Every changed note gets a sequence number in a bounded journal, which
+    ``changes_since`` reads back.
+    """
+
+    # Open ``batch()`` blocks; mutations defer their commit while it is non-zero.
+    _batch_depth = 0
+    # Created by each backend's __init__; its public methods record into it.
+    _stats: StorageStats
+    # Likewise; mutations record the ids they change, _poll_changes what
+    # other processes changed.
+    _journal: ChangeJournal
+
+    @abstractmethod
+    def list_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        """Notes in storage order, optionally only those carrying ``tag`` and all
+        of ``tags`` (any of them with ``match_any``). Tags compare case-insensitively.
+        ``limit``/``offset``/``after_id`` select one page, as in ``paginate``;
+        ``sort`` (one of ``SORT_ORDERS``) orders the notes before paging, so a
+        ``limit`` reads only the top of the order."""
+
+    @abstractmethod
+    def iter_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        """Like ``list_notes``, but yields notes as soon as they are read."""
+
+    @abstractmethod
+    def get_note(self, note_id: str) -> Optional[Note]:
+        ...
+
+    @abstractmethod
+    def get_by_title(self, title: str) -> Optional[Note]:
+        """The note with this title, compared as for uniqueness."""
+
+    @abstractmethod
+    def tags(self) -> Dict[str, int]:
+        """Number of notes per tag, ordered by tag."""
+
+    @abstractmethod
+    def add_note(self, title: str, body: str, tags: Optional[List[str]] = None) -> Note:
+        ...
+
+    @abstractmethod
+    def update_note(self, note_id: str, title: str, body: str, tags: Optional[List[str]] = None) -> Optional[Note]:
+        ...
+
+    @abstractmethod
+    def search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        """Notes matching ``query`` (see ``smartnotes.query`` for the syntax), best
+        BM25 matches first; a query of filters only keeps storage order. ``sort``
+        orders the matches instead, and paging works as in ``list_notes``, so a
+        ``limit`` keeps just the top-ranked notes. ``mode="fuzzy"`` tolerates
+        typos in the words; ``mode="substring"`` scans for the raw text, in
+        storage order."""
+
+    @abstractmethod
+    def iter_search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        """Like ``search``, but yields matches as soon as they are found."""
+
+    @instrumented("search_hits")
+    def search_hits(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Hit]:
+        """``search``, plus where each note matched: ``Span``s of its title and
+        body to highlight and a snippet of the body around the best match.
+        Fuzzy matches are the tokens the backend's index expanded the words to."""
+        notes = self.search(query, mode, limit, offset, after_id, sort)
+        parsed = Query() if mode == "substring" else parse_query(query)
+        misspellings: Optional[Dict[str, Collection[str]]] = None
+        if mode == "fuzzy" and notes:
+            known = {term: self._misspellings(term) for term in parsed.terms}
+            if all(tokens is not None for tokens in known.values()):
+                misspellings = known
+        return [find_hit(parsed, note, query, misspellings, mode == "fuzzy") for note in notes]
+
+    def _misspellings(self, term: str) -> Optional[Collection[str]]:
+        """Tokens fuzzy search lets ``term`` match besides those starting with
+        it; None if the backend cannot list them, and edit distances decide."""
+        return None
+
+    @abstractmethod
+    def delete(self, note_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def import_notes(self, notes: Iterable[Note], unique_titles: bool = True) -> int:
+        """Store notes as they are (ids and dates kept), replacing same-id notes.
+
+        ``unique_titles=False`` skips the title check, for copying a store that
+        predates it verbatim.
+        """
+
+    def add_many(self, items: Iterable[Mapping]) -> List[Note]:
+        """Create a note per ``{"title", "body", "tags"}`` mapping in one commit."""
+        notes = [
+            Note(id=str(uuid.uuid4()), title=item["title"], body=item["body"], tags=list(item.get("tags") or []))
+            for item in items
+        ]
+        self.import_notes(notes)
+        return notes
+
+    @abstractmethod
+    def update_many(self, items: Iterable[Mapping]) -> List[Note]:
+        """Apply ``{"id", "title", "body", "tags"}`` updates in one commit; unknown ids are skipped."""
+
+    @abstractmethod
+    def delete_many(self, note_ids: Iterable[str]) -> int:
+        """Delete notes in one commit; returns how many existed."""
+
+    @abstractmethod
+    def rebuild_index(self) -> int:
+        """Rebuild the full-text index from scratch; returns the note count."""
+
+    @property
+    def sequence(self) -> int:
+        """Sequence number of the latest change seen so far."""
+        return self._journal.seq
+
+    @instrumented("changes_since")
+    def changes_since(self, seq: int) -> Changes:
+        """Notes added, updated or deleted after sequence number ``seq``.
+
+        Covers changes made through this instance and, as far as the backend
+        can tell from its files, by other processes. Pass the returned ``seq``
+        to the next call; see ``Changes.complete`` for when to reload instead.
+        """
+        self._poll_changes()
+        current, ids = self._journal.since(seq)
+        if ids is None:
+            return Changes(current, [], [], False)
+        notes: List[Note] = []
+        deleted: List[str] = []
+        for note_id in ids:
+            note = self.get_note(note_id)
+            if note is None:
+                deleted.append(note_id)
+            else:
+                notes.append(note)
+        return Changes(current, notes, deleted, True)
+
+    def _poll_changes(self) -> None:
+        """Record in the journal what other processes changed since the last look."""
+
+    def watch_paths(self) -> List[Path]:
+        """Files whose changes on disk may change the notes, for ``ChangeWatcher``."""
+        return []
+
+    def export_batches(self, batch_size: int = 500) -> Iterator[List[Note]]:
+        """Yield every note in storage order, ``batch_size`` at a time."""
+        notes = self.iter_notes()
+        while True:
+            batch = list(islice(notes, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Defer commits until the block exits.
+
+        Mutations inside apply at once and reads see them, but they reach the
+        disk together when the outermost block exits (also on an exception),
+        or earlier at each ``commit()``.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.commit()
+
+    def commit(self) -> None:
+        """Write out mutations deferred by ``batch()``."""
+
+    def stats(self) -> dict:
+        """Operation timings, phase timers and counters since opening or ``reset_stats()``."""
+        return self._stats.snapshot()
+
+    def reset_stats(self) -> None:
+        self._stats.reset()
+
+    def last_operation(self) -> Optional[OperationTiming]:
+        """Name and duration of the last storage call made by the calling thread."""
+        return self._stats.last_operation()
+
+    def close(self) -> None:
+        self.commit()
+
+    def __enter__(self) -> "BaseNoteStorage":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def check_titles(notes: Sequence[Note], holders: Callable[[str], Iterable[str]]) -> None:
+    """Raise ``DuplicateTitleError`` if ``notes`` would share a title with each other
+    or with a note outside the batch; ``holders`` returns ids stored under a title key."""
+    batch_ids = {note.id for note in notes}
+    claimed: Dict[str, str] = {}
+    for note in notes:
+        key = normalize_title(note.title)
+        owner = claimed.setdefault(key, note.id)
+        if owner != note.id:
+            raise DuplicateTitleError(note.title, owner)
+        for other in holders(key):
+            # Batch members holding the key either keep it (caught above) or
+            # are being retitled away from it.
+            if other != note.id and other not in batch_ids:
+                raise DuplicateTitleError(note.title, other)
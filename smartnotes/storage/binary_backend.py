@@ -0,0 +1,905 @@
+"""
+Compact binary backend: a header file and a body file, read through ``mmap``.
+
+Header file ``notes.snb`` (little-endian)::
+
+    header      magic "SNB2", version, note count, tag count, the offsets
+                of the three sections below and the body file generation
+    records     per note: id/created_at/title/tag-count lengths, the offset
+                and length of its body in the body file, then id,
+                created_at, title and tag ids (u32 each)
+    tags        the interned tag dictionary: u16 length + UTF-8 per tag
+    table       per note in storage order: record offset (u64) and the
+                search-index fingerprint of the note (u32)
+    id hashes   (hash of the id, table position) pairs sorted by hash
+
+Body file ``notes.snb.<generation>.body``: the bodies back to back, appended
+to and never changed in place; compaction writes the live ones to the next
+generation's file.
+
+Listing titles, tags and dates reads only the header file, which is small
+however long the notes are; ``get_note`` finds a record through the sorted
+id hashes without reading any other note. Strings are UTF-8 with
+``surrogatepass``, so any Python string round-trips, even one no JSON
+file could store.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import uuid
+from bisect import bisect_right
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+from ..index import InvertedIndex, SortIndex, TagIndex, fingerprint, normalize_title
+from ..query import Query, evaluate, parse_query, rank
+from .base import SEARCH_MODES, BaseNoteStorage, check_titles, paginate, parse_sort
+from .changes import ChangeJournal
+from .config import BINARY_FILE
+from .filelock import FileLock
+from .models import BodyCache, LazyNote, Note
+from .stats import StorageStats, instrumented
+
+MAGIC = b"SNB2"
+FORMAT_VERSION = 2
+# magic, version, reserved, notes, tags, tags offset, table offset, id hashes offset, body file generation
+HEADER = struct.Struct("<4sHHIIQQQQ")
+# id, created_at, title, tag count (lengths), body offset and length in the body file
+RECORD = struct.Struct("<HHIHQI")
+TAG_LENGTH = struct.Struct("<H")
+TABLE_ENTRY = struct.Struct("<QI")
+HASH_ENTRY = struct.Struct("<QI")
+TEXT_ERRORS = "surrogatepass"
+# Notes decoded per step of iter_notes.
+ITER_CHUNK = 256
+# The body file is compacted once the bodies of deleted and edited notes in
+# it take at least BODY_COMPACT_MIN_BYTES and more than the live ones.
+BODY_COMPACT_MIN_BYTES = 1024 * 1024
+
+
+class NoteHeader(NamedTuple):
+    """Everything about a note except its body."""
+
+    id: str
+    title: str
+    tags: List[str]
+    created_at: str
+
+
+class _Layout(NamedTuple):
+    count: int
+    tag_count: int
+    tags_offset: int
+    table_offset: int
+    hashes_offset: int
+    body_generation: int
+
+
+class _Entry:
+    """A note's header plus where its body is: in the body file, or in ``note`` if not written yet."""
+
+    __slots__ = ("id", "title", "tags", "created_at", "crc", "body_at", "body_len", "note")
+
+    def __init__(
+        self,
+        note_id: str,
+        title: str,
+        tags: List[str],
+        created_at: str,
+        crc: int,
+        body_at: int = -1,
+        body_len: int = 0,
+        note: Optional[Note] = None,
+    ) -> None:
+        self.id = note_id
+        self.title = title
+        self.tags = tags
+        self.created_at = created_at
+        self.crc = crc
+        self.body_at = body_at
+        self.body_len = body_len
+        self.note = note
+
+    @classmethod
+    def fresh(cls, note: Note) -> "_Entry":
+        return cls(note.id, note.title, list(note.tags), note.created_at, fingerprint(note), note=note)
+
+    def header(self) -> NoteHeader:
+        return NoteHeader(self.id, self.title, list(self.tags), self.created_at)
+
+
+def _id_hash(note_id: str) -> int:
+    digest = hashlib.blake2b(note_id.encode("utf-8", TEXT_ERRORS), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _encode(text: str) -> bytes:
+    return text.encode("utf-8", TEXT_ERRORS)
+
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", TEXT_ERRORS)
+
+
+def _sort_key(entry: _Entry, field: str) -> str:
+    return entry.created_at if field == "date" else normalize_title(entry.title)
+
+
+class BinaryNoteStorage(BaseNoteStorage):
+    """Notes in the compact ``notes.snb`` format, read through a memory map.
+
+    Headers (id, title, tags, date) are decoded once into an in-memory
+    catalogue, which tag filters, sorting, paging and title checks work on.
+    Notes are returned as ``LazyNote``: a body is decoded from the body file
+    when it is first used and kept in a size-bounded ``BodyCache``, so listing
+    thousands of long notes costs about as much as their headers. A mutation
+    appends the new bodies to the body file, rewrites the header file and
+    swaps it in atomically; inside ``batch()`` that happens once, at the
+    commit. Like the JSON backend, a change made by another process is noticed
+    by the file's stat signature and the catalogue is rebuilt; comparing the
+    stored fingerprints with the old catalogue's tells ``changes_since`` which
+    notes changed.
+
+    Writers lock ``notes.snb.lock`` around reading the catalogue, appending
+    the bodies and swapping the header file in, so two processes never append
+    over each other or base a header on a stale one. Inside ``batch()`` the
+    lock is taken only at the commit: if another process wrote meanwhile, the
+    file is read again and the batch's changes are applied on top of it.
+
+    ``search`` uses the same inverted index sidecar as the JSON backend,
+    reconciled through the fingerprints stored in the file, so a new process
+    decodes only the bodies of notes the index has not seen. Date filters in
+    a query are checked on the headers; only phrases need the bodies of the
+    candidates.
+    """
+
+    def __init__(self, file_path: Path = BINARY_FILE) -> None:
+        self.file_path = file_path
+        self.index_path = file_path.with_name(file_path.name + ".idx")
+        self._lock = threading.RLock()
+        self._stats = StorageStats()
+        self._journal = ChangeJournal()
+        self._map: Optional[mmap.mmap] = None
+        # Map of the body file of the current generation; reopened when a
+        # body lies past its end.
+        self._body_map: Optional[mmap.mmap] = None
+        self._body_map_generation = -1
+        self._bodies = BodyCache()
+        self._layout: Optional[_Layout] = None
+        self._tag_names: Optional[List[str]] = None
+        self._signature: Optional[Tuple[int, int, int]] = None
+        # The catalogue, in storage order; None until a call needs it.
+        self._entries: Optional[Dict[str, _Entry]] = None
+        # (fingerprint, created_at) by id of a catalogue dropped because the
+        # file changed, until the new one is read and compared with them.
+        self._previous: Optional[Dict[str, Tuple[int, str]]] = None
+        self._ordered: Optional[List[_Entry]] = None
+        self._positions: Dict[str, int] = {}
+        self._next_position = 0
+        self._tags = TagIndex()
+        self._titles: Dict[str, Set[str]] = {}
+        self._sorted: Dict[str, SortIndex] = {}
+        # Catalogue changes not yet in the file (inside batch()), and the
+        # notes they put (None for a deletion) by id, to apply again on top
+        # of the file if another process rewrote it before the commit.
+        self._dirty = False
+        self._pending: Dict[str, Optional[Note]] = {}
+        self._file_lock = FileLock(file_path.with_name(file_path.name + ".lock"))
+        self.generation = 0
+        self._index: Optional[InvertedIndex] = None
+        self._index_generation = -1
+        if not self.file_path.exists():
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._file_lock:
+                if not self.file_path.exists():
+                    self._entries = {}
+                    self._write_out()
+
+    # -- file access ------------------------------------------------------
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self.file_path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _close_map(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _open_map(self) -> None:
+        self._close_map()
+        with self.file_path.open("rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, *layout = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._close_map()
+            raise ValueError(f"{self.file_path} is not a SmartNotes binary file (version {FORMAT_VERSION})")
+        self._layout = _Layout(*layout)
+        self._tag_names = None
+        self._stats.count("maps_opened")
+
+    def _current_map(self) -> mmap.mmap:
+        """The map of the file as it is on disk, reopened (and the catalogue dropped) if it changed."""
+        with self._lock:
+            if self._dirty and self._map is not None:
+                # Inside batch() the catalogue is ahead of the file on purpose.
+                return self._map
+            signature = self._stat()
+            if self._map is None or signature != self._signature:
+                self._open_map()
+                if signature != self._signature:
+                    if self._entries is not None:
+                        self._previous = {
+                            note_id: (entry.crc, entry.created_at) for note_id, entry in self._entries.items()
+                        }
+                    self._entries = None
+                    self._signature = signature
+            return self._map
+
+    def _body_path(self, generation: int) -> Path:
+        return self.file_path.with_name(f"{self.file_path.name}.{generation}.body")
+
+    def _close_body_map(self) -> None:
+        if self._body_map is not None:
+            self._body_map.close()
+            self._body_map = None
+
+    def _body_bytes(self, offset: int, length: int) -> bytes:
+        """Bytes of a body in the current generation's body file."""
+        if not length:
+            return b""
+        generation = self._layout.body_generation
+        end = offset + length
+        if self._body_map is None or self._body_map_generation != generation or len(self._body_map) < end:
+            self._close_body_map()
+            with self._body_path(generation).open("rb") as f:
+                self._body_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._body_map_generation = generation
+            self._stats.count("maps_opened")
+            if len(self._body_map) < end:
+                raise ValueError(f"{self._body_path(generation)} is shorter than {self.file_path} expects")
+        return self._body_map[offset:end]
+
+    def _load_body(self, note_id: str, crc: int, generation: int, offset: int, length: int) -> str:
+        """The body of a ``LazyNote``, from the cache or the body file it was read with.
+
+        Once that file has been compacted away, the note's body is found by
+        id, provided the note is unchanged since it was read.
+        """
+        key = (generation, offset)
+        body = self._bodies.get(key)
+        if body is not None:
+            self._stats.count("body_cache_hits")
+            return body
+        with self._lock:
+            self._current_map()
+            if generation != self._layout.body_generation:
+                if self._entries is not None:
+                    entry = self._entries.get(note_id)
+                else:
+                    found = self._lookup(note_id)
+                    entry = None if found is None else found[1]
+                if entry is None or entry.crc != crc:
+                    raise LookupError(f"Note {note_id} was changed or deleted since it was read")
+                if entry.note is not None:
+                    return entry.note.body
+                key = (self._layout.body_generation, entry.body_at)
+            self._stats.count("bodies_decoded")
+            body = _decode(self._body_bytes(key[1], length))
+        self._bodies.put(key, body, length)
+        return body
+
+    def _tag_dictionary(self) -> List[str]:
+        if self._tag_names is None:
+            data, layout = self._map, self._layout
+            names: List[str] = []
+            position = layout.tags_offset
+            for _ in range(layout.tag_count):
+                (length,) = TAG_LENGTH.unpack_from(data, position)
+                position += TAG_LENGTH.size
+                names.append(_decode(data[position:position + length]))
+                position += length
+            self._tag_names = names
+        return self._tag_names
+
+    def _read_header(self, offset: int, crc: int) -> _Entry:
+        data = self._map
+        id_len, created_len, title_len, tag_count, body_at, body_len = RECORD.unpack_from(data, offset)
+        position = offset + RECORD.size
+        note_id = _decode(data[position:position + id_len])
+        position += id_len
+        created_at = _decode(data[position:position + created_len])
+        position += created_len
+        title = _decode(data[position:position + title_len])
+        position += title_len
+        names = self._tag_dictionary()
+        tags = [names[tag_id] for tag_id in struct.unpack_from(f"<{tag_count}I", data, position)]
+        return _Entry(note_id, title, tags, created_at, crc, body_at, body_len)
+
+    def _table_entry(self, position: int) -> Tuple[int, int]:
+        return TABLE_ENTRY.unpack_from(self._map, self._layout.table_offset + position * TABLE_ENTRY.size)
+
+    def _note(self, entry: _Entry) -> Note:
+        """The note to return to a caller; its body is read when used."""
+        if entry.note is not None:
+            return entry.note
+        load = partial(
+            self._load_body, entry.id, entry.crc, self._layout.body_generation, entry.body_at, entry.body_len
+        )
+        return LazyNote(entry.id, entry.title, list(entry.tags), entry.created_at, load)
+
+    def _full_note(self, entry: _Entry) -> Note:
+        """The note with its body decoded now and not cached, for scans over many notes."""
+        if entry.note is not None:
+            return entry.note
+        self._stats.count("bodies_decoded")
+        body = _decode(self._body_bytes(entry.body_at, entry.body_len))
+        return Note(id=entry.id, title=entry.title, body=body, tags=list(entry.tags), created_at=entry.created_at)
+
+    def _lookup(self, note_id: str) -> Optional[Tuple[int, _Entry]]:
+        """Find a note's table position and header by its id hash, without the catalogue."""
+        data, layout = self._map, self._layout
+        target = _id_hash(note_id)
+        low, high = 0, layout.count
+        while low < high:
+            middle = (low + high) // 2
+            if HASH_ENTRY.unpack_from(data, layout.hashes_offset + middle * HASH_ENTRY.size)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        # Several ids may share a hash; compare the ids themselves.
+        while low < layout.count:
+            hashed, position = HASH_ENTRY.unpack_from(data, layout.hashes_offset + low * HASH_ENTRY.size)
+            if hashed != target:
+                return None
+            entry = self._read_header(*self._table_entry(position))
+            if entry.id == note_id:
+                return position, entry
+            low += 1
+        return None
+
+    def _page_from_map(self, limit: Optional[int], offset: int, after_id: Optional[str]) -> List[_Entry]:
+        """A page in storage order read straight from the table, for when the catalogue is not loaded."""
+        start = offset
+        if after_id is not None:
+            found = self._lookup(after_id)
+            if found is None:
+                return []
+            start += found[0] + 1
+        count = self._layout.count
+        stop = count if limit is None else min(count, start + limit)
+        return [self._read_header(*self._table_entry(position)) for position in range(start, stop)]
+
+    # -- catalogue --------------------------------------------------------
+
+    def _catalog(self) -> Dict[str, _Entry]:
+        """Headers of every note by id, decoded from the map on first use."""
+        with self._lock:
+            self._current_map()
+            if self._entries is not None:
+                self._stats.count("cache_hits")
+                return self._entries
+            self._stats.count("cache_misses")
+            self._entries = {}
+            self._positions = {}
+            self._next_position = 0
+            self._tags = TagIndex()
+            self._titles = {}
+            self._sorted = {}
+            with self._stats.timer("read_headers"):
+                for position in range(self._layout.count):
+                    self._put(self._read_header(*self._table_entry(position)))
+            self._ordered = None
+            self.generation += 1
+            if self._previous is not None:
+                previous, self._previous = self._previous, None
+                changed = [
+                    note_id
+                    for note_id, entry in self._entries.items()
+                    if previous.get(note_id) != (entry.crc, entry.created_at)
+                ]
+                changed.extend(note_id for note_id in previous if note_id not in self._entries)
+                self._journal.record(changed)
+            return self._entries
+
+    def _put(self, entry: _Entry) -> Optional[_Entry]:
+        previous = self._entries.get(entry.id)
+        self._entries[entry.id] = entry
+        if previous is None:
+            self._positions[entry.id] = self._next_position
+            self._next_position += 1
+        else:
+            self._tags.remove(entry.id, previous.tags)
+            self._untitle(previous)
+        self._tags.add(entry.id, entry.tags)
+        self._titles.setdefault(normalize_title(entry.title), set()).add(entry.id)
+        for field, order in self._sorted.items():
+            order.add(entry.id, _sort_key(entry, field), self._positions[entry.id])
+        return previous
+
+    def _untitle(self, entry: _Entry) -> None:
+        key = normalize_title(entry.title)
+        ids = self._titles.get(key)
+        if ids is not None:
+            ids.discard(entry.id)
+            if not ids:
+                del self._titles[key]
+
+    def _drop(self, note_id: str) -> Optional[_Entry]:
+        previous = self._entries.pop(note_id, None)
+        if previous is not None:
+            del self._positions[note_id]
+            self._tags.remove(note_id, previous.tags)
+            self._untitle(previous)
+            for order in self._sorted.values():
+                order.remove(note_id)
+        return previous
+
+    def _title_holders(self, key: str) -> Set[str]:
+        return self._titles.get(key, set())
+
+    def _select(
+        self,
+        ids: Optional[Set[str]],
+        sort: Optional[str],
+        limit: Optional[int],
+        offset: int,
+        after_id: Optional[str],
+    ) -> List[_Entry]:
+        """One page of catalogue entries (those in ``ids`` if given), in storage or ``sort`` order."""
+        entries = self._entries
+        stop = None if limit is None else offset + limit
+        if sort is not None:
+            field, reverse = parse_sort(sort)
+            order = self._sorted.get(field)
+            if order is None:
+                order = self._sorted[field] = SortIndex(
+                    (_sort_key(entry, field), self._positions[entry.id], entry.id) for entry in entries.values()
+                )
+            return [entries[note_id] for note_id in islice(order.walk(ids, reverse, after_id), offset, stop)]
+        if ids is None:
+            if self._ordered is None:
+                self._ordered = list(entries.values())
+            selected = self._ordered
+        else:
+            selected = [entries[note_id] for note_id in sorted(ids, key=self._positions.__getitem__)]
+        start = 0
+        if after_id is not None:
+            position = self._positions.get(after_id)
+            if position is None:
+                return []
+            start = bisect_right(selected, position, key=lambda entry: self._positions[entry.id])
+            if not start or selected[start - 1].id != after_id:
+                return []
+        return selected[start + offset:None if stop is None else start + stop]
+
+    def _page(
+        self,
+        tag: Optional[str],
+        tags: Sequence[str],
+        match_any: bool,
+        limit: Optional[int],
+        offset: int,
+        after_id: Optional[str],
+        sort: Optional[str],
+    ) -> List[_Entry]:
+        """Entries for one ``list_notes`` page. Plain storage-order pages come
+        from the map while the catalogue is not loaded, so a first ``--limit 20``
+        reads twenty headers, not all of them."""
+        wanted = [tag, *tags] if tag else list(tags)
+        self._current_map()
+        if self._entries is None and not wanted and sort is None:
+            return self._page_from_map(limit, offset, after_id)
+        self._catalog()
+        ids = self._tags.match(wanted, match_any) if wanted else None
+        return self._select(ids, sort, limit, offset, after_id)
+
+    def _changed(self, note_ids: Iterable[str]) -> None:
+        index_in_sync = self._index_generation == self.generation
+        self._ordered = None
+        self.generation += 1
+        if index_in_sync:
+            self._index_generation = self.generation
+        self._journal.record(note_ids)
+
+    def _poll_changes(self) -> None:
+        self._catalog()
+
+    def watch_paths(self) -> List[Path]:
+        return [self.file_path]
+
+    # -- writing ----------------------------------------------------------
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """The file lock for a mutation, taken under ``self._lock``; inside
+        ``batch()`` it waits for the commit."""
+        if self._batch_depth:
+            yield
+        else:
+            with self._file_lock:
+                yield
+
+    def _persist(self, changes: Mapping[str, Optional[Note]]) -> None:
+        if self._batch_depth:
+            self._dirty = True
+            self._pending.update(changes)
+        else:
+            self._write_out()
+
+    def _rebase(self) -> None:
+        """Read the file another process rewrote during ``batch()`` and apply
+        the batch's changes on top of it."""
+        pending, self._pending = self._pending, {}
+        self._dirty = False
+        self._catalog()
+        for note_id, note in pending.items():
+            if note is None:
+                self._drop(note_id)
+            else:
+                self._put(_Entry.fresh(note))
+        self._ordered = None
+        self._dirty = True
+
+    def _write_out(self) -> None:
+        """Append new bodies to the body file (or compact it), then write the headers
+        to a new header file and swap it in."""
+        entries = list(self._entries.values())
+        generation = 0 if self._layout is None else self._layout.body_generation
+        body_path = self._body_path(generation)
+        try:
+            size = body_path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        live = sum(entry.body_len for entry in entries if entry.note is None)
+        compact = size - live >= BODY_COMPACT_MIN_BYTES and size - live > live
+        tag_ids: Dict[str, int] = {}
+        table = bytearray()
+        hashes: List[Tuple[int, int]] = []
+        bodies: List[Tuple[int, int]] = []
+        tmp_path = self.file_path.with_name(f"{self.file_path.name}.{os.getpid()}.tmp")
+        with self._stats.timer("write"):
+            if compact:
+                generation += 1
+                body_path = self._body_path(generation)
+            with body_path.open("wb" if compact else "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                written = offset
+                for entry in entries:
+                    if entry.note is not None:
+                        body = _encode(entry.note.body)
+                    elif compact:
+                        body = self._body_bytes(entry.body_at, entry.body_len)
+                    else:
+                        bodies.append((entry.body_at, entry.body_len))
+                        continue
+                    f.write(body)
+                    bodies.append((offset, len(body)))
+                    offset += len(body)
+                written = offset - written
+            with tmp_path.open("wb") as f:
+                f.write(bytes(HEADER.size))
+                offset = HEADER.size
+                for position, (entry, (body_at, body_len)) in enumerate(zip(entries, bodies)):
+                    note_id, created_at, title = _encode(entry.id), _encode(entry.created_at), _encode(entry.title)
+                    ids = [tag_ids.setdefault(tag, len(tag_ids)) for tag in entry.tags]
+                    record = b"".join(
+                        [
+                            RECORD.pack(len(note_id), len(created_at), len(title), len(ids), body_at, body_len),
+                            note_id,
+                            created_at,
+                            title,
+                            struct.pack(f"<{len(ids)}I", *ids),
+                        ]
+                    )
+                    f.write(record)
+                    table += TABLE_ENTRY.pack(offset, entry.crc)
+                    hashes.append((_id_hash(entry.id), position))
+                    offset += len(record)
+                tags_offset = offset
+                for tag in tag_ids:
+                    name = _encode(tag)
+                    f.write(TAG_LENGTH.pack(len(name)))
+                    f.write(name)
+                    offset += TAG_LENGTH.size + len(name)
+                table_offset = offset
+                f.write(table)
+                hashes.sort()
+                f.write(b"".join(HASH_ENTRY.pack(hashed, position) for hashed, position in hashes))
+                written += f.tell()
+                f.seek(0)
+                f.write(
+                    HEADER.pack(
+                        MAGIC, FORMAT_VERSION, 0, len(entries), len(tag_ids),
+                        tags_offset, table_offset, table_offset + len(table), generation,
+                    )
+                )
+            # A mapped file cannot be replaced on Windows, so unmap it first.
+            self._close_map()
+            try:
+                os.replace(tmp_path, self.file_path)
+            finally:
+                self._open_map()
+        self._stats.count("bytes_written", written)
+        for entry, (body_at, body_len) in zip(entries, bodies):
+            entry.body_at, entry.body_len, entry.note = body_at, body_len, None
+        self._signature = self._stat()
+        self._dirty = False
+        self._pending = {}
+        if compact:
+            self._stats.count("body_compactions")
+            self._bodies.clear()
+            self._close_body_map()
+            for stale in self.file_path.parent.glob(f"{self.file_path.name}.*.body"):
+                if stale != body_path:
+                    try:
+                        stale.unlink()
+                    except OSError:  # still mapped by another process (Windows); removed next time
+                        pass
+
+    def commit(self) -> None:
+        with self._lock:
+            if self._dirty:
+                with self._file_lock:
+                    if self._stat() != self._signature:
+                        self._rebase()
+                    self._write_out()
+
+    def close(self) -> None:
+        with self._lock:
+            self.commit()
+            self._close_map()
+            self._close_body_map()
+
+    # -- search index -----------------------------------------------------
+
+    def _search_index(self) -> InvertedIndex:
+        with self._lock:
+            entries = self._catalog()
+            if self._index is None:
+                with self._stats.timer("index_load"):
+                    self._index = InvertedIndex.load(self.index_path)
+            if self._index_generation != self.generation:
+                with self._stats.timer("index_sync"):
+                    self._index.sync_fingerprints(
+                        ((entry.id, entry.crc) for entry in entries.values()),
+                        lambda note_id: self._full_note(entries[note_id]),
+                    )
+                self._index_generation = self.generation
+            return self._index
+
+    def _index_apply(self, notes: Iterable[Note] = (), removed: Iterable[str] = ()) -> None:
+        if self._index is not None:
+            self._index.apply(notes, removed)
+            return
+        records = [InvertedIndex.record(note) for note in notes]
+        records.extend({"id": note_id, "deleted": True} for note_id in removed)
+        InvertedIndex.append(self.index_path, records)
+
+    def _misspellings(self, term: str) -> List[str]:
+        with self._lock:
+            expanded = self._search_index().expansion(term, prefix=True, fuzzy=True)
+        return [token for token in expanded if not token.startswith(term)]
+
+    @instrumented("rebuild_index")
+    def rebuild_index(self) -> int:
+        with self._lock:
+            entries = self._catalog()
+            self._index = InvertedIndex(self.index_path)
+            self._index.rebuild(self._full_note(entry) for entry in entries.values())
+            self._index_generation = self.generation
+            return len(self._index)
+
+    # -- reads ------------------------------------------------------------
+
+    @instrumented("list_headers")
+    def list_headers(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[NoteHeader]:
+        """``list_notes`` without the bodies, which are never read."""
+        with self._lock:
+            return [entry.header() for entry in self._page(tag, tags, match_any, limit, offset, after_id, sort)]
+
+    @instrumented("list_notes")
+    def list_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        with self._lock:
+            return [self._note(entry) for entry in self._page(tag, tags, match_any, limit, offset, after_id, sort)]
+
+    @instrumented("iter_notes", streams=True)
+    def iter_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        # Callers stream every body (export, migrate), so bodies are decoded
+        # here, a chunk at a time, rather than through the cache. Each chunk
+        # is selected afresh after the last note yielded, so a rewrite in
+        # between cannot leave the iterator pointing into a replaced map.
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = ITER_CHUNK if remaining is None else min(ITER_CHUNK, remaining)
+            with self._lock:
+                chunk = [self._full_note(entry) for entry in self._page(tag, tags, match_any, size, offset, after_id, sort)]
+            yield from chunk
+            if len(chunk) < size:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            after_id, offset = chunk[-1].id, 0
+
+    @instrumented("get_note")
+    def get_note(self, note_id: str) -> Optional[Note]:
+        with self._lock:
+            self._current_map()
+            if self._entries is not None:
+                entry = self._entries.get(note_id)
+            else:
+                found = self._lookup(note_id)
+                entry = None if found is None else found[1]
+            return None if entry is None else self._note(entry)
+
+    @instrumented("get_by_title")
+    def get_by_title(self, title: str) -> Optional[Note]:
+        with self._lock:
+            entries = self._catalog()
+            ids = self._titles.get(normalize_title(title))
+            if not ids:
+                return None
+            return self._note(entries[min(ids, key=self._positions.__getitem__)])
+
+    @instrumented("tags")
+    def tags(self) -> Dict[str, int]:
+        with self._lock:
+            self._catalog()
+            return self._tags.counts()
+
+    @instrumented("search")
+    def search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode!r}")
+        parsed = Query() if mode == "substring" else parse_query(query)
+        with self._lock:
+            entries = self._catalog()
+            self._stats.count("searches")
+            if parsed.is_empty():
+                self._stats.count("search_scanned", len(entries))
+                ids = {entry.id for entry in entries.values() if self._full_note(entry).matches_keyword(query)}
+                return [self._note(entry) for entry in self._select(ids, sort, limit, offset, after_id)]
+            ids, scores, scanned = evaluate(
+                parsed,
+                self._search_index(),
+                self._tags,
+                entries.keys,
+                lambda note_id: entries[note_id].created_at,
+                lambda note_id: self._full_note(entries[note_id]),
+                fuzzy=mode == "fuzzy",
+            )
+            self._stats.count("search_scanned", scanned)
+            if sort is not None or scores is None:
+                return [self._note(entry) for entry in self._select(ids, sort, limit, offset, after_id)]
+            k = None if limit is None or after_id is not None else offset + limit
+            ranked = (entries[note_id] for note_id in rank(scores, self._positions.__getitem__, k))
+            return [self._note(entry) for entry in paginate(ranked, limit, offset, after_id)]
+
+    @instrumented("iter_search", streams=True)
+    def iter_search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        yield from self.search(query, mode, limit, offset, after_id, sort)
+
+    # -- writes -----------------------------------------------------------
+
+    @instrumented("add_note")
+    def add_note(self, title: str, body: str, tags: Optional[List[str]] = None) -> Note:
+        note = Note(id=str(uuid.uuid4()), title=title, body=body, tags=tags or [])
+        self.import_notes([note])
+        return note
+
+    @instrumented("update_note")
+    def update_note(self, note_id: str, title: str, body: str, tags: Optional[List[str]] = None) -> Optional[Note]:
+        updated = self.update_many([{"id": note_id, "title": title, "body": body, "tags": tags}])
+        return updated[0] if updated else None
+
+    @instrumented("import_notes")
+    def import_notes(self, notes: Iterable[Note], unique_titles: bool = True) -> int:
+        notes = list(notes)
+        if not notes:
+            return 0
+        with self._lock, self._writing():
+            self._catalog()
+            if unique_titles:
+                check_titles(notes, self._title_holders)
+            for note in notes:
+                self._put(_Entry.fresh(note))
+            self._persist({note.id: note for note in notes})
+            self._index_apply(notes)
+            self._changed(note.id for note in notes)
+        return len(notes)
+
+    @instrumented("update_many")
+    def update_many(self, items: Iterable[Mapping]) -> List[Note]:
+        with self._lock, self._writing():
+            entries = self._catalog()
+            updated: List[Note] = []
+            for item in items:
+                existing = entries.get(item["id"])
+                if existing is None:
+                    continue
+                updated.append(
+                    Note(
+                        id=existing.id,
+                        title=item["title"],
+                        body=item["body"],
+                        tags=list(item.get("tags") or []),
+                        created_at=existing.created_at,
+                    )
+                )
+            if updated:
+                check_titles(updated, self._title_holders)
+                for note in updated:
+                    self._put(_Entry.fresh(note))
+                self._persist({note.id: note for note in updated})
+                self._index_apply(updated)
+                self._changed(note.id for note in updated)
+        return updated
+
+    @instrumented("delete")
+    def delete(self, note_id: str) -> bool:
+        return self.delete_many([note_id]) == 1
+
+    @instrumented("delete_many")
+    def delete_many(self, note_ids: Iterable[str]) -> int:
+        with self._lock, self._writing():
+            self._catalog()
+            removed = [note_id for note_id in note_ids if self._drop(note_id) is not None]
+            if removed:
+                self._persist(dict.fromkeys(removed))
+                self._index_apply(removed=removed)
+                self._changed(removed)
+        return len(removed)
@@ -0,0 +1,186 @@
+"""
+Change feed of the SmartNotes storage backends and a watcher that follows it.
+"""
+
+from __future__ import annotations
+
+import os
+import select
+import sys
+import threading
+from collections import deque
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Deque, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .models import Note
+
+if TYPE_CHECKING:
+    from .base import BaseNoteStorage
+
+# Changes remembered per storage; a reader further behind has to reload.
+CHANGE_JOURNAL_SIZE = 1024
+# The watcher asks the storage for changes this often, inotify or not.
+WATCH_INTERVAL = 1.0
+# After an inotify event, wait this long for the writer to finish the file.
+WATCH_SETTLE = 0.05
+# IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_INOTIFY_MASK = 0x002 | 0x040 | 0x080 | 0x100 | 0x200
+
+
+class Changes(NamedTuple):
+    # Pass this back to the next changes_since call.
+    seq: int
+    # Notes added or updated since the sequence number asked for, as they are now.
+    notes: List[Note]
+    deleted: List[str]
+    # False if the storage cannot tell what changed (its journal no longer
+    # reaches back that far, or another process rewrote the store in a way it
+    # cannot diff); the caller has to reread whatever it shows.
+    complete: bool
+
+
+class ChangeJournal:
+    """Sequence numbers for note changes, keeping the ids of the last ``size`` of them.
+
+    Every changed note id gets the next number. ``reset`` records a change
+    whose notes are unknown, so every reader from before it has to reload.
+    """
+
+    def __init__(self, size: int = CHANGE_JOURNAL_SIZE) -> None:
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._entries: Deque[Tuple[int, str]] = deque(maxlen=size)
+        # changes_since can answer exactly for any seq from here on.
+        self._floor = 0
+
+    def record(self, note_ids: Iterable[str]) -> None:
+        with self._lock:
+            for note_id in note_ids:
+                if len(self._entries) == self._entries.maxlen:
+                    self._floor = self._entries[0][0]
+                self.seq += 1
+                self._entries.append((self.seq, note_id))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.seq += 1
+            self._floor = self.seq
+            self._entries.clear()
+
+    def since(self, seq: int) -> Tuple[int, Optional[List[str]]]:
+        """The current sequence number and the ids changed after ``seq``, oldest
+        change first; None instead of the ids if the journal cannot tell."""
+        with self._lock:
+            if not self._floor <= seq <= self.seq:
+                return self.seq, None
+            ids: List[str] = []
+            for entry_seq, note_id in reversed(self._entries):
+                if entry_seq <= seq:
+                    break
+                ids.append(note_id)
+            return self.seq, list(dict.fromkeys(reversed(ids)))
+
+
+def _inotify(directories: Iterable[Path]) -> Optional[int]:
+    """A non-blocking inotify descriptor watching ``directories``; None where inotify is unavailable."""
+    if not sys.platform.startswith("linux"):
+        return None
+    import ctypes
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    for directory in directories:
+        if libc.inotify_add_watch(fd, os.fsencode(directory), _INOTIFY_MASK) < 0:
+            os.close(fd)
+            return None
+    return fd
+
+
+class ChangeWatcher:
+    """Calls ``callback(changes)`` on a background thread whenever ``storage`` changes.
+
+    Where inotify is available (Linux) the watcher wakes up as soon as one of
+    the storage's files changes; it also polls every ``interval`` seconds, so
+    without inotify, or for a missed event, a change just shows up later.
+    ``changes`` is what ``storage.changes_since`` returned, starting from the
+    sequence number current at ``start()``. The callback must not touch GUI
+    widgets directly; hand the changes over to the GUI thread instead.
+    """
+
+    def __init__(
+        self,
+        storage: "BaseNoteStorage",
+        callback: Callable[[Changes], None],
+        interval: float = WATCH_INTERVAL,
+        use_inotify: bool = True,
+    ) -> None:
+        self.storage = storage
+        self.callback = callback
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.seq = 0
+        self._fd: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def inotify(self) -> bool:
+        """Whether the running watcher is woken by inotify rather than only polling."""
+        return self._fd is not None
+
+    def start(self) -> "ChangeWatcher":
+        self.seq = self.storage.sequence
+        if self.use_inotify:
+            directories: Set[Path] = {path.parent for path in self.storage.watch_paths()}
+            self._fd = _inotify(sorted(directories))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="smartnotes-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _wait(self) -> None:
+        if self._fd is None:
+            self._stop.wait(self.interval)
+            return
+        ready, _, _ = select.select([self._fd], [], [], self.interval)
+        if ready:
+            # Let a rewrite finish, then drop the whole burst of events at once.
+            self._stop.wait(WATCH_SETTLE)
+            try:
+                while os.read(self._fd, 1 << 16):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wait()
+            if self._stop.is_set():
+                return
+            try:
+                changes = self.storage.changes_since(self.seq)
+            except Exception:  # e.g. a file caught mid-rewrite; the next round retries
+                continue
+            if changes.seq != self.seq:
+                self.seq = changes.seq
+                self.callback(changes)
+
+    def __enter__(self) -> "ChangeWatcher":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,45 @@
+"""
+Data locations and backend selection for SmartNotes.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+# Created by whichever backend first writes there, not on import.
+DATA_DIR = Path(__file__).resolve().parents[2] / "data"
+DATA_FILE = DATA_DIR / "notes.json"
+SQLITE_FILE = DATA_DIR / "notes.sqlite3"
+BINARY_FILE = DATA_DIR / "notes.snb"
+# Directory of the sharded backend: manifest.json plus one layout of shard files.
+SHARDS_DIR = DATA_DIR / "shards"
+CONFIG_FILE = DATA_DIR / "config.json"
+# Written by a running ``smartnotes.server`` so the CLI can find it.
+SERVER_FILE = DATA_DIR / "server.json"
+
+BACKEND_ENV = "SMARTNOTES_BACKEND"
+DEFAULT_BACKEND = "json"
+SERVER_ENV = "SMARTNOTES_SERVER"
+
+
+def load_config(path: Path = CONFIG_FILE) -> dict:
+    """Read ``data/config.json``; a missing or broken file means defaults."""
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def resolve_backend(name: Optional[str] = None) -> str:
+    """Pick the backend: explicit name, then $SMARTNOTES_BACKEND, then config, then JSON."""
+    return (
+        name
+        or os.environ.get(BACKEND_ENV)
+        or load_config().get("backend")
+        or DEFAULT_BACKEND
+    )
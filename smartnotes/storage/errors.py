@@ -0,0 +1,23 @@
+"""
+Errors raised by SmartNotes storage backends.
+"""
+
+from __future__ import annotations
+
+
+class DuplicateTitleError(ValueError):
+    """A note with the same title (ignoring case and surrounding spaces) already exists."""
+
+    def __init__(self, title: str, existing_id: str) -> None:
+        super().__init__(f"Note titled {title!r} already exists: {existing_id}")
+        self.title = title
+        self.existing_id = existing_id
+
+
+class CorruptStorageError(ValueError):
+    """A storage file exists but cannot be parsed; it is left untouched rather than read as empty."""
+
+    def __init__(self, path: object, reason: str) -> None:
+        super().__init__(f"{path} is corrupt: {reason}")
+        self.path = path
+        self.reason = reason
@@ -0,0 +1,1051 @@
+"""
+JSON file backend: a notes.json snapshot, optionally with an append-only log.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from itertools import islice
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+from ..index import InvertedIndex, SortIndex, TagIndex, normalize_tag, normalize_title
+from ..query import Query, evaluate, parse_query, rank
+from .base import SEARCH_MODES, BaseNoteStorage, check_titles, paginate, parse_sort
+from .changes import ChangeJournal
+from .config import DATA_FILE
+from .errors import CorruptStorageError
+from .filelock import FileLock
+from .models import Note
+from .stats import StorageStats, instrumented
+
+STORAGE_MODES = ("json", "log")
+# The log is folded back into the snapshot once it is both bigger than
+# LOG_COMPACT_MIN_BYTES and at least LOG_COMPACT_RATIO of the snapshot size.
+LOG_COMPACT_MIN_BYTES = 256 * 1024
+LOG_COMPACT_RATIO = 0.5
+# Encoded JSON is written to notes.json in pieces of about this many characters.
+DUMP_CHUNK_CHARS = 1 << 13
+
+# (st_mtime_ns, st_size, st_ino) of the snapshot and the log; None if missing.
+FileSignature = Tuple[Optional[Tuple[int, int, int]], ...]
+
+
+def _sort_key(note: Note, field: str) -> str:
+    return note.created_at if field == "date" else normalize_title(note.title)
+
+
+def iter_json_array(f: IO[str], chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """Yield the items of a top-level JSON array of objects as they are read.
+
+    Works on any formatting of the array, so existing ``indent=2`` files stream
+    just like compact ones. Anything but a complete array, a truncated tail
+    included, raises ``json.JSONDecodeError`` once the items before it are out.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def next_char() -> str:
+        nonlocal buf, pos, eof
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos] if pos < len(buf) else ""
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+    if next_char() != "[":
+        raise json.JSONDecodeError("Expecting '['", buf, pos)
+    pos += 1
+    while True:
+        char = next_char()
+        if char == ",":
+            pos += 1
+            continue
+        if char == "]":
+            return
+        if not char:
+            raise json.JSONDecodeError("Unterminated array", buf, pos)
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        pos = end
+        yield item
+
+
+@dataclass
+class _Commit:
+    """Log records of mutations written together by one group commit."""
+
+    records: List[dict] = field(default_factory=list)
+    done: bool = False
+    error: Optional[BaseException] = None
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+    generation: int
+
+
+class NoteStorage(BaseNoteStorage):
+    """Lightweight JSON storage for notes.
+
+    In ``"json"`` mode every mutation rewrites ``notes.json``. In ``"log"`` mode
+    mutations are appended to ``notes.json.log`` as ``add``/``update``/``delete``
+    records, reads replay that log over the ``notes.json`` snapshot, and the log
+    is folded back into the snapshot by a background compaction. Both modes
+    share the snapshot format, so existing files are picked up as they are.
+
+    Writes are crash-safe: the snapshot is written to a temporary file, fsynced
+    and renamed over ``notes.json``, and log records are fsynced once appended,
+    so an interrupted write leaves the previous state rather than a truncated
+    file; a file that still cannot be parsed raises ``CorruptStorageError``.
+    Every mutation holds an advisory lock on ``notes.json.lock`` from reading
+    the files to writing them, so processes sharing the files never lose one
+    another's updates. Inside ``batch()`` mutations only change the cache and
+    the lock is taken by the commit, which reads the files again if another
+    process changed them and writes the batch on top, so a long batch (a shell
+    session, say) never keeps other writers waiting. Threads mutating the same
+    instance are group-committed:
+    while one write is on its way to disk the next mutations collect behind it
+    and go out together, in one rewrite or one append.
+
+    Parsed notes are kept in memory and reused for as long as the files on
+    disk keep the stat signature seen at the last read or write; a change made
+    by another process triggers a reparse, diffed against the old cache for
+    ``changes_since``. In ``"log"`` mode records another process appended are
+    read from where the last read stopped and applied to the cache instead.
+    Notes handed out are shared with the cache and must be treated as read-only.
+
+    ``search`` is answered from an inverted index kept in ``notes.json.idx``;
+    it is loaded on the first search and kept up to date on every mutation.
+    Matches are ranked by BM25 from the token counts the index keeps.
+    Tag filters and ``tags()`` use an in-memory tag index built with the cache,
+    title uniqueness and ``get_by_title`` a normalised-title index. Sorted
+    reads use a ``SortIndex`` per field, built by the first such read and then
+    updated in place, so ``sort`` with a ``limit`` is a top-k read.
+    ``iter_notes``/``iter_search`` on a cold cache stream the file instead, so
+    the first notes come out before the rest of the file has been parsed.
+
+    ``stats()`` adds the phases of every call: time spent reading, parsing,
+    serialising and writing the files, the bytes moved, cache hits and misses,
+    and how many notes each search had to look at.
+    """
+
+    def __init__(
+        self,
+        file_path: Path = DATA_FILE,
+        mode: str = "json",
+        compact_min_bytes: int = LOG_COMPACT_MIN_BYTES,
+        compact_ratio: float = LOG_COMPACT_RATIO,
+    ) -> None:
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode: {mode!r}")
+        self.file_path = file_path
+        self.log_path = file_path.with_name(file_path.name + ".log")
+        self.index_path = file_path.with_name(file_path.name + ".idx")
+        self.lock_path = file_path.with_name(file_path.name + ".lock")
+        self.mode = mode
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(self.lock_path)
+        # True while we hold the file lock for mutations not all written yet;
+        # the cache is then ahead of the files and no one else can change them.
+        self._writing = False
+        # Mutations waiting for the next group commit, and whether one runs.
+        self._open_commit = _Commit()
+        self._committing = False
+        self._committed = threading.Condition(self._lock)
+        self._compactor: Optional[threading.Thread] = None
+        self._by_id: Dict[str, Note] = {}
+        self._ordered: Optional[List[Note]] = None
+        # File order of every cached note, so index hits can be ordered
+        # without walking the whole notebook.
+        self._positions: Dict[str, int] = {}
+        self._next_position = 0
+        self._tags = TagIndex()
+        # normalize_title(title) -> ids; more than one only in files written
+        # before titles were unique.
+        self._titles: Dict[str, Set[str]] = {}
+        # Sort field ("date"/"title") -> its order, for fields sorted by so far.
+        self._sorted: Dict[str, SortIndex] = {}
+        self._signature: Optional[FileSignature] = None
+        # Bytes at the start of the log the cache reflects; None if unknown.
+        self._log_offset: Optional[int] = None
+        # Log records held back by batch(), without the file lock; applied again
+        # whenever the cache is reread, until the commit writes them.
+        self._deferred: List[dict] = []
+        self._stats = StorageStats()
+        self._journal = ChangeJournal()
+        # Bumped whenever the cached notes change, by us or by a reparse.
+        self.generation = 0
+        self._index: Optional[InvertedIndex] = None
+        # Generation the index was last reconciled with.
+        self._index_generation = -1
+        if not self.file_path.exists():
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._file_lock:
+                # Another process may have created it while we waited.
+                if not self.file_path.exists():
+                    self._write([])
+
+    def _stat(self) -> FileSignature:
+        signature = []
+        for path in (self.file_path, self.log_path):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        return tuple(signature)
+
+    def _load(self) -> Dict[str, Note]:
+        """Return the cached notes by id, reparsing only if the files changed."""
+        with self._lock:
+            # While we hold the file lock the cache is ahead of the files on purpose.
+            if self._writing and self._signature is not None:
+                self._stats.count("cache_hits")
+                return self._by_id
+            signature = self._stat()
+            if signature == self._signature:
+                self._stats.count("cache_hits")
+                return self._by_id
+            if self._follow_log(signature):
+                self._signature = signature
+                return self._by_id
+            self._stats.count("cache_misses")
+            # The first load is the baseline; later ones are diffed against it.
+            previous = self._by_id if self.generation else None
+            self._by_id = {}
+            self._positions = {}
+            self._next_position = 0
+            self._tags = TagIndex()
+            self._titles = {}
+            self._sorted = {}
+            for entry in self._read():
+                self._put(Note(**entry))
+            self._apply(self._deferred)
+            self._ordered = None
+            self._signature = signature
+            self.generation += 1
+            if previous is not None:
+                self._journal.record(self._diff(previous))
+            return self._by_id
+
+    def _diff(self, previous: Dict[str, Note]) -> List[str]:
+        """Ids whose note differs between ``previous`` and the cache."""
+        current = self._by_id
+        changed = [note_id for note_id, note in current.items() if previous.get(note_id) != note]
+        changed.extend(note_id for note_id in previous if note_id not in current)
+        return changed
+
+    def _follow_log(self, signature: FileSignature) -> bool:
+        """Apply the records another process appended to the log since it was last read.
+
+        Only possible while the snapshot is the one parsed and the log is the
+        same file, grown; returns False when a full reparse is needed instead.
+        """
+        old, log = self._signature, signature[1]
+        if self.mode != "log" or old is None or self._log_offset is None or signature[0] != old[0]:
+            return False
+        if log is None or log[1] < self._log_offset or (old[1] is not None and old[1][2] != log[2]):
+            return False
+        with self._stats.timer("read"):
+            with self.log_path.open("rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        # A record still being appended is picked up by the next read.
+        end = data.rfind(b"\n") + 1
+        self._stats.count("bytes_read", len(data))
+        self._stats.count("log_follows")
+        records: List[dict] = []
+        with self._stats.timer("parse"):
+            for line in data[:end].decode("utf-8").splitlines():
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+            changed = self._apply(records)
+        self._log_offset += end
+        if changed:
+            # Our own batch still has the last word on the notes it changed.
+            self._apply(self._deferred)
+            self._ordered = None
+            self.generation += 1
+            self._journal.record(changed)
+        return True
+
+    def _apply(self, records: List[dict]) -> List[str]:
+        """Apply log records to the cache; returns the ids they changed."""
+        changed: List[str] = []
+        for record in records:
+            if record["op"] == "delete":
+                if self._drop(record["id"]) is not None:
+                    changed.append(record["id"])
+            else:
+                note = Note(**record["note"])
+                self._put(note)
+                changed.append(note.id)
+        return changed
+
+    def _put(self, note: Note) -> Optional[Note]:
+        """Place a note in the cache and its in-memory indexes; returns the note replaced."""
+        previous = self._by_id.get(note.id)
+        self._by_id[note.id] = note
+        if previous is None:
+            self._positions[note.id] = self._next_position
+            self._next_position += 1
+        else:
+            self._tags.remove(note.id, previous.tags)
+            self._untitle(previous)
+        self._tags.add(note.id, note.tags)
+        self._titles.setdefault(normalize_title(note.title), set()).add(note.id)
+        for field, order in self._sorted.items():
+            order.add(note.id, _sort_key(note, field), self._positions[note.id])
+        return previous
+
+    def _untitle(self, note: Note) -> None:
+        key = normalize_title(note.title)
+        ids = self._titles.get(key)
+        if ids is not None:
+            ids.discard(note.id)
+            if not ids:
+                del self._titles[key]
+
+    def _title_holders(self, key: str) -> Set[str]:
+        return self._titles.get(key, set())
+
+    def _drop(self, note_id: str) -> Optional[Note]:
+        previous = self._by_id.pop(note_id, None)
+        if previous is not None:
+            del self._positions[note_id]
+            self._tags.remove(note_id, previous.tags)
+            self._untitle(previous)
+            for order in self._sorted.values():
+                order.remove(note_id)
+        return previous
+
+    def _in_order(self, ids: Set[str]) -> List[Note]:
+        return [self._by_id[note_id] for note_id in sorted(ids, key=self._positions.__getitem__)]
+
+    def _sorted_page(
+        self,
+        ids: Optional[Set[str]],
+        sort: str,
+        limit: Optional[int],
+        offset: int,
+        after_id: Optional[str],
+    ) -> List[Note]:
+        """One page of the cached notes (those in ``ids`` if given) in ``sort`` order."""
+        field, reverse = parse_sort(sort)
+        order = self._sorted.get(field)
+        if order is None:
+            order = self._sorted[field] = SortIndex(
+                (_sort_key(note, field), self._positions[note.id], note.id) for note in self._by_id.values()
+            )
+        page = islice(order.walk(ids, reverse, after_id), offset, None if limit is None else offset + limit)
+        return [self._by_id[note_id] for note_id in page]
+
+    def _notes(self) -> List[Note]:
+        with self._lock:
+            by_id = self._load()
+            if self._ordered is None:
+                self._ordered = list(by_id.values())
+            return self._ordered
+
+    def _changed(self, note_ids: Iterable[str]) -> None:
+        """Record a mutation of ``note_ids`` made through this instance."""
+        index_in_sync = self._index_generation == self.generation
+        self._ordered = None
+        self.generation += 1
+        if index_in_sync:
+            self._index_generation = self.generation
+        self._journal.record(note_ids)
+
+    def _written_signature(self) -> FileSignature:
+        """The files' signature after a write of ours, to compare the next read against."""
+        signature = self._stat()
+        log = signature[1]
+        if self.mode == "log" and log is not None and self._log_offset is not None and log[1] != self._log_offset:
+            # Another process appended to the log too; leave the log part
+            # unknown so the next read follows it from ``_log_offset``.
+            return (signature[0], None)
+        return signature
+
+    def _poll_changes(self) -> None:
+        self._load()
+
+    def watch_paths(self) -> List[Path]:
+        return [self.file_path, self.log_path]
+
+    def _search_index(self) -> InvertedIndex:
+        with self._lock:
+            notes = self._load()
+            if self._index is None:
+                with self._stats.timer("index_load"):
+                    self._index = InvertedIndex.load(self.index_path)
+            if self._index_generation != self.generation:
+                with self._stats.timer("index_sync"):
+                    self._index.sync(notes.values())
+                self._index_generation = self.generation
+            return self._index
+
+    def _index_apply(self, notes: Iterable[Note] = (), removed: Iterable[str] = ()) -> None:
+        if self._index is not None:
+            self._index.apply(notes, removed)
+            return
+        # Not loaded in this process: append to the sidecar blindly, it is
+        # reconciled with the notes when it is next loaded anyway.
+        records = [InvertedIndex.record(note) for note in notes]
+        records.extend({"id": note_id, "deleted": True} for note_id in removed)
+        InvertedIndex.append(self.index_path, records)
+
+    def _misspellings(self, term: str) -> List[str]:
+        with self._lock:
+            expanded = self._search_index().expansion(term, prefix=True, fuzzy=True)
+        return [token for token in expanded if not token.startswith(term)]
+
+    @instrumented("rebuild_index")
+    def rebuild_index(self) -> int:
+        """Rebuild the search index sidecar from scratch; returns the note count."""
+        with self._lock:
+            notes = self._load()
+            self._index = InvertedIndex(self.index_path)
+            self._index.rebuild(notes.values())
+            self._index_generation = self.generation
+            return len(self._index)
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            stats = self._stats
+            return CacheInfo(stats.counter("cache_hits"), stats.counter("cache_misses"), len(self._by_id), self.generation)
+
+    def _read_text(self, path: Path) -> str:
+        with self._stats.timer("read"):
+            with path.open("r", encoding="utf-8") as f:
+                text = f.read()
+                self._stats.count("bytes_read", os.fstat(f.fileno()).st_size)
+        return text
+
+    def _read(self) -> List[dict]:
+        with self._lock:
+            # Read and parsed separately (as json.load does anyway) so the
+            # stats can tell disk time from parse time.
+            text = self._read_text(self.file_path)
+            with self._stats.timer("parse"):
+                try:
+                    data = json.loads(text)
+                except json.JSONDecodeError as exc:
+                    raise CorruptStorageError(self.file_path, str(exc)) from None
+            del text
+            self._log_offset = 0
+            if self.log_path.exists():
+                data = self._replay_log(data)
+        return data
+
+    def _replay_log(self, snapshot: List[dict]) -> List[dict]:
+        notes: Dict[str, dict] = {entry["id"]: entry for entry in snapshot}
+        text = self._read_text(self.log_path)
+        # Up to the last complete record; _follow_log carries on from there.
+        self._log_offset = len(text[:text.rfind("\n") + 1].encode("utf-8"))
+        lines = text.splitlines()
+        with self._stats.timer("parse"):
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn tail left by an interrupted append.
+                    continue
+                if record["op"] == "delete":
+                    notes.pop(record["id"], None)
+                else:
+                    entry = record["note"]
+                    notes[entry["id"]] = entry
+        return list(notes.values())
+
+    def _iter_entries(self) -> Iterator[dict]:
+        """Stream the entries ``_read`` would return, in the same order."""
+        # The log is bounded by compaction, so it is read up front: ``overrides``
+        # holds its final word per id (None = deleted), and ``moved`` the ids a
+        # delete has taken out of their snapshot position.
+        overrides: Dict[str, Optional[dict]] = {}
+        moved: Set[str] = set()
+        self._stats.count("streamed_reads")
+        if self.log_path.exists():
+            with self.log_path.open("r", encoding="utf-8") as f:
+                self._stats.count("bytes_read", os.fstat(f.fileno()).st_size)
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record["op"] == "delete":
+                        overrides.pop(record["id"], None)
+                        overrides[record["id"]] = None
+                        moved.add(record["id"])
+                    else:
+                        entry = record["note"]
+                        overrides[entry["id"]] = entry
+        with self.file_path.open("r", encoding="utf-8") as f:
+            self._stats.count("bytes_read", os.fstat(f.fileno()).st_size)
+            entries = iter_json_array(f)
+            while True:
+                try:
+                    entry = next(entries, None)
+                except json.JSONDecodeError as exc:
+                    raise CorruptStorageError(self.file_path, str(exc)) from None
+                if entry is None:
+                    break
+                note_id = entry["id"]
+                if note_id in moved:
+                    continue
+                if note_id in overrides:
+                    entry = overrides.pop(note_id)
+                    if entry is None:
+                        continue
+                yield entry
+        for entry in overrides.values():
+            if entry is not None:
+                yield entry
+
+    def _stream(
+        self,
+        predicate: Optional[Callable[[Note], bool]] = None,
+        counter: Optional[str] = None,
+    ) -> Iterator[Note]:
+        """Notes parsed one by one from the files; ``counter`` tallies how many were read."""
+        scanned = 0
+        try:
+            for entry in self._iter_entries():
+                scanned += 1
+                note = Note(**entry)
+                if predicate is None or predicate(note):
+                    yield note
+        finally:
+            if counter is not None:
+                self._stats.count(counter, scanned)
+
+    def _is_warm(self) -> bool:
+        with self._lock:
+            return self._signature is not None and self._signature == self._stat()
+
+    def _page(
+        self,
+        notes: List[Note],
+        limit: Optional[int],
+        offset: int,
+        after_id: Optional[str],
+    ) -> List[Note]:
+        """``paginate`` for cached notes in file order, seeking the cursor by position."""
+        start = 0
+        if after_id is not None:
+            position = self._positions.get(after_id)
+            if position is None:
+                return []
+            start = bisect_right(notes, position, key=lambda note: self._positions[note.id])
+            if not start or notes[start - 1].id != after_id:
+                # The cursor note exists but is not among these notes.
+                return []
+        start += offset
+        return notes[start:] if limit is None else notes[start:start + limit]
+
+    def _write(self, notes: Iterable[dict]) -> None:
+        """Replace the snapshot atomically; the caller holds the file lock."""
+        tmp_path = self.file_path.with_name(self.file_path.name + ".tmp")
+        self._dump(tmp_path, notes)
+        os.replace(tmp_path, self.file_path)
+        # The snapshot now holds everything the log described.
+        self.log_path.unlink(missing_ok=True)
+        self._sync_dir()
+
+    def _sync_dir(self) -> None:
+        """Make renames and new files in the data directory durable (a no-op on Windows)."""
+        if os.name == "nt":
+            return
+        with self._stats.timer("fsync"):
+            fd = os.open(self.file_path.parent, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _dump(self, path: Path, notes: Iterable[dict]) -> None:
+        # Encoded piecewise, as json.dump does, so a big notebook never sits in
+        # memory as one string; the writes are timed apart from the encoding.
+        encoder = json.JSONEncoder(ensure_ascii=False, indent=2)
+        writing = 0.0
+        started = time.perf_counter()
+        with path.open("w", encoding="utf-8") as f:
+            buffer: List[str] = []
+            size = 0
+            for chunk in encoder.iterencode(list(notes)):
+                buffer.append(chunk)
+                size += len(chunk)
+                if size >= DUMP_CHUNK_CHARS:
+                    start = time.perf_counter()
+                    f.write("".join(buffer))
+                    writing += time.perf_counter() - start
+                    buffer, size = [], 0
+            start = time.perf_counter()
+            f.write("".join(buffer))
+            f.flush()
+            writing += time.perf_counter() - start
+            self._stats.count("bytes_written", os.fstat(f.fileno()).st_size)
+            start = time.perf_counter()
+            os.fsync(f.fileno())
+            syncing = time.perf_counter() - start
+        self._stats.add_time("serialize", time.perf_counter() - started - writing - syncing)
+        self._stats.add_time("write", writing)
+        self._stats.add_time("fsync", syncing)
+
+    def _write_bytes(self, path: Path, data: bytes, mode: str) -> int:
+        """Write ``data`` durably; returns the file offset it was written at."""
+        with path.open(mode) as f:
+            with self._stats.timer("write"):
+                f.write(data)
+                f.flush()
+            with self._stats.timer("fsync"):
+                os.fsync(f.fileno())
+            start = f.tell() - len(data)
+        self._stats.count("bytes_written", len(data))
+        if not start:
+            self._sync_dir()
+        return start
+
+    @contextmanager
+    def _mutating(self) -> Iterator[None]:
+        """Bring the cache up to date for a read-modify-write of it.
+
+        Outside ``batch()`` that happens under the file lock, held until the
+        write; inside it the change stays in memory until ``commit()``.
+        """
+        with self._lock:
+            if self._batch_depth:
+                self._load()
+                yield
+                return
+            with self._locked():
+                yield
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the file lock with the cache brought up to date under it.
+
+        The lock is taken unless this instance already holds it for writes still
+        in flight; it is given back once every write made under it is on disk.
+        """
+        with self._lock:
+            if not self._writing:
+                self._file_lock.acquire()
+                try:
+                    self._load()
+                except BaseException:
+                    self._file_lock.release()
+                    raise
+                self._writing = True
+            try:
+                yield
+            finally:
+                self._settle()
+
+    def _settle(self) -> None:
+        """Give the file lock back if nothing of ours is left to write."""
+        if self._writing and not (self._open_commit.records or self._committing):
+            if self._signature is not None:
+                self._signature = self._written_signature()
+            self._writing = False
+            self._file_lock.release()
+
+    def _persist(self, records: List[dict]) -> Optional[_Commit]:
+        """Queue ``add``/``update``/``delete`` records already applied to the cache for
+        the next group commit, or hold them for ``commit()`` inside ``batch()``.
+
+        Returns the group to pass to ``_flush`` once the instance lock is released.
+        """
+        if self._batch_depth:
+            self._deferred.extend(records)
+            return None
+        self._open_commit.records.extend(records)
+        return self._open_commit
+
+    def _flush(self, group: Optional[_Commit]) -> None:
+        """Return once ``group`` is on disk, writing it if no other thread is writing.
+
+        While one thread writes a group, mutations from other threads collect in
+        the next one; the first of them to get here writes it in one go, so N
+        concurrent writers cost about one write each time the disk is free
+        rather than N writes in a row.
+        """
+        if group is None:
+            return
+        with self._committed:
+            while self._committing and not group.done:
+                self._committed.wait()
+            if group.done:
+                if group.error is not None:
+                    raise group.error
+                return
+            # Nobody is writing, so ``group`` is the open one: take it.
+            self._committing = True
+            self._open_commit = _Commit()
+            notes = [asdict(note) for note in self._by_id.values()] if self.mode == "json" else None
+            self._stats.count("group_commits")
+            self._stats.count("group_commit_records", len(group.records))
+        try:
+            if self.mode == "log":
+                self._append(group.records)
+            else:
+                self._write(notes)
+        except BaseException as exc:
+            group.error = exc
+        with self._committed:
+            group.done = True
+            self._committing = False
+            if group.error is not None:
+                # The cache is ahead of the disk now; force a reparse next time.
+                self._signature = None
+            self._committed.notify_all()
+            self._settle()
+            if self.mode == "log" and group.error is None:
+                self._maybe_compact()
+        if group.error is not None:
+            raise group.error
+
+    def commit(self) -> None:
+        with self._lock:
+            if not self._deferred:
+                return
+            # Taking the lock rereads files another process changed during the
+            # batch, with the batch applied on top, so the write keeps both.
+            with self._locked():
+                group = self._open_commit
+                group.records.extend(self._deferred)
+                self._deferred = []
+        self._flush(group)
+
+    def _append(self, records: List[dict]) -> None:
+        with self._stats.timer("serialize"):
+            data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        start = self._write_bytes(self.log_path, data, "ab")
+        with self._lock:
+            if start == self._log_offset:
+                self._log_offset += len(data)
+
+    def _maybe_compact(self) -> None:
+        log_size = self.log_path.stat().st_size
+        if log_size < self.compact_min_bytes:
+            return
+        if log_size < self.compact_ratio * self.file_path.stat().st_size:
+            return
+        if self._compactor and self._compactor.is_alive():
+            return
+        # Not a daemon: a short-lived CLI process finishes the compaction
+        # before the interpreter exits instead of abandoning it.
+        self._compactor = threading.Thread(target=self.compact, name="smartnotes-compact")
+        self._compactor.start()
+
+    @instrumented("compact")
+    def compact(self) -> None:
+        """Fold the append log into the snapshot and drop the folded records."""
+        with self._lock:
+            # The cache holds an open batch too, which is not to be written yet.
+            if not self.log_path.exists() or self._deferred:
+                return
+            notes = [asdict(note) for note in self._load().values()]
+            offset = self._log_offset
+            before = self._stat()
+        # Writers keep appending to the log while the snapshot is serialised;
+        # only the records seen above are removed from it afterwards.
+        tmp_path = self.file_path.with_name(f"{self.file_path.name}.{os.getpid()}.compact")
+        self._dump(tmp_path, notes)
+        with self._committed:
+            # An append in flight would land in the log file being replaced.
+            while self._committing:
+                self._committed.wait()
+            with self._file_lock:
+                now = self._stat()
+                if now[0] != before[0] or now[1] is None or now[1][2] != before[1][2]:
+                    # Another process compacted the files in the meantime.
+                    tmp_path.unlink()
+                    return
+                cache_fresh = self._writing or self._signature == now
+                os.replace(tmp_path, self.file_path)
+                with self.log_path.open("rb") as f:
+                    f.seek(offset)
+                    tail = f.read()
+                if tail:
+                    tmp_log = self.log_path.with_name(f"{self.log_path.name}.{os.getpid()}.compact")
+                    with tmp_log.open("wb") as f:
+                        f.write(tail)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_log, self.log_path)
+                else:
+                    self.log_path.unlink()
+                self._sync_dir()
+                if cache_fresh:
+                    # Same notes, new files: no reason to reparse them.
+                    self._signature = self._stat()
+                    self._log_offset = len(tail)
+
+    @instrumented("list_notes")
+    def list_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        wanted = [tag, *tags] if tag else list(tags)
+        with self._lock:
+            if sort is not None:
+                self._load()
+                ids = self._tags.match(wanted, match_any) if wanted else None
+                return self._sorted_page(ids, sort, limit, offset, after_id)
+            if not wanted:
+                notes = self._notes()
+            else:
+                self._load()
+                notes = self._in_order(self._tags.match(wanted, match_any))
+            if limit is None and not offset and after_id is None:
+                return list(notes)
+            return self._page(notes, limit, offset, after_id)
+
+    @instrumented("iter_notes", streams=True)
+    def iter_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        # Sorting needs every note, so a sorted read warms the cache first.
+        if sort is not None or self._is_warm():
+            yield from self.list_notes(tag, tags, match_any, limit, offset, after_id, sort)
+            return
+        wanted = {normalize_tag(t) for t in ([tag, *tags] if tag else tags)}
+        predicate = None
+        if wanted:
+            combine = any if match_any else all
+
+            def predicate(note: Note) -> bool:
+                note_tags = {normalize_tag(t) for t in note.tags}
+                return combine(t in note_tags for t in wanted)
+
+        yield from paginate(self._stream(predicate), limit, offset, after_id)
+
+    @instrumented("get_note")
+    def get_note(self, note_id: str) -> Optional[Note]:
+        with self._lock:
+            return self._load().get(note_id)
+
+    @instrumented("get_by_title")
+    def get_by_title(self, title: str) -> Optional[Note]:
+        with self._lock:
+            self._load()
+            ids = self._titles.get(normalize_title(title))
+            if not ids:
+                return None
+            return self._by_id[min(ids, key=self._positions.__getitem__)]
+
+    @instrumented("tags")
+    def tags(self) -> Dict[str, int]:
+        with self._lock:
+            self._load()
+            return self._tags.counts()
+
+    @instrumented("add_note")
+    def add_note(self, title: str, body: str, tags: Optional[List[str]] = None) -> Note:
+        tags = tags or []
+        note = Note(id=str(uuid.uuid4()), title=title, body=body, tags=tags)
+        with self._mutating():
+            check_titles([note], self._title_holders)
+            self._put(note)
+            group = self._persist([{"op": "add", "note": asdict(note)}])
+            self._index_apply([note])
+            self._changed([note.id])
+        self._flush(group)
+        return note
+
+    @instrumented("update_note")
+    def update_note(self, note_id: str, title: str, body: str, tags: Optional[List[str]] = None) -> Optional[Note]:
+        updated = self.update_many([{"id": note_id, "title": title, "body": body, "tags": tags}])
+        return updated[0] if updated else None
+
+    @instrumented("search")
+    def search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode!r}")
+        parsed = Query() if mode == "substring" else parse_query(query)
+        with self._lock:
+            notes = self._load()
+            self._stats.count("searches")
+            if parsed.is_empty():
+                # A substring scan, also for text with no tokens (e.g. "++").
+                self._stats.count("search_scanned", len(notes))
+                matching = [note for note in self._notes() if note.matches_keyword(query)]
+                if sort is not None:
+                    return self._sorted_page({note.id for note in matching}, sort, limit, offset, after_id)
+                return self._page(matching, limit, offset, after_id)
+            ids, scores = self._evaluate(parsed, mode)
+            if sort is not None:
+                return self._sorted_page(ids, sort, limit, offset, after_id)
+            if scores is None:
+                return self._page(self._in_order(ids), limit, offset, after_id)
+            # A cursor can sit anywhere in the ranking; otherwise only the top is needed.
+            k = None if limit is None or after_id is not None else offset + limit
+            ranked = (notes[note_id] for note_id in rank(scores, self._positions.__getitem__, k))
+            return list(paginate(ranked, limit, offset, after_id))
+
+    def _evaluate(self, parsed: Query, mode: str) -> Tuple[Set[str], Optional[Dict[str, float]]]:
+        """Ids matching a non-empty query and their scores; the cache must be loaded."""
+        notes = self._by_id
+        ids, scores, scanned = evaluate(
+            parsed,
+            self._search_index(),
+            self._tags,
+            notes.keys,
+            lambda note_id: notes[note_id].created_at,
+            notes.__getitem__,
+            fuzzy=mode == "fuzzy",
+        )
+        self._stats.count("search_scanned", scanned)
+        return ids, scores
+
+    def _scored_search(self, query: str, mode: str = "index", limit: Optional[int] = None) -> List[Tuple[float, Note]]:
+        """The best ``limit`` matches of a ranked query, best first, with their BM25 scores.
+
+        ``ShardedNoteStorage`` merges these across its shard files; the scores of
+        each file use that file's own term statistics.
+        """
+        parsed = parse_query(query)
+        with self._lock:
+            notes = self._load()
+            self._stats.count("searches")
+            ids, scores = self._evaluate(parsed, mode)
+            if scores is None:
+                scores = dict.fromkeys(ids, 0.0)
+            return [(scores[note_id], notes[note_id]) for note_id in rank(scores, self._positions.__getitem__, limit)]
+
+    @instrumented("iter_search", streams=True)
+    def iter_search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode!r}")
+        parsed = Query() if mode == "substring" else parse_query(query)
+        # Ranking and sorting need every match, so they warm the cache first;
+        # filter-only queries and substring scans can stream.
+        if sort is not None or parsed.scored or self._is_warm():
+            yield from self.search(query, mode, limit, offset, after_id, sort)
+            return
+        if parsed.is_empty():
+            predicate: Callable[[Note], bool] = lambda note: note.matches_keyword(query)
+        else:
+            predicate = parsed.matches
+        self._stats.count("searches")
+        yield from paginate(self._stream(predicate, "search_scanned"), limit, offset, after_id)
+
+    @instrumented("delete")
+    def delete(self, note_id: str) -> bool:
+        return self.delete_many([note_id]) == 1
+
+    @instrumented("import_notes")
+    def import_notes(self, notes: Iterable[Note], unique_titles: bool = True) -> int:
+        notes = list(notes)
+        if not notes:
+            return 0
+        with self._mutating():
+            if unique_titles:
+                check_titles(notes, self._title_holders)
+            records = [
+                {"op": "add" if self._put(note) is None else "update", "note": asdict(note)}
+                for note in notes
+            ]
+            group = self._persist(records)
+            self._index_apply(notes)
+            self._changed(note.id for note in notes)
+        self._flush(group)
+        return len(notes)
+
+    @instrumented("update_many")
+    def update_many(self, items: Iterable[Mapping]) -> List[Note]:
+        group = None
+        with self._mutating():
+            notes = self._by_id
+            updated: List[Note] = []
+            for item in items:
+                existing = notes.get(item["id"])
+                if existing is None:
+                    continue
+                updated.append(
+                    Note(
+                        id=existing.id,
+                        title=item["title"],
+                        body=item["body"],
+                        tags=list(item.get("tags") or []),
+                        created_at=existing.created_at,
+                    )
+                )
+            if updated:
+                check_titles(updated, self._title_holders)
+                for note in updated:
+                    self._put(note)
+                group = self._persist([{"op": "update", "note": asdict(note)} for note in updated])
+                self._index_apply(updated)
+                self._changed(note.id for note in updated)
+        self._flush(group)
+        return updated
+
+    @instrumented("delete_many")
+    def delete_many(self, note_ids: Iterable[str]) -> int:
+        group = None
+        with self._mutating():
+            removed = [note_id for note_id in note_ids if self._drop(note_id) is not None]
+            if removed:
+                group = self._persist([{"op": "delete", "id": note_id} for note_id in removed])
+                self._index_apply(removed=removed)
+                self._changed(removed)
+        self._flush(group)
+        return len(removed)
@@ -0,0 +1,121 @@
+"""
+Data model shared by all SmartNotes storage backends, and the lazily loaded
+notes some of them return.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Hashable, List, Optional, Tuple
+
+# Decoded note bodies a BodyCache keeps, by their size in bytes as stored.
+BODY_CACHE_BYTES = 16 * 1024 * 1024
+
+
+@dataclass(slots=True)
+class Note:
+    id: str
+    title: str
+    body: str
+    tags: List[str] = field(default_factory=list)
+    created_at: str = field(
+        default_factory=lambda: datetime.utcnow().isoformat(timespec="seconds")
+    )
+
+    def matches_keyword(self, keyword: str) -> bool:
+        pattern = keyword.lower()
+        return (
+            pattern in self.title.lower()
+            or pattern in self.body.lower()
+            or any(pattern in tag.lower() for tag in self.tags)
+        )
+
+
+_BODY = Note.__dict__["body"]
+
+
+class LazyNote(Note):
+    """A ``Note`` whose body is read from the storage when ``body`` is used.
+
+    ``load`` is called on every access and is expected to be backed by a
+    ``BodyCache``, so a list of lazy notes holds no bodies at all. Assigning
+    ``body`` stores it on the note, as on a plain ``Note``. Lazy and plain
+    notes with the same fields compare equal; a copy or pickle of a lazy note
+    is a plain one.
+    """
+
+    __slots__ = ("_load",)
+
+    def __init__(self, id: str, title: str, tags: List[str], created_at: str, load: Callable[[], str]) -> None:
+        self.id = id
+        self.title = title
+        self.tags = tags
+        self.created_at = created_at
+        self._load = load
+
+    @property
+    def body(self) -> str:
+        try:
+            return _BODY.__get__(self, Note)
+        except AttributeError:
+            return self._load()
+
+    @body.setter
+    def body(self, value: str) -> None:
+        _BODY.__set__(self, value)
+
+    def __reduce__(self) -> tuple:
+        return Note, (self.id, self.title, self.body, self.tags, self.created_at)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Note):
+            return NotImplemented
+        return (self.id, self.title, self.tags, self.created_at, self.body) == (
+            other.id, other.title, other.tags, other.created_at, other.body,
+        )
+
+
+class BodyCache:
+    """Recently used note bodies, bounded by their total size.
+
+    Thread-safe: lazy notes may be read from any thread.
+    """
+
+    def __init__(self, max_bytes: int = BODY_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        self._bodies: OrderedDict[Hashable, Tuple[str, int]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            item = self._bodies.get(key)
+            if item is None:
+                return None
+            self._bodies.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Hashable, body: str, size: int) -> None:
+        """Remember ``body`` (``size`` bytes as stored), dropping the least recently used ones over the limit."""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._bodies.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._bodies[key] = (body, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, dropped) = self._bodies.popitem(last=False)
+                self.size -= dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            self._bodies.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._bodies)
@@ -0,0 +1,599 @@
+"""
+Sharded backend: notes partitioned across independent JSON files.
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from operator import itemgetter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+from ..index import normalize_tag
+from ..query import Query, parse_query
+from .base import SEARCH_MODES, BaseNoteStorage, check_titles, paginate, parse_sort
+from .changes import ChangeJournal
+from .config import SHARDS_DIR
+from .filelock import FileLock
+from .json_backend import NoteStorage, _sort_key
+from .models import Note
+from .stats import StorageStats, instrumented
+
+# "hash" spreads notes over a fixed number of shards by id; "month" keeps one
+# shard per creation month, so old months are never rewritten.
+SHARD_SCHEMES = ("hash", "month")
+DEFAULT_SHARDS = 8
+MANIFEST_VERSION = 1
+# Below this much data (all shard files together) reads stay in-process:
+# starting workers and shipping notes back would cost more than it saves.
+PARALLEL_MIN_BYTES = 8 << 20
+# Storage order of the sharded store, which has no single insertion order.
+STORAGE_ORDER = "date_asc"
+
+
+def shard_name(note: Note, scheme: str, shards: int) -> str:
+    """File stem of the shard ``note`` belongs to; stable for the note's lifetime."""
+    if scheme == "month":
+        return note.created_at[:7]
+    return hash_shard(note.id, shards)
+
+
+def hash_shard(note_id: str, shards: int) -> str:
+    return f"shard-{zlib.crc32(note_id.encode('utf-8')) % shards:02d}"
+
+
+# Shards opened by a worker process, by path. Each worker serves a fixed
+# subset of shards, so their parsed notes and indexes stay warm between calls;
+# NoteStorage reparses a shard when the parent process has rewritten it.
+_worker_shards: Dict[str, NoteStorage] = {}
+
+
+def _call_shard(path: str, method: str, args: tuple) -> list:
+    """Worker-process entry point: ``method(*args)`` on the shard stored at ``path``."""
+    shard = _worker_shards.get(path)
+    if shard is None:
+        shard = _worker_shards[path] = NoteStorage(Path(path))
+    return getattr(shard, method)(*args)
+
+
+class ShardedNoteStorage(BaseNoteStorage):
+    """Notes split into independent ``NoteStorage`` files under one directory.
+
+    ``manifest.json`` records the scheme (see ``SHARD_SCHEMES``), the shard
+    count and the layout directory holding the shard files. A mutation loads
+    and rewrites only the shards its notes live in; titles stay unique across
+    all of them, with ``titles.lock`` held from the check to the write so
+    processes sharing the store cannot both claim a title. Every write takes
+    that lock, and so does ``reshard`` for the whole copy.
+
+    Reads fan out: every shard answers the query for the first ``offset +
+    limit`` notes of its own order, and the pages are merged with a heap. Once
+    the files add up to ``parallel_min_bytes``, shards are queried on a pool
+    of ``workers`` processes, each serving a fixed subset of the shards so it
+    keeps them parsed. Storage order is creation order (``STORAGE_ORDER``).
+    Search ranks with each shard's own BM25 statistics, so scores of close
+    matches in different shards can differ slightly from a single file's.
+
+    ``reshard`` rewrites the notes into a new layout and switches the
+    manifest to it in one rename. Every call checks the manifest's stat
+    signature first and moves to the new layout if another process switched
+    it; the layout switched away from is only deleted by the reshard after,
+    so an instance still reading it finishes undisturbed. Writes deferred by
+    an open ``batch()`` are replayed into the new layout at the commit.
+
+    ``changes_since`` collects the changes each shard's own journal saw, so
+    it loads every shard in this process; a layout switched by another
+    process's ``reshard`` is followed, with a reset of the journal.
+    """
+
+    def __init__(
+        self,
+        directory: Path = SHARDS_DIR,
+        shards: int = DEFAULT_SHARDS,
+        scheme: str = "hash",
+        workers: Optional[int] = None,
+        parallel_min_bytes: int = PARALLEL_MIN_BYTES,
+    ) -> None:
+        self.directory = directory
+        self.manifest_path = directory / "manifest.json"
+        # Held from a title check to the write that relies on it, across
+        # processes, by every other write, and by reshard() for its copy.
+        self._titles_lock = FileLock(directory / "titles.lock")
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.parallel_min_bytes = parallel_min_bytes
+        self._lock = threading.RLock()
+        self._stats = StorageStats()
+        self._journal = ChangeJournal()
+        self._shards: Dict[str, NoteStorage] = {}
+        # Shard name -> its sequence number already copied into our journal;
+        # None until the first _poll_changes.
+        self._shard_seqs: Optional[Dict[str, int]] = None
+        # Shards that joined the open batch(): their commits wait for ours.
+        self._batched: Set[str] = set()
+        self._batches = ExitStack()
+        self._executors: List[ProcessPoolExecutor] = []
+        # Stat signature of the manifest the layout was taken from.
+        self._manifest_signature = self._manifest_stat()
+        manifest = self._read_manifest()
+        if manifest is None:
+            # The arguments only shape a new store; reshard() changes an existing one.
+            manifest = self._new_manifest(scheme, shards, 1)
+            self._write_manifest(manifest)
+            self._manifest_signature = self._manifest_stat()
+        self._use(manifest)
+
+    @staticmethod
+    def _new_manifest(scheme: str, shards: int, layout: int) -> dict:
+        if scheme not in SHARD_SCHEMES:
+            raise ValueError(f"Unknown shard scheme: {scheme!r} (expected one of {', '.join(SHARD_SCHEMES)})")
+        if shards < 1:
+            raise ValueError("A sharded store needs at least one shard")
+        return {"version": MANIFEST_VERSION, "scheme": scheme, "shards": shards, "layout": f"layout-{layout}"}
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with self.manifest_path.open("r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"{self.manifest_path}: unsupported manifest version {manifest.get('version')!r}")
+        return manifest
+
+    def _write_manifest(self, manifest: dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, self.manifest_path)
+
+    def _manifest_stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self.manifest_path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _follow_manifest(self) -> Optional[dict]:
+        """Move to the layout another process's ``reshard`` switched the store to.
+
+        Returns the new manifest if the layout changed. Shards enlisted in an
+        open batch stay put until ``commit()`` replays their writes.
+        """
+        signature = self._manifest_stat()
+        if signature == self._manifest_signature or self._batched:
+            return None
+        # Stat first: a manifest replaced after it is read is noticed next time.
+        manifest = self._read_manifest()
+        self._manifest_signature = signature
+        if manifest is None or self.directory / manifest["layout"] == self.layout_dir:
+            return None
+        self._release()
+        self._use(manifest)
+        self._journal.reset()
+        return manifest
+
+    def _use(self, manifest: dict) -> None:
+        self.scheme = manifest["scheme"]
+        self.shard_count = manifest["shards"]
+        self._layout_number = int(manifest["layout"].rsplit("-", 1)[1])
+        self.layout_dir = self.directory / manifest["layout"]
+        self.layout_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, name: str) -> Path:
+        return self.layout_dir / f"{name}.json"
+
+    def _poll_changes(self) -> None:
+        with self._lock:
+            if self._batch_depth:
+                return
+            self._follow_manifest()
+            polled = self._shard_seqs is not None
+            if self._shard_seqs is None:
+                self._shard_seqs = {}
+            for name in self._names():
+                shard = self._shard(name)
+                known = self._shard_seqs.get(name)
+                if known is None and polled:
+                    # A month shard that appeared since the last look: all of it is new.
+                    self._journal.record(note.id for note in shard.list_notes())
+                changes = shard.changes_since(known or 0)
+                if changes.complete:
+                    self._journal.record([*(note.id for note in changes.notes), *changes.deleted])
+                else:
+                    self._journal.reset()
+                self._shard_seqs[name] = changes.seq
+
+    @property
+    def sequence(self) -> int:
+        # Writes made through this instance reach the journal the same way as
+        # other processes' ones, from the shards' journals.
+        with self._lock:
+            self._poll_changes()
+            return self._journal.seq
+
+    def watch_paths(self) -> List[Path]:
+        with self._lock:
+            self._follow_manifest()
+            return [self.manifest_path, *(self._path(name) for name in self._names())]
+
+    def _names(self) -> List[str]:
+        if self.scheme == "month":
+            return sorted({path.stem for path in self.layout_dir.glob("*.json")} | set(self._shards))
+        return [f"shard-{i:02d}" for i in range(self.shard_count)]
+
+    def _shard(self, name: str) -> NoteStorage:
+        shard = self._shards.get(name)
+        if shard is None:
+            shard = self._shards[name] = NoteStorage(self._path(name))
+        return shard
+
+    def _writable(self, name: str) -> NoteStorage:
+        """The shard, enlisted in the open ``batch()`` if there is one."""
+        shard = self._shard(name)
+        if self._batch_depth and name not in self._batched:
+            self._batches.enter_context(shard.batch())
+            self._batched.add(name)
+        return shard
+
+    def _locate(self, note_id: str) -> Optional[Tuple[str, Note]]:
+        """The shard holding ``note_id`` and the note; a month layout has to ask every shard."""
+        if self.scheme == "hash":
+            name = hash_shard(note_id, self.shard_count)
+            note = self._shard(name).get_note(note_id)
+            return None if note is None else (name, note)
+        for name in self._names():
+            note = self._shard(name).get_note(note_id)
+            if note is not None:
+                return name, note
+        return None
+
+    def _title_holders(self, key: str) -> List[str]:
+        holders = (self._shard(name).get_by_title(key) for name in self._names())
+        return [note.id for note in holders if note is not None]
+
+    def _store(self, notes: Iterable[Note]) -> None:
+        """Write notes (titles already checked) into their shards."""
+        groups: Dict[str, List[Note]] = {}
+        for note in notes:
+            groups.setdefault(shard_name(note, self.scheme, self.shard_count), []).append(note)
+        for name, group in groups.items():
+            self._writable(name).import_notes(group, unique_titles=False)
+
+    def _parallel(self, names: Sequence[str]) -> bool:
+        if self.workers < 2 or len(names) < 2 or self._batched:
+            # Workers read the files, which lag behind a batch until it commits.
+            return False
+        size = 0
+        for name in names:
+            try:
+                size += self._path(name).stat().st_size
+            except FileNotFoundError:
+                pass
+        return size >= self.parallel_min_bytes
+
+    def _pool(self) -> List[ProcessPoolExecutor]:
+        if not self._executors:
+            # Not forked: the GUI and the server run threads the child would inherit mid-flight.
+            context = multiprocessing.get_context("spawn")
+            self._executors = [
+                ProcessPoolExecutor(max_workers=1, mp_context=context)
+                for _ in range(min(self.workers, len(self._names())))
+            ]
+        return self._executors
+
+    def _fan_out(self, method: str, args: tuple) -> List[list]:
+        """``method(*args)`` on every shard, in worker processes if the store is big enough."""
+        names = self._names()
+        if not self._parallel(names):
+            return [getattr(self._shard(name), method)(*args) for name in names]
+        executors = self._pool()
+        futures = [
+            # Pinned by name, so a shard is always served by the same worker.
+            executors[zlib.crc32(name.encode("utf-8")) % len(executors)].submit(
+                _call_shard, str(self._path(name)), method, args
+            )
+            for name in names
+        ]
+        self._stats.count("shard_tasks", len(futures))
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _merge(
+        pages: List[List[Note]],
+        sort: str,
+        limit: Optional[int],
+        offset: int,
+        after_id: Optional[str],
+    ) -> List[Note]:
+        """One page of per-shard results, each already in ``sort`` order; ties go to the lower shard."""
+        field, reverse = parse_sort(sort)
+        merged = heapq.merge(*pages, key=lambda note: _sort_key(note, field), reverse=reverse)
+        return list(paginate(merged, limit, offset, after_id))
+
+    @staticmethod
+    def _needed(limit: Optional[int], offset: int, after_id: Optional[str]) -> Optional[int]:
+        """How many notes each shard must return; a cursor can be anywhere, so then all."""
+        return None if limit is None or after_id is not None else offset + limit
+
+    @instrumented("list_notes")
+    def list_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        sort = sort or STORAGE_ORDER
+        with self._lock:
+            self._follow_manifest()
+            pages = self._fan_out(
+                "list_notes",
+                (tag, tuple(tags), match_any, self._needed(limit, offset, after_id), 0, None, sort),
+            )
+        return self._merge(pages, sort, limit, offset, after_id)
+
+    @instrumented("iter_notes", streams=True)
+    def iter_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        yield from self.list_notes(tag, tags, match_any, limit, offset, after_id, sort)
+
+    @instrumented("get_note")
+    def get_note(self, note_id: str) -> Optional[Note]:
+        with self._lock:
+            self._follow_manifest()
+            found = self._locate(note_id)
+        return None if found is None else found[1]
+
+    @instrumented("get_by_title")
+    def get_by_title(self, title: str) -> Optional[Note]:
+        with self._lock:
+            self._follow_manifest()
+            holders = [note for name in self._names() if (note := self._shard(name).get_by_title(title))]
+        # The first in storage order, as the single-file backends return.
+        return min(holders, key=lambda note: note.created_at, default=None)
+
+    @instrumented("tags")
+    def tags(self) -> Dict[str, int]:
+        counts: Dict[str, Tuple[str, int]] = {}
+        with self._lock:
+            self._follow_manifest()
+            for name in self._names():
+                for label, count in self._shard(name).tags().items():
+                    key = normalize_tag(label)
+                    first, total = counts.get(key, (label, 0))
+                    counts[key] = (first, total + count)
+        return {label: count for _, (label, count) in sorted(counts.items())}
+
+    @instrumented("add_note")
+    def add_note(self, title: str, body: str, tags: Optional[List[str]] = None) -> Note:
+        note = Note(id=str(uuid.uuid4()), title=title, body=body, tags=tags or [])
+        with self._lock, self._titles_lock:
+            self._follow_manifest()
+            check_titles([note], self._title_holders)
+            self._store([note])
+        return note
+
+    @instrumented("update_note")
+    def update_note(self, note_id: str, title: str, body: str, tags: Optional[List[str]] = None) -> Optional[Note]:
+        updated = self.update_many([{"id": note_id, "title": title, "body": body, "tags": tags}])
+        return updated[0] if updated else None
+
+    @instrumented("update_many")
+    def update_many(self, items: Iterable[Mapping]) -> List[Note]:
+        updated: List[Note] = []
+        with self._lock, self._titles_lock:
+            self._follow_manifest()
+            for item in items:
+                found = self._locate(item["id"])
+                if found is None:
+                    continue
+                updated.append(
+                    Note(
+                        id=item["id"],
+                        title=item["title"],
+                        body=item["body"],
+                        tags=list(item.get("tags") or []),
+                        created_at=found[1].created_at,
+                    )
+                )
+            if updated:
+                check_titles(updated, self._title_holders)
+                self._store(updated)
+        return updated
+
+    @instrumented("search")
+    def search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode!r}")
+        # Parsed here too, so a malformed query fails before any shard is asked.
+        parsed = Query() if mode == "substring" else parse_query(query)
+        needed = self._needed(limit, offset, after_id)
+        with self._lock:
+            self._follow_manifest()
+            self._stats.count("searches")
+            if sort is None and parsed.scored:
+                pages = self._fan_out("_scored_search", (query, mode, needed))
+            else:
+                sort = sort or STORAGE_ORDER
+                pages = self._fan_out("search", (query, mode, needed, 0, None, sort))
+        if sort is not None:
+            return self._merge(pages, sort, limit, offset, after_id)
+        ranked = heapq.merge(*pages, key=itemgetter(0), reverse=True)
+        return list(paginate((note for _, note in ranked), limit, offset, after_id))
+
+    @instrumented("iter_search", streams=True)
+    def iter_search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        yield from self.search(query, mode, limit, offset, after_id, sort)
+
+    @instrumented("delete")
+    def delete(self, note_id: str) -> bool:
+        return self.delete_many([note_id]) == 1
+
+    @instrumented("delete_many")
+    def delete_many(self, note_ids: Iterable[str]) -> int:
+        groups: Dict[str, List[str]] = {}
+        with self._lock, self._titles_lock:
+            self._follow_manifest()
+            for note_id in dict.fromkeys(note_ids):
+                found = self._locate(note_id)
+                if found is not None:
+                    groups.setdefault(found[0], []).append(note_id)
+            return sum(self._writable(name).delete_many(ids) for name, ids in groups.items())
+
+    @instrumented("import_notes")
+    def import_notes(self, notes: Iterable[Note], unique_titles: bool = True) -> int:
+        notes = list(notes)
+        with self._lock, self._titles_lock:
+            self._follow_manifest()
+            if unique_titles:
+                check_titles(notes, self._title_holders)
+            if self.scheme == "month":
+                # A re-imported note whose date moved to another month leaves its old shard.
+                for note in notes:
+                    found = self._locate(note.id)
+                    if found is not None and found[0] != shard_name(note, self.scheme, self.shard_count):
+                        self._writable(found[0]).delete_many([note.id])
+            self._store(notes)
+        return len(notes)
+
+    @instrumented("rebuild_index")
+    def rebuild_index(self) -> int:
+        with self._lock:
+            self._follow_manifest()
+            return sum(self._shard(name).rebuild_index() for name in self._names())
+
+    @instrumented("reshard")
+    def reshard(self, shards: Optional[int] = None, scheme: Optional[str] = None) -> int:
+        """Move every note into a new layout of ``shards`` shards under ``scheme``
+        (the current ones by default); returns the note count.
+
+        The new shard files are written next to the old ones and the manifest
+        is switched to them with one rename, so an interrupted reshard leaves
+        the store as it was. ``titles.lock`` is held throughout, so no write
+        can land in the old layout after it was copied. The old layout is left
+        for instances still reading it and deleted by the next reshard.
+        """
+        with self._lock, self._titles_lock:
+            if self._batch_depth:
+                raise RuntimeError("reshard() cannot run inside batch()")
+            self._follow_manifest()
+            manifest = self._new_manifest(
+                scheme or self.scheme,
+                self.shard_count if shards is None else shards,
+                self._layout_number + 1,
+            )
+            target = self.directory / manifest["layout"]
+            # Left over by an interrupted reshard.
+            shutil.rmtree(target, ignore_errors=True)
+            target.mkdir(parents=True)
+            groups: Dict[str, List[Note]] = {}
+            count = 0
+            for name in self._names():
+                for note in self._shard(name).list_notes():
+                    groups.setdefault(shard_name(note, manifest["scheme"], manifest["shards"]), []).append(note)
+                    count += 1
+            if manifest["scheme"] == "hash":
+                # Every hash shard exists, even if no note falls into it.
+                for i in range(manifest["shards"]):
+                    groups.setdefault(f"shard-{i:02d}", [])
+            for name, group in groups.items():
+                with NoteStorage(target / f"{name}.json") as shard:
+                    shard.import_notes(group, unique_titles=False)
+            self._write_manifest(manifest)
+            self._manifest_signature = self._manifest_stat()
+            old_layout = self.layout_dir
+            self._release()
+            self._use(manifest)
+            for layout in self.directory.glob("layout-*"):
+                if layout not in (self.layout_dir, old_layout):
+                    shutil.rmtree(layout, ignore_errors=True)
+        return count
+
+    def _replay(self, records: List[dict]) -> None:
+        """Apply log records deferred in shards of a layout since switched away from."""
+        for record in records:
+            if record["op"] == "delete":
+                found = self._locate(record["id"])
+                if found is not None:
+                    self._writable(found[0]).delete_many([record["id"]])
+            else:
+                note = Note(**record["note"])
+                found = self._locate(note.id)
+                if found is not None and found[0] != shard_name(note, self.scheme, self.shard_count):
+                    self._writable(found[0]).delete_many([note.id])
+                self._store([note])
+
+    def commit(self) -> None:
+        with self._lock, self._titles_lock:
+            records: List[dict] = []
+            if self._batched and self._manifest_stat() != self._manifest_signature:
+                manifest = self._read_manifest()
+                if manifest is not None and self.directory / manifest["layout"] != self.layout_dir:
+                    # Resharded while the batch was open: its writes belong in the new layout.
+                    for name in self._batched:
+                        shard = self._shards[name]
+                        records.extend(shard._deferred)
+                        shard._deferred = []
+                    self._batches.close()
+                    self._batched.clear()
+            self._follow_manifest()
+            self._replay(records)
+            for name in self._batched:
+                self._shards[name].commit()
+            if not self._batch_depth:
+                # Ends the shards' own batch() blocks, now that nothing is deferred.
+                self._batches.close()
+                self._batched.clear()
+
+    def _release(self) -> None:
+        """Shut the worker pool down and close every open shard."""
+        for executor in self._executors:
+            executor.shutdown()
+        self._executors = []
+        for shard in self._shards.values():
+            shard.close()
+        self._shards = {}
+        self._shard_seqs = None
+
+    def close(self) -> None:
+        with self._lock:
+            self.commit()
+            self._release()
@@ -0,0 +1,650 @@
+"""
+SQLite backend: notes in a WAL-mode database with an FTS5 search index.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+from ..index import FUZZY_MAX_EXPANSIONS, TrigramIndex, fuzzy_distance, normalize_tag, normalize_title, tokenize
+from ..query import Query, parse_query
+from .base import SEARCH_MODES, BaseNoteStorage, check_titles, paginate, parse_sort
+from .changes import Changes
+from .config import SQLITE_FILE
+from .models import Note
+from .stats import StorageStats, instrumented
+
+# Bumped when the schema changes; see SqliteNoteStorage._migrate.
+SCHEMA_VERSION = 4
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    title_key TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS notes_created_at ON notes (created_at);
+-- Not UNIQUE: databases filled before titles were unique may hold duplicates.
+CREATE INDEX IF NOT EXISTS notes_title_key ON notes (title_key);
+CREATE TABLE IF NOT EXISTS note_tags (
+    note_seq INTEGER NOT NULL REFERENCES notes (seq) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    label TEXT NOT NULL,
+    PRIMARY KEY (tag, note_seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS note_tags_note ON note_tags (note_seq);
+-- Fed TOKEN_RE tokens joined by spaces (see _fts_text); apostrophes and
+-- underscores are token characters so those tokens come back whole.
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5 (
+    title, body, tags,
+    tokenize = "unicode61 remove_diacritics 0 tokenchars '''_'"
+);
+-- The FTS vocabulary (token -> number of notes), read by fuzzy search.
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_vocab USING fts5vocab (notes_fts, 'row');
+-- Change feed for changes_since: a row per changed note, whichever
+-- connection changed it. Trimmed to the last 1024 rows (CHANGE_JOURNAL_SIZE).
+CREATE TABLE IF NOT EXISTS note_changes (
+    change INTEGER PRIMARY KEY AUTOINCREMENT,
+    note_id TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS notes_inserted AFTER INSERT ON notes BEGIN
+    INSERT INTO note_changes (note_id) VALUES (new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_updated AFTER UPDATE ON notes BEGIN
+    INSERT INTO note_changes (note_id) VALUES (new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_deleted AFTER DELETE ON notes BEGIN
+    INSERT INTO note_changes (note_id) VALUES (old.id);
+END;
+CREATE TRIGGER IF NOT EXISTS note_changes_trimmed AFTER INSERT ON note_changes
+WHEN new.change % 256 = 0 BEGIN
+    DELETE FROM note_changes WHERE change <= new.change - 1024;
+END;
+"""
+_COLUMNS = "id, title, body, tags, created_at"
+# Rows fetched per round trip while streaming a result set.
+FETCH_SIZE = 256
+# Sort field -> indexed column it orders by; seq breaks ties.
+_SORT_COLUMNS = {"date": "created_at", "title": "title_key"}
+# Notes held back by batch() before they are written anyway, to bound memory.
+PENDING_FLUSH_NOTES = 1000
+
+
+def _fts_text(text: str) -> str:
+    """``text`` as the FTS table stores it: its ``tokenize`` tokens, space-separated.
+
+    unicode61 alone would keep an apostrophe at the edge of a word (``'quoted'``)
+    and split at underscores, where the index's TOKEN_RE does neither.
+    """
+    return " ".join(tokenize(text))
+
+
+def _fts_phrase(tokens: Sequence[str], prefix: bool = False) -> str:
+    # Tokens are \w runs joined by apostrophes, so they never contain a quote.
+    return '"' + " ".join(tokens) + '"' + ("*" if prefix else "")
+
+
+def _fts_term(term: str, alternatives: Sequence[str] = ()) -> str:
+    """A prefix term, OR-ed with the exact ``alternatives`` fuzzy search adds."""
+    options = [_fts_phrase([term], prefix=True), *(_fts_phrase([token]) for token in alternatives)]
+    return options[0] if len(options) == 1 else "(" + " OR ".join(options) + ")"
+
+
+def _fts_query(
+    terms: Sequence[str],
+    phrases: Sequence[Sequence[str]],
+    operator: str,
+    alternatives: Mapping[str, Sequence[str]] = {},
+) -> str:
+    """An FTS5 MATCH expression joining prefix ``terms`` and exact ``phrases``."""
+    parts = [_fts_term(term, alternatives.get(term, ())) for term in terms]
+    parts.extend(_fts_phrase(phrase) for phrase in phrases)
+    return f" {operator} ".join(parts)
+
+
+def _row_to_note(row: tuple) -> Note:
+    note_id, title, body, tags, created_at = row
+    return Note(id=note_id, title=title, body=body, tags=json.loads(tags), created_at=created_at)
+
+
+class SqliteNoteStorage(BaseNoteStorage):
+    """SQLite storage for large notebooks.
+
+    ``seq`` keeps insertion order, ``note_tags`` is indexed by normalised tag,
+    ``created_at`` and the normalised ``title_key`` have their own indexes. The
+    FTS5 table is fed the tokens of the same ``tokenize`` as the JSON backend's
+    index (rowid = ``notes.seq``), so both backends agree on what a
+    token-prefix search finds. A search query compiles to FTS5 MATCH
+    expressions plus tag and date conditions, and is ranked with FTS5's
+    ``bm25()`` under an ``ORDER BY ... LIMIT``, so SQLite keeps only the top
+    rows. Fuzzy search ORs each word with its near spellings, found through a
+    ``TrigramIndex`` over the ``notes_vocab`` (fts5vocab) table that is rebuilt
+    after the database changes. Triggers log every changed note id in
+    ``note_changes``, whose AUTOINCREMENT key is the ``changes_since`` sequence
+    number, shared by every process using the database. ``stats()`` times
+    every call and counts the rows fetched.
+
+    Inside ``batch()`` writes are checked against the database plus the notes
+    already held back, and kept in memory; they are written in one short
+    transaction at ``commit()``, before the next read, or once
+    ``PENDING_FLUSH_NOTES`` are waiting. So an open batch (a shell session,
+    say) holds the database's write lock only while it writes.
+    """
+
+    def __init__(self, file_path: Path = SQLITE_FILE) -> None:
+        self.file_path = file_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared across threads; the lock serialises its use.
+        self._conn = sqlite3.connect(str(file_path), check_same_thread=False)
+        self._lock = threading.RLock()
+        self._stats = StorageStats()
+        # Trigrams and note counts of the FTS vocabulary, and the database state they describe.
+        self._vocabulary: Optional[Tuple[TrigramIndex, Dict[str, int]]] = None
+        self._vocabulary_version: Optional[Tuple[int, int]] = None
+        # Writes held back by batch(): the note by id, None for a deletion, and
+        # the ids of the held-back notes by title key.
+        self._pending: Dict[str, Optional[Note]] = {}
+        self._pending_titles: Dict[str, Set[str]] = {}
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        with self._conn:
+            self._migrate()
+
+    def _migrate(self) -> None:
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(notes)")}
+        add_title_key = bool(columns) and "title_key" not in columns
+        if version < 1:
+            # note_tags gained its label column; it is derived, so rebuild it.
+            self._conn.execute("DROP TABLE IF EXISTS note_tags")
+        if version < 3:
+            # notes_fts changed tokenizer; it is derived, so rebuild it.
+            self._conn.execute("DROP TABLE IF EXISTS notes_vocab")
+            self._conn.execute("DROP TABLE IF EXISTS notes_fts")
+        if add_title_key:
+            self._conn.execute("ALTER TABLE notes ADD COLUMN title_key TEXT NOT NULL DEFAULT ''")
+        self._conn.executescript(SCHEMA)
+        if version < 1:
+            self._rebuild_tags()
+        if version < 3:
+            self._rebuild_fts()
+        if add_title_key or version < 4:
+            # Added, or computed before normalize_title applied NFKC. Only keys
+            # that change are rewritten, as each UPDATE lands in note_changes.
+            rows = self._conn.execute("SELECT seq, title, title_key FROM notes").fetchall()
+            self._conn.executemany(
+                "UPDATE notes SET title_key = ? WHERE seq = ?",
+                [(normalize_title(title), seq) for seq, title, key in rows if normalize_title(title) != key],
+            )
+        if version < SCHEMA_VERSION:
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self) -> None:
+        with self._lock:
+            self.commit()
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """One mutation: its own transaction, or none in ``batch()``, whose writes
+        ``_apply`` holds back.
+
+        Transactions start with ``BEGIN IMMEDIATE``, which takes the database's
+        write lock before the title checks read anything, so two processes
+        cannot both find a title free and then both store it.
+        """
+        with self._lock:
+            if self._batch_depth:
+                yield
+                return
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                yield
+
+    def _apply(self, changes: Mapping[str, Optional[Note]]) -> None:
+        """Write notes (None deletes), or hold them back inside ``batch()``."""
+        if not self._batch_depth:
+            for note_id, note in changes.items():
+                self._write_note(note_id, note)
+            return
+        for note_id, note in changes.items():
+            previous = self._pending.get(note_id)
+            if previous is not None:
+                self._pending_titles[normalize_title(previous.title)].discard(note_id)
+            self._pending[note_id] = note
+            if note is not None:
+                self._pending_titles.setdefault(normalize_title(note.title), set()).add(note_id)
+        if len(self._pending) >= PENDING_FLUSH_NOTES:
+            self.commit()
+
+    def _write_note(self, note_id: str, note: Optional[Note]) -> None:
+        seq = self._seq(note_id)
+        if note is None:
+            if seq is not None:
+                self._conn.execute("DELETE FROM notes_fts WHERE rowid = ?", (seq,))
+                self._conn.execute("DELETE FROM notes WHERE seq = ?", (seq,))
+        elif seq is None:
+            self._insert(note)
+        else:
+            self._replace(seq, note)
+
+    def commit(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for note_id, note in self._pending.items():
+                    self._write_note(note_id, note)
+            self._pending = {}
+            self._pending_titles = {}
+
+    def _insert(self, note: Note) -> None:
+        cursor = self._conn.execute(
+            "INSERT INTO notes (id, title, body, tags, created_at, title_key) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                note.id,
+                note.title,
+                note.body,
+                json.dumps(note.tags, ensure_ascii=False),
+                note.created_at,
+                normalize_title(note.title),
+            ),
+        )
+        self._index(cursor.lastrowid, note)
+
+    def _replace(self, seq: int, note: Note) -> None:
+        self._conn.execute(
+            "UPDATE notes SET title = ?, body = ?, tags = ?, created_at = ?, title_key = ? WHERE seq = ?",
+            (
+                note.title,
+                note.body,
+                json.dumps(note.tags, ensure_ascii=False),
+                note.created_at,
+                normalize_title(note.title),
+                seq,
+            ),
+        )
+        self._conn.execute("DELETE FROM note_tags WHERE note_seq = ?", (seq,))
+        self._conn.execute("DELETE FROM notes_fts WHERE rowid = ?", (seq,))
+        self._index(seq, note)
+
+    def _index(self, seq: int, note: Note) -> None:
+        self._index_tags(seq, note.tags)
+        self._conn.execute(
+            "INSERT INTO notes_fts (rowid, title, body, tags) VALUES (?, ?, ?, ?)",
+            (seq, _fts_text(note.title), _fts_text(note.body), _fts_text(" ".join(note.tags))),
+        )
+
+    def _index_tags(self, seq: int, tags: List[str]) -> None:
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO note_tags (note_seq, tag, label) VALUES (?, ?, ?)",
+            [(seq, normalize_tag(tag), tag) for tag in tags],
+        )
+
+    def _rebuild_tags(self) -> None:
+        self._conn.execute("DELETE FROM note_tags")
+        for seq, tags in self._conn.execute("SELECT seq, tags FROM notes").fetchall():
+            self._index_tags(seq, json.loads(tags))
+
+    def _rebuild_fts(self) -> None:
+        self._conn.execute("DELETE FROM notes_fts")
+        self._conn.executemany(
+            "INSERT INTO notes_fts (rowid, title, body, tags) VALUES (?, ?, ?, ?)",
+            [
+                (seq, _fts_text(title), _fts_text(body), _fts_text(" ".join(json.loads(tags))))
+                for seq, title, body, tags in self._conn.execute("SELECT seq, title, body, tags FROM notes").fetchall()
+            ],
+        )
+
+    def _title_holders(self, key: str) -> List[str]:
+        holders = [row[0] for row in self._conn.execute("SELECT id FROM notes WHERE title_key = ?", (key,))]
+        if not self._pending:
+            return holders
+        holders = [note_id for note_id in holders if note_id not in self._pending]
+        holders.extend(self._pending_titles.get(key, ()))
+        return holders
+
+    def _seq(self, note_id: str) -> Optional[int]:
+        row = self._conn.execute("SELECT seq FROM notes WHERE id = ?", (note_id,)).fetchone()
+        return row[0] if row else None
+
+    def _created_at(self, note_id: str) -> Optional[str]:
+        """When a note was created, None if there is no such note, held-back writes included."""
+        if note_id in self._pending:
+            note = self._pending[note_id]
+            return None if note is None else note.created_at
+        row = self._conn.execute("SELECT created_at FROM notes WHERE id = ?", (note_id,)).fetchone()
+        return row[0] if row else None
+
+    def _query(
+        self,
+        where: str,
+        params: List[object],
+        limit: Optional[int],
+        offset: int,
+        after_id: Optional[str],
+        predicate: Optional[Callable[[Note], bool]] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        """Stream notes matching ``where`` in ``seq`` (or ``sort``) order, one page of them.
+
+        Paging happens in SQL unless a Python ``predicate`` still has to filter
+        the rows, in which case it is done by ``paginate``. Sorted reads walk
+        the ``created_at``/``title_key`` index, so a ``limit`` stops early.
+        """
+        columns, direction, after = ["seq"], "", ">"
+        if sort is not None:
+            field, reverse = parse_sort(sort)
+            columns = [_SORT_COLUMNS[field], "seq"]
+            if reverse:
+                direction, after = " DESC", "<"
+        key = ", ".join(columns)
+        sql = f"SELECT {_COLUMNS} FROM notes WHERE {where}"
+        params = list(params)
+        if after_id is not None and predicate is None:
+            # A cursor that is unknown or outside ``where`` compares against
+            # NULL and matches nothing, as in ``paginate``.
+            sql += f" AND ({key}) {after} (SELECT {key} FROM notes WHERE id = ? AND ({where}))"
+            params.extend([after_id, *params])
+        sql += " ORDER BY " + ", ".join(column + direction for column in columns)
+        if predicate is None and (limit is not None or offset):
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset])
+        with self._lock:
+            self.commit()
+            cursor = self._conn.execute(sql, params)
+        notes = self._fetch(cursor)
+        if predicate is not None:
+            notes = paginate(filter(predicate, notes), limit, offset, after_id)
+        yield from notes
+
+    def _fetch(self, cursor: sqlite3.Cursor) -> Iterator[Note]:
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            self._stats.count("rows_read", len(rows))
+            for row in rows:
+                yield _row_to_note(row)
+
+    @instrumented("list_notes")
+    def list_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        return list(self.iter_notes(tag, tags, match_any, limit, offset, after_id, sort))
+
+    @instrumented("iter_notes", streams=True)
+    def iter_notes(
+        self,
+        tag: Optional[str] = None,
+        tags: Sequence[str] = (),
+        match_any: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        wanted = list(dict.fromkeys(normalize_tag(t) for t in ([tag, *tags] if tag else tags)))
+        if not wanted:
+            return self._query("1", [], limit, offset, after_id, sort=sort)
+        placeholders = ", ".join("?" * len(wanted))
+        matching = f"SELECT note_seq FROM note_tags WHERE tag IN ({placeholders})"
+        params: List[object] = list(wanted)
+        if not match_any and len(wanted) > 1:
+            matching += " GROUP BY note_seq HAVING COUNT(*) = ?"
+            params.append(len(wanted))
+        return self._query(f"seq IN ({matching})", params, limit, offset, after_id, sort=sort)
+
+    @instrumented("get_note")
+    def get_note(self, note_id: str) -> Optional[Note]:
+        with self._lock:
+            self.commit()
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM notes WHERE id = ?", (note_id,)).fetchone()
+        return _row_to_note(row) if row else None
+
+    @instrumented("get_by_title")
+    def get_by_title(self, title: str) -> Optional[Note]:
+        with self._lock:
+            self.commit()
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM notes WHERE title_key = ? ORDER BY seq LIMIT 1",
+                (normalize_title(title),),
+            ).fetchone()
+        return _row_to_note(row) if row else None
+
+    @instrumented("tags")
+    def tags(self) -> Dict[str, int]:
+        with self._lock:
+            self.commit()
+            rows = self._conn.execute(
+                "SELECT MIN(label), COUNT(*) FROM note_tags GROUP BY tag ORDER BY tag"
+            )
+            return {label: count for label, count in rows}
+
+    @instrumented("add_note")
+    def add_note(self, title: str, body: str, tags: Optional[List[str]] = None) -> Note:
+        tags = tags or []
+        note = Note(id=str(uuid.uuid4()), title=title, body=body, tags=tags)
+        with self._transaction():
+            check_titles([note], self._title_holders)
+            self._apply({note.id: note})
+        return note
+
+    @instrumented("update_note")
+    def update_note(self, note_id: str, title: str, body: str, tags: Optional[List[str]] = None) -> Optional[Note]:
+        updated = self.update_many([{"id": note_id, "title": title, "body": body, "tags": tags}])
+        return updated[0] if updated else None
+
+    @instrumented("update_many")
+    def update_many(self, items: Iterable[Mapping]) -> List[Note]:
+        updated: List[Note] = []
+        with self._transaction():
+            for item in items:
+                created_at = self._created_at(item["id"])
+                if created_at is None:
+                    continue
+                updated.append(
+                    Note(
+                        id=item["id"],
+                        title=item["title"],
+                        body=item["body"],
+                        tags=list(item.get("tags") or []),
+                        created_at=created_at,
+                    )
+                )
+            check_titles(updated, self._title_holders)
+            self._apply({note.id: note for note in updated})
+        return updated
+
+    @instrumented("search")
+    def search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> List[Note]:
+        return list(self.iter_search(query, mode, limit, offset, after_id, sort))
+
+    @instrumented("iter_search", streams=True)
+    def iter_search(
+        self,
+        query: str,
+        mode: str = "index",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after_id: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Iterator[Note]:
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode!r}")
+        parsed = Query() if mode == "substring" else parse_query(query)
+        if parsed.is_empty():
+            return self._query("1", [], limit, offset, after_id, lambda note: note.matches_keyword(query), sort)
+        where, params = self._filters(parsed)
+        alternatives = {term: self._misspellings(term) for term in parsed.terms} if mode == "fuzzy" else {}
+        match = _fts_query(parsed.terms, parsed.phrases, "AND", alternatives)
+        if match and sort is None:
+            return self._ranked(match, where, params, limit, offset, after_id)
+        if match:
+            where += " AND seq IN (SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?)"
+            params.append(match)
+        return self._query(where, params, limit, offset, after_id, sort=sort)
+
+    def _misspellings(self, term: str) -> List[str]:
+        """Indexed tokens a few typos away from ``term`` that do not simply start with it."""
+        distance = fuzzy_distance(term)
+        if not distance:
+            return []
+        with self._lock:
+            self.commit()
+            version = (self._conn.execute("PRAGMA data_version").fetchone()[0], self._conn.total_changes)
+            if self._vocabulary is None or self._vocabulary_version != version:
+                with self._stats.timer("vocabulary_load"):
+                    frequencies = dict(self._conn.execute("SELECT term, doc FROM notes_vocab"))
+                    self._vocabulary = (TrigramIndex(frequencies), frequencies)
+                self._vocabulary_version = version
+            trigrams, frequencies = self._vocabulary
+        similar = trigrams.similar(term, distance, prefix=True)
+        # Closest first, then the most common spelling; distance 0 is "term"* already.
+        closest = sorted(
+            (token for token, edits in similar.items() if edits),
+            key=lambda token: (similar[token], -frequencies[token]),
+        )
+        return closest[:FUZZY_MAX_EXPANSIONS]
+
+    @property
+    def sequence(self) -> int:
+        with self._lock:
+            self.commit()
+            row = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'note_changes'").fetchone()
+        return row[0] if row else 0
+
+    @instrumented("changes_since")
+    def changes_since(self, seq: int) -> Changes:
+        """As in ``BaseNoteStorage``, read from the ``note_changes`` table the
+        triggers fill, so changes made by other processes are itemised too."""
+        with self._lock:
+            current = self.sequence
+            oldest = self._conn.execute("SELECT min(change) FROM note_changes").fetchone()[0]
+            if not (current if oldest is None else oldest - 1) <= seq <= current:
+                return Changes(current, [], [], False)
+            rows = self._conn.execute(
+                f"SELECT note_id, {_COLUMNS} FROM"
+                " (SELECT note_id, max(change) AS last FROM note_changes WHERE change > ? GROUP BY note_id)"
+                " LEFT JOIN notes ON id = note_id ORDER BY last",
+                (seq,),
+            ).fetchall()
+        self._stats.count("rows_read", len(rows))
+        notes = [_row_to_note(row[1:]) for row in rows if row[1] is not None]
+        deleted = [row[0] for row in rows if row[1] is None]
+        return Changes(current, notes, deleted, True)
+
+    def watch_paths(self) -> List[Path]:
+        return [self.file_path, self.file_path.with_name(self.file_path.name + "-wal")]
+
+    def _filters(self, query: Query) -> Tuple[str, List[object]]:
+        """SQL conditions for everything in ``query`` except its words and phrases."""
+        clauses = ["1"]
+        params: List[object] = []
+        excluded = _fts_query(query.excluded_terms, query.excluded_phrases, "OR")
+        if excluded:
+            clauses.append("seq NOT IN (SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?)")
+            params.append(excluded)
+        for tag in dict.fromkeys(normalize_tag(t) for t in query.tags):
+            clauses.append("seq IN (SELECT note_seq FROM note_tags WHERE tag = ?)")
+            params.append(tag)
+        if query.excluded_tags:
+            wanted = list(dict.fromkeys(normalize_tag(t) for t in query.excluded_tags))
+            placeholders = ", ".join("?" * len(wanted))
+            clauses.append(f"seq NOT IN (SELECT note_seq FROM note_tags WHERE tag IN ({placeholders}))")
+            params.extend(wanted)
+        if query.after is not None:
+            clauses.append("created_at >= ?")
+            params.append(query.after)
+        if query.before is not None:
+            clauses.append("created_at < ?")
+            params.append(query.before)
+        return " AND ".join(clauses), params
+
+    def _ranked(
+        self,
+        match: str,
+        where: str,
+        params: List[object],
+        limit: Optional[int],
+        offset: int,
+        after_id: Optional[str],
+    ) -> Iterator[Note]:
+        """Stream FTS5 matches best first (``bm25()`` is lower for better matches), ties in ``seq`` order."""
+        sql = (
+            f"SELECT {_COLUMNS} FROM notes"
+            " JOIN (SELECT rowid AS hit, bm25(notes_fts) AS score FROM notes_fts WHERE notes_fts MATCH ?)"
+            f" ON hit = seq WHERE {where} ORDER BY score, seq"
+        )
+        params = [match, *params]
+        # A cursor is found by reading the ranking up to it; otherwise page in SQL.
+        if after_id is None and (limit is not None or offset):
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset])
+        with self._lock:
+            self.commit()
+            cursor = self._conn.execute(sql, params)
+        notes = self._fetch(cursor)
+        if after_id is not None:
+            notes = paginate(notes, limit, offset, after_id)
+        yield from notes
+
+    @instrumented("delete")
+    def delete(self, note_id: str) -> bool:
+        return self.delete_many([note_id]) == 1
+
+    @instrumented("delete_many")
+    def delete_many(self, note_ids: Iterable[str]) -> int:
+        with self._transaction():
+            deleted = [note_id for note_id in dict.fromkeys(note_ids) if self._created_at(note_id) is not None]
+            self._apply(dict.fromkeys(deleted))
+        return len(deleted)
+
+    @instrumented("import_notes")
+    def import_notes(self, notes: Iterable[Note], unique_titles: bool = True) -> int:
+        notes = list(notes)
+        with self._transaction():
+            if unique_titles:
+                check_titles(notes, self._title_holders)
+            self._apply({note.id: note for note in notes})
+        return len(notes)
+
+    @instrumented("rebuild_index")
+    def rebuild_index(self) -> int:
+        with self._lock:
+            self.commit()
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute("DELETE FROM notes_fts")
+                self._conn.execute("DELETE FROM note_tags")
+                rows = self._conn.execute(f"SELECT seq, {_COLUMNS} FROM notes").fetchall()
+                for row in rows:
+                    self._index(row[0], _row_to_note(row[1:]))
+        return len(rows)
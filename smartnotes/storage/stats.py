@@ -0,0 +1,171 @@
+"""
+Timings and counters collected by the storage backends.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class OperationTiming(NamedTuple):
+    name: str
+    seconds: float
+
+
+class StorageStats:
+    """Thread-safe timers and counters for one storage instance.
+
+    ``operations`` time the public calls (only the outermost one when they
+    nest, e.g. ``update_note`` over ``update_many``), ``timers`` the phases
+    inside them (file I/O, JSON parsing, ...), ``counters`` plain totals.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # name -> [calls, total seconds, max seconds]
+        self._operations: Dict[str, List[float]] = {}
+        self._timers: Dict[str, List[float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._last: Optional[OperationTiming] = None
+        self._local = threading.local()
+
+    def _record(self, table: Dict[str, List[float]], name: str, seconds: float) -> None:
+        with self._lock:
+            entry = table.get(name)
+            if entry is None:
+                table[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(self._timers, name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """Record a phase timed by the caller, for phases interleaved with others."""
+        self._record(self._timers, name, seconds)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def counter(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def call(self, name: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run ``func`` as operation ``name``, unless another operation is already running on this thread."""
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        if depth:
+            return func(*args, **kwargs)
+        local.depth = 1
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            local.depth = 0
+            self._finish(name, time.perf_counter() - start)
+
+    def iterate(self, name: str, items: Iterable[Any]) -> Iterator[Any]:
+        """Yield from ``items`` as operation ``name``, timing only the time spent producing them."""
+        local = self._local
+        iterator = iter(items)
+        spent = 0.0
+        try:
+            while True:
+                if getattr(local, "depth", 0):
+                    # Consumed inside another operation, which is timed instead.
+                    yield from iterator
+                    return
+                local.depth = 1
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    spent += time.perf_counter() - start
+                    local.depth = 0
+                yield item
+        finally:
+            if spent:
+                self._finish(name, spent)
+
+    def _finish(self, name: str, seconds: float) -> None:
+        timing = OperationTiming(name, seconds)
+        self._local.last = timing
+        self._last = timing
+        self._record(self._operations, name, seconds)
+
+    def last_operation(self) -> Optional[OperationTiming]:
+        """The last operation finished on the calling thread."""
+        return getattr(self._local, "last", None)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._operations.clear()
+            self._timers.clear()
+            self._counters.clear()
+            self._last = None
+
+    def snapshot(self) -> dict:
+        """JSON-ready copy: per name ``calls``/``total_ms``/``mean_ms``/``max_ms``, plus counters."""
+        with self._lock:
+            return {
+                "operations": _summaries(self._operations),
+                "timers": _summaries(self._timers),
+                "counters": dict(sorted(self._counters.items())),
+                "last_operation": None
+                if self._last is None
+                else {"name": self._last.name, "ms": round(self._last.seconds * 1000, 3)},
+            }
+
+
+def _summaries(table: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    return {
+        name: {
+            "calls": int(calls),
+            "total_ms": round(total * 1000, 3),
+            "mean_ms": round(total / calls * 1000, 3),
+            "max_ms": round(longest * 1000, 3),
+        }
+        for name, (calls, total, longest) in sorted(table.items())
+    }
+
+
+def instrumented(name: str, streams: bool = False) -> Callable[[F], F]:
+    """Time a storage method as operation ``name`` in its instance's ``_stats``.
+
+    With ``streams`` the method returns an iterator, which is timed while it
+    produces items rather than while the caller consumes them.
+    """
+
+    def decorate(method: F) -> F:
+        if streams:
+
+            @wraps(method)
+            def iterate(self, *args: Any, **kwargs: Any) -> Iterator[Any]:
+                return self._stats.iterate(name, method(self, *args, **kwargs))
+
+            return iterate  # type: ignore[return-value]
+
+        @wraps(method)
+        def wrapper(self, *args: Any, **kwargs: Any) -> Any:
+            return self._stats.call(name, method, self, *args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
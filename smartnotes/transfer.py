@@ -0,0 +1,92 @@
+"""
+Streaming JSONL/CSV import and export for SmartNotes.
+
+Both formats carry ``id``, ``title``, ``body``, ``tags`` and ``created_at``.
+In CSV the tags are joined with spaces, as in the GUI tags field.
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict
+from pathlib import Path
+from typing import IO, Iterable, Iterator, List, Optional
+
+from .storage.models import Note
+
+FORMATS = ("jsonl", "csv")
+CSV_FIELDS = ["id", "title", "body", "tags", "created_at"]
+
+
+def guess_format(path: Path, fmt: Optional[str] = None) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.suffix.lower() == ".csv" else "jsonl"
+
+
+@contextmanager
+def _open(path: Path, mode: str) -> Iterator[IO[str]]:
+    """Open ``path`` for text I/O, with ``-`` meaning stdin/stdout."""
+    if str(path) == "-":
+        yield sys.stdin if "r" in mode else sys.stdout
+        return
+    with path.open(mode, encoding="utf-8", newline="") as f:
+        yield f
+
+
+def note_from_record(record: dict) -> Note:
+    """Build a note from an imported record; a missing id or date gets a fresh one."""
+    tags = record.get("tags") or []
+    if isinstance(tags, str):
+        tags = tags.split()
+    note = Note(
+        id=record.get("id") or str(uuid.uuid4()),
+        title=record["title"],
+        body=record["body"],
+        tags=list(tags),
+    )
+    if record.get("created_at"):
+        note.created_at = record["created_at"]
+    return note
+
+
+def read_batches(path: Path, fmt: str, batch_size: int) -> Iterator[List[Note]]:
+    """Yield notes from a JSONL/CSV file, never holding more than one batch."""
+    import csv  # only the CSV paths need it; keeps CLI startup light
+
+    batch: List[Note] = []
+    with _open(path, "r") as f:
+        if fmt == "csv":
+            records: Iterable[dict] = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            batch.append(note_from_record(record))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def write_batches(path: Path, fmt: str, batches: Iterable[List[Note]]) -> Iterator[int]:
+    """Write note batches to a JSONL/CSV file, yielding each batch's size once written."""
+    import csv
+
+    with _open(path, "w") as f:
+        writer = None
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+        for batch in batches:
+            for note in batch:
+                record = asdict(note)
+                if writer is not None:
+                    record["tags"] = " ".join(note.tags)
+                    writer.writerow(record)
+                else:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            yield len(batch)